@@ -0,0 +1,109 @@
+# DS Final project
+# Benchmark for hashing a shared directory: the serial path (one file after another) against the parallel pipeline (peer.hashFiles).
+#
+# Usage: python benchmarks/hash_benchmark.py [--small-count 1000] [--small-size 64K] [--large-count 20] [--large-size 2G]
+#                                            [--workers 8] [--drop-caches] [--directory DIR]
+#
+# Two test directories are created: many small files and a few large ones. Both are hashed serially with
+# peer.calculateFileManifest and then with peer.hashFiles, the hash cache is not used in either.
+# Without --drop-caches the files are probably in the page cache after they were written, so the run measures
+# hashing speed (CPU). --drop-caches empties the page cache before every run (needs root on Linux) to measure
+# the disk as well. The large files need large-count * large-size of free disk space.
+
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from relay_benchmark import parseSize, formatSize, UNITS
+
+WRITE_BLOCK = 8 * 1024 * 1024
+
+
+def createFiles(directory, count, size):
+    os.makedirs(directory, exist_ok=True)
+    block = os.urandom(min(size, WRITE_BLOCK)) if size else b""
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"file{index:05d}.bin")
+        with open(path, "wb") as file:
+            written = 0
+            while written < size:
+                written += file.write(block[:size - written])
+        paths.append(path)
+    return paths
+
+
+def dropCaches():
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as file:
+        file.write("3\n")
+
+
+def runSerial(peer, paths):
+    return [peer.calculateFileManifest(path)["hash"] for path in paths]
+
+
+def runParallel(peer, paths, workers):
+    results = {}
+    for path, manifest, error in peer.hashFiles(paths, peer.calculateFileManifest, workers, cached=None):
+        if error is not None:
+            raise error
+        results[path] = manifest["hash"]
+    return [results[path] for path in paths]
+
+
+def measure(label, function, dropPageCache):
+    if dropPageCache:
+        dropCaches()
+    start = time.perf_counter()
+    cpuStart = time.process_time()
+    result = function()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpuStart
+    return label, elapsed, cpu, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial against parallel hashing of a shared directory.")
+    parser.add_argument("--small-count", type=int, default=1000, help="Number of small files")
+    parser.add_argument("--small-size", default="64K", help="Size of each small file")
+    parser.add_argument("--large-count", type=int, default=20, help="Number of large files")
+    parser.add_argument("--large-size", default="2G", help="Size of each large file")
+    parser.add_argument("--workers", type=int, default=None, help="Worker threads of the pipeline, default peer.HASH_WORKERS")
+    parser.add_argument("--drop-caches", action="store_true", help="Empty the page cache before every run (Linux, root)")
+    parser.add_argument("--directory", default=None, help="Where the test files are written, default a temporary directory")
+    args = parser.parse_args()
+
+    import peer
+    workers = args.workers or peer.HASH_WORKERS
+    root = tempfile.mkdtemp(prefix="hash_benchmark_", dir=args.directory)
+    try:
+        sets = [
+            (f"{args.small_count} x {formatSize(parseSize(args.small_size))}", args.small_count, parseSize(args.small_size)),
+            (f"{args.large_count} x {formatSize(parseSize(args.large_size))}", args.large_count, parseSize(args.large_size)),
+        ]
+        print(f"Hashing with {workers} worker(s), page cache {'dropped' if args.drop_caches else 'warm'}")
+        print(f"{'files':>16} {'mode':>9} {'wall':>9} {'cpu':>9} {'MB/s':>9} {'speedup':>8}")
+        for index, (label, count, size) in enumerate(sets):
+            if count == 0:
+                continue
+            paths = createFiles(os.path.join(root, f"set{index}"), count, size)
+            serial = measure("serial", lambda: runSerial(peer, paths), args.drop_caches)
+            parallel = measure("parallel", lambda: runParallel(peer, paths, workers), args.drop_caches)
+            if serial[3] != parallel[3]:
+                raise SystemExit("The pipeline returned different hashes than the serial path")
+            for mode, elapsed, cpu, _ in (serial, parallel):
+                print(f"{label:>16} {mode:>9} {elapsed:>7.2f} s {cpu:>7.2f} s {count * size / elapsed / UNITS['M']:>9.1f} "
+                      f"{serial[1] / elapsed:>7.2f}x")
+            shutil.rmtree(os.path.join(root, f"set{index}"))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
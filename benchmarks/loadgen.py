@@ -0,0 +1,638 @@
+# DS Final project
+# Load generator and benchmark suite for the tracker server: synthetic headless clients that speak the real protocol.
+#
+# Usage: python benchmarks/loadgen.py [--scenarios register,sync,download,slow] [--clients 50] [--files 2000]
+#                                     [--output results.json] [--compare baseline.json]
+#
+# Every scenario starts its own tracker_server.py on loopback, so the tracker's peak RSS and CPU time belong to that
+# scenario only. The clients run in threads of this process and need no GUI, no shared folder and no network.
+#   register  Clients connect and share many files with ANNOUNCE and UPLOADREQUEST, then search the catalog.
+#   sync      A large catalog is synced by every client at once (a reconnect storm), then a publisher keeps adding files
+#             and the time until each change reaches every subscriber is measured.
+#   download  A seeder shares small and large files and downloaders fetch them all concurrently through the relay.
+#   slow      The sync and download load of the other scenarios while slow peers never read their notifications
+#             and download at a crawl. The normal clients' latencies should stay where they are without the slow peers.
+#
+# The results are printed as a table and written as JSON (--output), together with the git commit they were measured
+# on. --compare prints the change against an earlier result file, so regressions show up between commits.
+
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import protocol
+from protocol import FrameReader, sendFrame
+from relay_benchmark import parseSize, UNITS
+
+SCENARIOS = ("register", "sync", "download", "slow")
+REQUEST_TIMEOUT = 60 # Seconds a synthetic client waits for a reply before the request counts as an error
+STARTUP_TIMEOUT = 10 # Seconds the tracker has to start listening
+PIECE_SIZE = 256 * 1024
+SEND_BLOCK = 1024 * 1024
+SEARCH_WORDS = ("report", "holiday", "photo", "backup", "notes", "music", "video", "draft", "final", "data")
+
+
+# Returns the value at the given percentile (0-100) of a sorted list, nearest-rank
+def percentile(values, percent):
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def freePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def fakeHash(*parts):
+    return hashlib.sha256("/".join(map(str, parts)).encode()).hexdigest()
+
+
+class Recorder:
+    '''Latencies of every operation of a scenario, by operation name. Used from many client threads at once.'''
+
+    def __init__(self):
+        self.latencies = {} # In the form: operation: [seconds, ...]
+        self.bytes = {} # In the form: operation: bytes moved
+        self.errors = {} # In the form: operation: count
+        self.lock = threading.Lock()
+
+    def add(self, operation, seconds, size=0):
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            if size:
+                self.bytes[operation] = self.bytes.get(operation, 0) + size
+
+    def error(self, operation, reason):
+        with self.lock:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+            if self.errors[operation] <= 3:
+                print(f"  {operation} failed: {reason}", file=sys.stderr)
+
+    # Summary of every operation. duration is the wall time of the phase the operation ran in.
+    def summary(self, durations):
+        operations = {}
+        for operation, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            duration = durations.get(operation) or sum(values)
+            row = {
+                "count": len(values),
+                "errors": self.errors.get(operation, 0),
+                "perS": len(values) / duration if duration else None,
+                "p50Ms": percentile(values, 50) * 1000,
+                "p99Ms": percentile(values, 99) * 1000,
+                "maxMs": values[-1] * 1000,
+            }
+            if operation in self.bytes:
+                row["mbPerS"] = self.bytes[operation] / duration / UNITS["M"] if duration else None
+            operations[operation] = row
+        for operation, count in self.errors.items():
+            operations.setdefault(operation, {"count": 0, "errors": count})
+        return operations
+
+
+class LoadClient:
+    '''
+    A headless client: the control connection, the nickname handshake and a listener thread that hands replies to
+    the waiting request and handles the pushes. A client that seeds files answers FILESENDREQUEST with zero-filled
+    synthetic data, so no files are needed on disk.
+    '''
+
+    def __init__(self, address, nickname, recorder, receiveBuffer=None, listen=True):
+        self.address = address
+        self.nickname = nickname
+        self.recorder = recorder
+        started = time.perf_counter()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if receiveBuffer:
+            # A small receive window makes the tracker's writes to this client block as soon as it stops reading
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receiveBuffer)
+        self.sock.connect(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = FrameReader(self.sock)
+        self.sendLock = threading.Lock()
+        self.requestIds = itertools.count(1)
+        self.pending = {} # In the form: requestId: queue the reply is put in
+        self.pendingLock = threading.Lock()
+        self.transferQueue = queue.Queue() # TRANSFER messages of this client's relayed downloads
+        self.shared = {} # In the form: hash: size of the synthetic files this client seeds
+        self.version = None
+        self.arrivals = {} # In the form: round: time the first file of that publishing round arrived in a SYNC
+        self.alive = True
+        self.closed = False
+        sendFrame(self.sock, protocol.NICKNAME, {"nickname": nickname})
+        reply = self.reader.readFrame()
+        if reply is None or reply.type != protocol.NICKNAMESTATUS or not reply.body["valid"]:
+            raise RuntimeError(f"Nickname {nickname} was not accepted")
+        recorder.add("connect", time.perf_counter() - started)
+        if listen:
+            threading.Thread(target=self.listen, daemon=True).start()
+
+    def send(self, type, body=None, requestId=0):
+        sendFrame(self.sock, type, body, requestId, self.sendLock)
+
+    # Sends a request and returns (reply frame, seconds it took), or (None, None) if no reply came
+    def request(self, operation, type, body=None, timeout=REQUEST_TIMEOUT):
+        requestId = next(self.requestIds)
+        replies = queue.Queue()
+        with self.pendingLock:
+            self.pending[requestId] = replies
+        started = time.perf_counter()
+        try:
+            self.send(type, body, requestId)
+            frame = replies.get(timeout=timeout)
+        except (OSError, queue.Empty) as e:
+            self.recorder.error(operation, repr(e) or "timeout")
+            return None, None
+        finally:
+            with self.pendingLock:
+                self.pending.pop(requestId, None)
+        elapsed = time.perf_counter() - started
+        if frame.type == protocol.ERROR:
+            self.recorder.error(operation, frame.body.get("message"))
+            return None, None
+        self.recorder.add(operation, elapsed)
+        return frame, elapsed
+
+    def listen(self):
+        try:
+            while True:
+                frame = self.reader.readFrame()
+                if frame is None:
+                    break
+                with self.pendingLock:
+                    replies = self.pending.get(frame.requestId) if frame.requestId else None
+                if replies is not None:
+                    replies.put(frame)
+                elif frame.type == protocol.SYNC:
+                    self.applySync(frame.body)
+                elif frame.type == protocol.TRANSFER:
+                    self.transferQueue.put(frame.body)
+                elif frame.type == protocol.FILESENDREQUEST:
+                    threading.Thread(target=self.upload, args=(frame.body,), daemon=True).start()
+        except (OSError, protocol.ProtocolError):
+            pass
+        finally:
+            self.alive = False
+
+    # Records when each publishing round first reached this client. Published files are named "r<round>-...".
+    def applySync(self, message):
+        now = time.perf_counter()
+        self.version = message["version"]
+        for data in message["added"]:
+            name = data["fileName"]
+            if name.startswith("r") and "-" in name:
+                self.arrivals.setdefault(int(name[1:name.index("-")]), now)
+
+    # Builds the records of count synthetic files
+    def makeFiles(self, count, size=1024, prefix=None):
+        files = []
+        for index in range(count):
+            word = random.choice(SEARCH_WORDS)
+            name = f"{prefix}-{index}.bin" if prefix else f"{self.nickname}_{word}_{index}.txt"
+            files.append({"fileName": name, "hash": fakeHash(self.nickname, prefix, index), "size": size,
+                          "pieceSize": PIECE_SIZE, "root": ""})
+        return files
+
+    def announce(self, files, operation="announce"):
+        for data in files:
+            self.shared[data["hash"]] = data["size"]
+        return self.request(operation, protocol.ANNOUNCE, {"files": files})
+
+    # Sends a relayed file over a data channel of its own, the way peer.sendRelayedFile does
+    def upload(self, message):
+        size = self.shared.get(message["hash"])
+        if size is None:
+            return
+        offset = message.get("offset", 0)
+        try:
+            with socket.create_connection(self.address) as channel:
+                sendFrame(channel, protocol.DATACHANNEL, {"transfer": message["transfer"], "token": message["token"], "role": "upload"})
+                sendFrame(channel, protocol.FILE, {"hash": message["hash"], "offset": offset, "length": size - offset})
+                block = memoryview(bytes(SEND_BLOCK))
+                remaining = size - offset
+                while remaining:
+                    remaining -= channel.send(block[:min(SEND_BLOCK, remaining)])
+                channel.shutdown(socket.SHUT_WR)
+                channel.recv(1) # Waits until the tracker has relayed everything and closes the channel
+        except OSError as e:
+            if not self.closed: # Uploads to slow downloaders are still running when the scenario ends
+                self.recorder.error("upload", repr(e))
+
+    # Downloads one file through the relay. rate limits the reading to that many bytes per second.
+    def download(self, operation, fileHash, size, rate=None):
+        started = time.perf_counter()
+        requestId = next(self.requestIds)
+        with self.pendingLock:
+            self.pending[requestId] = self.transferQueue # An ERROR reply ends the wait as well
+        try:
+            self.send(protocol.DOWNLOADREQUEST, {"hash": fileHash, "offset": 0, "codecs": []}, requestId)
+            message = self.transferQueue.get(timeout=REQUEST_TIMEOUT)
+            if isinstance(message, protocol.Frame):
+                raise RuntimeError(message.body.get("message"))
+            with socket.create_connection(self.address) as channel:
+                if rate:
+                    channel.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+                sendFrame(channel, protocol.DATACHANNEL, {"transfer": message["transfer"], "token": message["token"], "role": "download"})
+                reader = FrameReader(channel)
+                header = reader.readFrame()
+                if header is None or header.type != protocol.FILE:
+                    raise RuntimeError("No FILE header on the data channel")
+                firstByte = time.perf_counter()
+                received = self.receive(reader, header.body["length"], rate)
+            if received != size:
+                raise RuntimeError(f"Received {received} of {size} bytes")
+        except (OSError, queue.Empty, RuntimeError, protocol.ProtocolError) as e:
+            self.recorder.error(operation, repr(e))
+            return
+        finally:
+            with self.pendingLock:
+                self.pending.pop(requestId, None)
+        self.recorder.add(operation, time.perf_counter() - started, size)
+        self.recorder.add(operation + "-first-byte", firstByte - started)
+
+    @staticmethod
+    def receive(reader, length, rate=None):
+        buffer = bytearray(min(SEND_BLOCK, max(length, 1)))
+        view = memoryview(buffer)
+        received = 0
+        started = time.perf_counter()
+        while received < length:
+            count = reader.recvInto(view, min(len(buffer), length - received, rate or len(buffer)))
+            if count == 0:
+                break
+            received += count
+            if rate:
+                ahead = received / rate - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        return received
+
+    def close(self):
+        self.closed = True
+        try:
+            self.send(protocol.DISCONNECT)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class Tracker:
+    '''tracker_server.py in a process of its own, on loopback ports nobody else uses.'''
+
+    def __init__(self, logPath=None):
+        self.port = freePort()
+        self.statsPort = freePort()
+        self.log = open(logPath, "a") if logPath else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO, "tracker_server.py"), "--host", "127.0.0.1", "--port", str(self.port),
+             "--stats-port", str(self.statsPort)],
+            stdout=self.log, stderr=subprocess.STDOUT, cwd=REPO)
+        self.address = ("127.0.0.1", self.port)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                socket.create_connection(self.address, timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.process.kill()
+                    raise RuntimeError("The tracker did not start")
+                time.sleep(0.05)
+
+    # Peak RSS and CPU time of the tracker process so far, from /proc
+    def usage(self):
+        with open(f"/proc/{self.process.pid}/status") as file:
+            status = dict(line.split(":", 1) for line in file if ":" in line)
+        with open(f"/proc/{self.process.pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        return {
+            "peakRssMb": int(status["VmHWM"].split()[0]) / 1024,
+            "cpuS": (int(fields[11]) + int(fields[12])) / ticks,
+        }
+
+    # The tracker's own metrics (see metrics.py), without the histogram buckets
+    def stats(self):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{self.statsPort}/metrics", timeout=5) as response:
+                text = response.read().decode()
+        except OSError:
+            return {}
+        values = {}
+        for line in text.splitlines():
+            if line and not line.startswith("#") and "_bucket" not in line:
+                name, value = line.rsplit(" ", 1)
+                values[name] = float(value)
+        return values
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        if self.log is not subprocess.DEVNULL:
+            self.log.close()
+
+
+# Runs function(index) in count threads at once and returns the wall time until all of them are done
+def runParallel(count, function):
+    errors = []
+
+    def run(index):
+        try:
+            function(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        print(f"  {len(errors)} client thread(s) failed, first: {errors[0]!r}", file=sys.stderr)
+    return time.perf_counter() - started
+
+
+def connectClients(tracker, recorder, count, prefix, **options):
+    clients = [None] * count
+
+    def connect(index):
+        clients[index] = LoadClient(tracker.address, f"{prefix}{index}", recorder, **options)
+
+    runParallel(count, connect)
+    return [client for client in clients if client is not None]
+
+
+# Publishes rounds of new files from one client and records how long each round took to reach every subscriber
+def publishRounds(publisher, subscribers, recorder, rounds, batch, interval):
+    published = {}
+    for round in range(rounds):
+        published[round] = time.perf_counter()
+        publisher.announce(publisher.makeFiles(batch, prefix=f"r{round}"), "publish")
+        time.sleep(interval)
+    deadline = time.perf_counter() + REQUEST_TIMEOUT
+    for client in subscribers:
+        while len(client.arrivals) < rounds and client.alive and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        for round, sent in published.items():
+            if round in client.arrivals:
+                recorder.add("propagate", client.arrivals[round] - sent)
+            else:
+                recorder.error("propagate", f"round {round} never reached {client.nickname}")
+
+
+def scenarioRegister(tracker, recorder, args):
+    durations = {}
+    started = time.perf_counter()
+    clients = connectClients(tracker, recorder, args.clients, "reg")
+    durations["connect"] = time.perf_counter() - started
+
+    def share(index):
+        client = clients[index]
+        files = client.makeFiles(args.files)
+        for start in range(0, len(files), args.batch):
+            client.announce(files[start:start + args.batch])
+        for data in client.makeFiles(args.uploads, prefix="single"):
+            client.shared[data["hash"]] = data["size"]
+            client.request("upload-request", protocol.UPLOADREQUEST, {"owner": client.nickname, **data})
+
+    durations["announce"] = durations["upload-request"] = runParallel(len(clients), share)
+
+    def search(index):
+        for _ in range(args.searches):
+            clients[index].request("search", protocol.SEARCH, {"query": random.choice(SEARCH_WORDS), "limit": 50, "cursor": None})
+
+    durations["search"] = runParallel(len(clients), search)
+    registered = len(clients) * (args.files + args.uploads)
+    extra = {"filesRegistered": registered, "filesPerS": registered / durations["announce"]}
+    return clients, durations, extra
+
+
+def scenarioSync(tracker, recorder, args):
+    durations = {}
+    publisher = LoadClient(tracker.address, "publisher", recorder)
+    files = publisher.makeFiles(args.files * 4, prefix="catalog")
+    for start in range(0, len(files), args.batch):
+        publisher.announce(files[start:start + args.batch], "preload")
+    subscribers = connectClients(tracker, recorder, args.clients, "sub")
+
+    # Every client asks for the whole catalog at once, like after the tracker restarts
+    durations["snapshot"] = runParallel(len(subscribers), lambda index: subscribers[index].request(
+        "snapshot", protocol.SYNCREQUEST, {"version": None}))
+    started = time.perf_counter()
+    publishRounds(publisher, subscribers, recorder, args.rounds, args.batch, args.interval)
+    durations["propagate"] = durations["publish"] = time.perf_counter() - started
+    return subscribers + [publisher], durations, {"catalogFiles": len(files)}
+
+
+def seedFiles(tracker, recorder, args):
+    seeder = LoadClient(tracker.address, "seeder", recorder)
+    small = seeder.makeFiles(args.small_count, args.small_size, "small")
+    large = seeder.makeFiles(args.large_count, args.large_size, "large")
+    seeder.announce(small + large, "preload")
+    return seeder, small, large
+
+
+# Downloads every file once, count downloaders at a time, each with one download in progress
+def downloadAll(downloaders, files, operation):
+    work = queue.Queue()
+    for data in files:
+        work.put(data)
+
+    def fetch(index):
+        while True:
+            try:
+                data = work.get_nowait()
+            except queue.Empty:
+                return
+            downloaders[index].download(operation, data["hash"], data["size"])
+
+    return runParallel(len(downloaders), fetch)
+
+
+def scenarioDownload(tracker, recorder, args):
+    durations = {}
+    seeder, small, large = seedFiles(tracker, recorder, args)
+    downloaders = connectClients(tracker, recorder, args.downloaders, "dl")
+    durations["download-small"] = durations["download-small-first-byte"] = downloadAll(downloaders, small, "download-small")
+    durations["download-large"] = durations["download-large-first-byte"] = downloadAll(downloaders, large, "download-large")
+    return downloaders + [seeder], durations, {}
+
+
+def scenarioSlow(tracker, recorder, args):
+    durations = {}
+    seeder, small, large = seedFiles(tracker, recorder, args)
+    publisher = LoadClient(tracker.address, "publisher", recorder)
+    subscribers = connectClients(tracker, recorder, args.clients, "sub")
+    for client in subscribers:
+        client.request("snapshot", protocol.SYNCREQUEST, {"version": None})
+
+    # Slow subscribers ask for notifications and then never read them
+    slowRecorder = Recorder()
+    slowSubscribers = connectClients(tracker, slowRecorder, args.slow_clients, "stalled", receiveBuffer=4096, listen=False)
+    for client in slowSubscribers:
+        client.send(protocol.SYNCREQUEST, {"version": None}, 1)
+    # Slow downloaders fetch the large files at a crawl the whole time
+    slowDownloaders = connectClients(tracker, slowRecorder, args.slow_clients, "crawler")
+    for index, client in enumerate(slowDownloaders):
+        data = large[index % len(large)] if large else small[index % len(small)]
+        threading.Thread(target=client.download, args=("slow-download", data["hash"], data["size"], args.slow_rate), daemon=True).start()
+
+    downloaders = connectClients(tracker, recorder, args.downloaders, "dl")
+    started = time.perf_counter()
+    fetching = threading.Thread(target=downloadAll, args=(downloaders, small, "download-small"))
+    fetching.start()
+    publishRounds(publisher, subscribers, recorder, args.rounds, args.batch, args.interval)
+    durations["propagate"] = durations["publish"] = time.perf_counter() - started
+    fetching.join()
+    durations["download-small"] = durations["download-small-first-byte"] = time.perf_counter() - started
+    stats = tracker.stats()
+    extra = {"slowPeers": len(slowSubscribers) + len(slowDownloaders),
+             "connectionsLeft": stats.get("tracker_connections"),
+             "sendQueueBytes": stats.get("tracker_send_queue_bytes")}
+    for client in slowSubscribers + slowDownloaders:
+        client.sock.close()
+    return subscribers + downloaders + [publisher, seeder], durations, extra
+
+
+def runScenario(name, args):
+    recorder = Recorder()
+    tracker = Tracker(args.tracker_log)
+    cpuStart = time.process_time()
+    started = time.perf_counter()
+    clients = []
+    try:
+        clients, durations, extra = globals()["scenario" + name.capitalize()](tracker, recorder, args)
+        elapsed = time.perf_counter() - started
+        result = {
+            "scenario": name,
+            "durationS": elapsed,
+            "operations": recorder.summary(durations),
+            "tracker": tracker.usage(),
+            "trackerMetrics": {key: value for key, value in tracker.stats().items()
+                               if key.startswith(("tracker_messages_total", "tracker_transfers_total", "tracker_relay_bytes_total"))},
+            "loadgen": {"cpuS": time.process_time() - cpuStart,
+                        "peakRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024},
+            **extra,
+        }
+    finally:
+        for client in clients:
+            client.close()
+        tracker.stop()
+    return result
+
+
+def printResult(result):
+    tracker = result["tracker"]
+    print(f"{result['scenario']}: {result['durationS']:.2f} s, tracker peak RSS {tracker['peakRssMb']:.1f} MB, "
+          f"tracker CPU {tracker['cpuS']:.2f} s, load generator CPU {result['loadgen']['cpuS']:.2f} s")
+    print(f"  {'operation':<26} {'count':>7} {'errors':>6} {'per s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'MB/s':>8}")
+    for operation, row in result["operations"].items():
+        if not row["count"]:
+            print(f"  {operation:<26} {0:>7} {row['errors']:>6}")
+            continue
+        speed = f"{row['mbPerS']:>8.1f}" if row.get("mbPerS") is not None else ""
+        print(f"  {operation:<26} {row['count']:>7} {row['errors']:>6} {row['perS']:>9.1f} {row['p50Ms']:>9.2f} "
+              f"{row['p99Ms']:>9.2f} {row['maxMs']:>9.2f} {speed}")
+
+
+# Prints the change of every latency and throughput against an earlier result file
+def compare(results, baselinePath):
+    with open(baselinePath) as file:
+        baseline = {result["scenario"]: result for result in json.load(file)["results"]}
+    print(f"\nChange against {baselinePath}:")
+    for result in results:
+        old = baseline.get(result["scenario"])
+        if old is None:
+            continue
+        for operation, row in result["operations"].items():
+            oldRow = old["operations"].get(operation)
+            if not oldRow or not row["count"] or not oldRow["count"]:
+                continue
+            changes = []
+            for key in ("p50Ms", "p99Ms", "mbPerS"):
+                if row.get(key) and oldRow.get(key):
+                    changes.append(f"{key} {(row[key] - oldRow[key]) / oldRow[key] * 100:+.1f}%")
+            print(f"  {result['scenario']}/{operation}: {', '.join(changes)}")
+        for key in ("peakRssMb", "cpuS"):
+            print(f"  {result['scenario']}/tracker {key}: {old['tracker'][key]:.2f} -> {result['tracker'][key]:.2f}")
+
+
+def gitCommit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the tracker server with synthetic headless clients.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios: " + ", ".join(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=50, help="Clients that share files or subscribe to the catalog")
+    parser.add_argument("--files", type=int, default=2000, help="Files every client shares in the register scenario")
+    parser.add_argument("--batch", type=int, default=100, help="Files per ANNOUNCE message")
+    parser.add_argument("--uploads", type=int, default=20, help="Files every client shares one by one with UPLOADREQUEST")
+    parser.add_argument("--searches", type=int, default=20, help="Searches of every client in the register scenario")
+    parser.add_argument("--rounds", type=int, default=20, help="Batches of files published while the clients are subscribed")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between two published batches")
+    parser.add_argument("--downloaders", type=int, default=8, help="Clients downloading at the same time")
+    parser.add_argument("--small-size", default="64K", help="Size of the small files")
+    parser.add_argument("--small-count", type=int, default=200, help="Number of small files")
+    parser.add_argument("--large-size", default="64M", help="Size of the large files")
+    parser.add_argument("--large-count", type=int, default=4, help="Number of large files")
+    parser.add_argument("--slow-clients", type=int, default=10, help="Slow subscribers and slow downloaders in the slow scenario, each")
+    parser.add_argument("--slow-rate", default="64K", help="Bytes per second a slow downloader reads")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the random file names and search words")
+    parser.add_argument("--tracker-log", help="Append the tracker's output to this file instead of discarding it")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="FILE", help="Print the change against the results in an earlier --output file")
+    args = parser.parse_args()
+    args.small_size = parseSize(args.small_size)
+    args.large_size = parseSize(args.large_size)
+    args.slow_rate = parseSize(args.slow_rate)
+    random.seed(args.seed)
+
+    results = []
+    for name in args.scenarios.split(","):
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario {name}")
+        print(f"Running {name}...", flush=True)
+        result = runScenario(name, args)
+        printResult(result)
+        results.append(result)
+
+    if args.output:
+        parameters = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tracker_log")}
+        with open(args.output, "w") as file:
+            json.dump({"commit": gitCommit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": sys.version.split()[0],
+                       "cpus": os.cpu_count(), "parameters": parameters, "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
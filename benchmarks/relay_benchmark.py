@@ -0,0 +1,162 @@
+# DS Final project
+# Benchmark for the tracker's file relay (relay.py).
+#
+# Usage: python benchmarks/relay_benchmark.py [--sizes 10M,1G,10G] [--modes splice,copy,async,buffered]
+#
+# Every run happens in its own process so that the reported peak RSS belongs to that run only.
+# An uploader thread streams the file over loopback TCP to the relay, the relay forwards it to a
+# downloader thread, and the downloader measures time-to-first-byte and the end-to-end time.
+# "async" is relay.relayStreamAsync on an asyncio event loop, the way the tracker server runs it.
+# "buffered" is the old behaviour of tracker_server.handle (collect the whole file, then send it)
+# and is skipped for files that do not fit in memory.
+
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import relay
+
+SEND_BLOCK = 1024 * 1024
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parseSize(text):
+    text = text.strip().upper().rstrip("B")
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def formatSize(size):
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f"{size // UNITS[unit]} {unit}B"
+    return f"{size} B"
+
+
+# The old tracker relay: every packet of the file is collected before anything is forwarded
+def bufferedStream(source, destination):
+    chunkList = []
+    packet = source.recv(1024)
+    while packet:
+        chunkList.append(packet)
+        packet = source.recv(1024)
+    for chunk in chunkList:
+        destination.sendall(chunk)
+    return sum(len(chunk) for chunk in chunkList)
+
+
+def uploader(sock, size):
+    block = memoryview(bytes(SEND_BLOCK))
+    remaining = size
+    while remaining:
+        sent = sock.send(block[:min(SEND_BLOCK, remaining)])
+        remaining -= sent
+    sock.shutdown(socket.SHUT_WR)
+
+
+def downloader(sock, result):
+    buffer = bytearray(SEND_BLOCK)
+    received = sock.recv_into(buffer)
+    result["firstByte"] = time.perf_counter()
+    total = received
+    while received:
+        received = sock.recv_into(buffer)
+        total += received
+    result["done"] = time.perf_counter()
+    result["received"] = total
+
+
+# Runs a single relay of the given size and prints the result as one JSON line
+def runOnce(size, mode):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(2)
+    address = listener.getsockname()
+
+    uploadSocket = socket.create_connection(address)
+    relaySource, _ = listener.accept()
+    downloadSocket = socket.create_connection(address)
+    relayDestination, _ = listener.accept()
+    listener.close()
+
+    result = {}
+    downloaderThread = threading.Thread(target=downloader, args=(downloadSocket, result))
+    downloaderThread.start()
+    start = time.perf_counter()
+    uploaderThread = threading.Thread(target=uploader, args=(uploadSocket, size))
+    uploaderThread.start()
+
+    cpuStart = time.process_time()
+    if mode == "buffered":
+        relayed = bufferedStream(relaySource, relayDestination)
+    elif mode == "copy":
+        relayed = relay.copyStream(relaySource, relayDestination)
+    elif mode == "async":
+        relaySource.setblocking(False)
+        relayDestination.setblocking(False)
+        relayed = asyncio.run(relay.relayStreamAsync(relaySource, relayDestination))
+        relayDestination.setblocking(True)
+    else:
+        relayed = relay.relayStream(relaySource, relayDestination)
+    relayDestination.shutdown(socket.SHUT_WR)
+    uploaderThread.join()
+    downloaderThread.join()
+    cpu = time.process_time() - cpuStart
+
+    for sock in (uploadSocket, relaySource, downloadSocket, relayDestination):
+        sock.close()
+
+    elapsed = result["done"] - start
+    print(json.dumps({
+        "mode": mode,
+        "size": size,
+        "relayed": relayed,
+        "received": result["received"],
+        "firstByteMs": (result["firstByte"] - start) * 1000,
+        "totalS": elapsed,
+        "mbPerS": size / elapsed / UNITS["M"],
+        "cpuS": cpu,
+        "peakRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker file relay.")
+    parser.add_argument("--sizes", default="10M,1G,10G", help="Comma separated file sizes, e.g. 10M,1G,10G")
+    parser.add_argument("--modes", default="splice,copy,async,buffered", help="Comma separated relay modes: splice, copy, async, buffered")
+    parser.add_argument("--buffered-limit", default="1G", help="Largest size the buffered mode is run for")
+    parser.add_argument("--single", nargs=2, metavar=("SIZE", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        runOnce(int(args.single[0]), args.single[1])
+        return
+
+    bufferedLimit = parseSize(args.buffered_limit)
+    print(f"{'size':>8} {'mode':>9} {'first byte':>12} {'total':>10} {'MB/s':>9} {'cpu':>8} {'peak RSS':>10}")
+    for size in [parseSize(text) for text in args.sizes.split(",")]:
+        for mode in args.modes.split(","):
+            if mode == "splice" and not hasattr(os, "splice"):
+                continue
+            if mode == "buffered" and size > bufferedLimit:
+                print(f"{formatSize(size):>8} {mode:>9} {'skipped (does not fit in memory)':>40}")
+                continue
+            output = subprocess.run([sys.executable, __file__, "--single", str(size), mode],
+                                    capture_output=True, text=True, check=True).stdout
+            row = json.loads(output)
+            print(f"{formatSize(size):>8} {mode:>9} {row['firstByteMs']:>9.2f} ms {row['totalS']:>8.2f} s "
+                  f"{row['mbPerS']:>9.1f} {row['cpuS']:>6.2f} s {row['peakRssMb']:>7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# DS Final project
+# Benchmark for the file sender (peer.sendFileRange) against the old 1 kB send loop.
+#
+# Usage: python benchmarks/sender_benchmark.py [--size 512M] [--modes legacy,readinto,sendfile] [--chunk-size 256K]
+#
+# A temporary file is sent over a loopback TCP connection to a receiver thread that throws the data away.
+# Every mode runs in its own process. The CPU time is the sending thread's own CPU time.
+# "legacy" is the old divideFileIntoChunksAndSendChunks loop: 1 kB reads, unchecked send() and a printed line per chunk
+# (the lines go to /dev/null so the terminal speed does not count).
+
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from relay_benchmark import parseSize, formatSize, UNITS
+
+
+# The sender as it was before: 1 kB at a time and one printed line per chunk
+def legacySend(client, filePath, output):
+    with open(filePath, "rb") as file:
+        chunk = 0
+        byte = file.read(1024)
+        while byte:
+            print("Sending chunk", chunk, file=output)
+            client.send(byte)
+            byte = file.read(1024)
+            chunk += 1
+
+
+def receiver(sock, result):
+    buffer = bytearray(1024 * 1024)
+    total = 0
+    received = sock.recv_into(buffer)
+    while received:
+        total += received
+        received = sock.recv_into(buffer)
+    result["received"] = total
+
+
+def runOnce(filePath, mode, chunkSize):
+    import peer
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    sender = socket.create_connection(listener.getsockname())
+    receiving, _ = listener.accept()
+    listener.close()
+
+    result = {}
+    receiverThread = threading.Thread(target=receiver, args=(receiving, result))
+    receiverThread.start()
+
+    size = os.path.getsize(filePath)
+    start = time.perf_counter()
+    cpuStart = time.thread_time()
+    if mode == "legacy":
+        with open(os.devnull, "w") as output:
+            legacySend(sender, filePath, output)
+    else:
+        peer.sendFileRange(sender, filePath, 0, size, chunkSize, zeroCopy=(mode == "sendfile"))
+    cpu = time.thread_time() - cpuStart
+    sender.shutdown(socket.SHUT_WR)
+    receiverThread.join()
+    elapsed = time.perf_counter() - start
+    sender.close()
+    receiving.close()
+
+    print(json.dumps({
+        "mode": mode,
+        "size": size,
+        "received": result["received"],
+        "totalS": elapsed,
+        "mbPerS": size / elapsed / UNITS["M"],
+        "senderCpuS": cpu,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the file sender against the old 1 kB send loop.")
+    parser.add_argument("--size", default="512M", help="Size of the test file, e.g. 512M or 2G")
+    parser.add_argument("--modes", default="legacy,readinto,sendfile", help="Comma separated modes: legacy, readinto, sendfile")
+    parser.add_argument("--chunk-size", default="256K", help="Block size of the readinto mode")
+    parser.add_argument("--single", nargs=3, metavar=("FILE", "MODE", "CHUNK"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        runOnce(args.single[0], args.single[1], int(args.single[2]))
+        return
+
+    size = parseSize(args.size)
+    chunkSize = parseSize(args.chunk_size)
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        block = os.urandom(UNITS["M"])
+        written = 0
+        while written < size:
+            written += file.write(block[:size - written])
+        filePath = file.name
+    try:
+        print(f"Sending {formatSize(size)} over loopback")
+        print(f"{'mode':>9} {'total':>9} {'MB/s':>9} {'sender cpu':>11}")
+        for mode in args.modes.split(","):
+            if mode == "sendfile" and not hasattr(os, "sendfile"):
+                continue
+            output = subprocess.run([sys.executable, __file__, "--single", filePath, mode, str(chunkSize)],
+                                    capture_output=True, text=True, check=True).stdout
+            row = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>9} {row['totalS']:>7.2f} s {row['mbPerS']:>9.1f} {row['senderCpuS']:>9.2f} s")
+    finally:
+        os.remove(filePath)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# DS Final project
+# Benchmark for the consistent hash ring of the multi-tracker mode (sharding.HashRing): how many keys move when a
+# tracker joins, how evenly the keys are spread and how fast owner() is.
+#
+# Usage: python benchmarks/shard_benchmark.py [--keys 200000] [--trackers 1,2,4,8,16] [--virtual-nodes 128]
+#
+# For every cluster size N the ring of N trackers is compared with the ring after one more tracker has joined.
+# Consistent hashing should move about 1/(N+1) of the keys, all of them to the new tracker. The spread is the
+# share of the busiest tracker divided by the fair share 1/(N+1), 1.00 is perfectly even.
+
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sharding import HashRing, VIRTUAL_NODES
+
+
+def trackerAddress(index):
+    return f"10.0.{index // 256}.{index % 256}:12345"
+
+
+def measure(keys, count, virtualNodes):
+    ring = HashRing([trackerAddress(index) for index in range(count)], virtualNodes)
+    before = [ring.owner(key) for key in keys]
+    newTracker = trackerAddress(count)
+    ring.add(newTracker)
+    start = time.perf_counter()
+    after = [ring.owner(key) for key in keys]
+    lookup = (time.perf_counter() - start) / len(keys)
+    moved = [new for old, new in zip(before, after) if old != new]
+    shares = {}
+    for owner in after:
+        shares[owner] = shares.get(owner, 0) + 1
+    spread = max(shares.values()) / (len(keys) / (count + 1))
+    return len(moved) / len(keys), all(owner == newTracker for owner in moved), spread, lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure key movement and balance of the consistent hash ring.")
+    parser.add_argument("--keys", type=int, default=200000, help="File hashes to place on the ring")
+    parser.add_argument("--trackers", default="1,2,4,8,16", help="Cluster sizes before one more tracker joins")
+    parser.add_argument("--virtual-nodes", type=int, default=VIRTUAL_NODES, help="Points per tracker on the ring")
+    args = parser.parse_args()
+
+    keys = [hashlib.sha256(str(index).encode()).hexdigest() for index in range(args.keys)]
+    print(f"{args.keys} keys, {args.virtual_nodes} points per tracker")
+    print(f"{'trackers':>10} {'moved':>8} {'expected':>9} {'to new':>7} {'spread':>7} {'owner()':>10}")
+    for count in (int(value) for value in args.trackers.split(",")):
+        moved, toNew, spread, lookup = measure(keys, count, args.virtual_nodes)
+        print(f"{f'{count} -> {count + 1}':>10} {moved:>8.3f} {1 / (count + 1):>9.3f} {'yes' if toNew else 'no':>7} {spread:>7.2f} {lookup * 1e6:>8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# DS Final project
+# In-memory file catalog of the tracker server, replaces the pysondb file database (fileDB.json).
+# Every lookup the server needs goes through an index, so nothing scans all files and nothing rewrites a file on every change.
+# The catalog only lives in memory: the records belong to connected clients, and clients announce their files again when they reconnect.
+
+
+'''
+1. FileRecord: One shared file of one owner: hash, owner, file name, size, piece size and Merkle root.
+2. Catalog: The records indexed by hash (hash -> owners), by owner (owner -> hashes) and by file name (name -> hashes).
+   Every change of the file list clients see gets a new version number and goes to a changelog, so clients can ask for the changes since their version.
+   search finds files by name through a SearchIndex (see searchindex.py) and returns them ranked and a page at a time.
+   searchRanked returns the ranks too, so the pages of the catalogs of several trackers can be merged (see sharding.py).
+3. searchPage: Takes (rank, result) pairs sorted by rank and the page size as parameters and returns the page and the cursor of the next one.
+'''
+
+import heapq
+from collections import deque
+from itertools import islice
+
+from searchindex import SearchIndex
+
+# How many file list changes are kept for clients catching up, older clients get a snapshot instead
+CHANGELOG_SIZE = 4096
+MAX_SEARCH_RESULTS = 200 # Most results one search page may ask for
+
+
+class FileRecord:
+    '''One owner's copy of a shared file.'''
+    __slots__ = ("hash", "owner", "fileName", "size", "pieceSize", "root")
+
+    def __init__(self, hash, owner, fileName, size=0, pieceSize=0, root=""):
+        self.hash = hash
+        self.owner = owner
+        self.fileName = fileName
+        self.size = size
+        self.pieceSize = pieceSize
+        self.root = root
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def fromDict(cls, data):
+        return cls(data["hash"], data["owner"], data["fileName"], data.get("size", 0), data.get("pieceSize", 0), data.get("root", ""))
+
+
+class Catalog:
+    '''
+    Shared files of all connected clients.
+
+    add, get and owners take O(1) time, removeOwner takes O(k) for an owner with k files.
+    The first owner of a hash stays first as long as it is connected, the others follow in the order they announced the file.
+
+    Clients see the catalog as a file list of hash -> file name. version grows by one whenever an entry of that
+    list appears, disappears or gets another name, and the change is kept in a changelog of the last CHANGELOG_SIZE changes.
+    '''
+
+    def __init__(self):
+        self.byHash = {} # In the form: hash: {owner: FileRecord}
+        self.byOwner = {} # In the form: owner: set of hashes
+        self.byName = {} # In the form: fileName: set of hashes
+        self.count = 0 # Number of records
+        self.version = 0
+        self.changes = deque(maxlen=CHANGELOG_SIZE) # In the form: (version, hash, fileName), fileName is None for a removed file
+        self.index = SearchIndex() # The names of the file list, the same names clients see
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, fileHash):
+        return fileHash in self.byHash
+
+    # Adds a file of an owner. Returns False if the owner has already announced this file.
+    def add(self, record):
+        return self.insert(record)
+
+    # Adds many files in one go, for example everything a client shares when it connects.
+    # Returns the records that were added, files the owner had already announced are skipped.
+    def addMany(self, records):
+        return [record for record in records if self.insert(record)]
+
+    # Puts a record into the indexes
+    def insert(self, record):
+        owners = self.byHash.setdefault(record.hash, {})
+        if record.owner in owners:
+            return False
+        owners[record.owner] = record
+        self.count += 1
+        if len(owners) == 1:
+            self.recordChange(record.hash, record.fileName)
+        self.byOwner.setdefault(record.owner, set()).add(record.hash)
+        self.byName.setdefault(record.fileName, set()).add(record.hash)
+        return True
+
+    # Returns the records of every owner of the file, an empty list if nobody has it
+    def get(self, fileHash):
+        return list(self.byHash.get(fileHash, {}).values())
+
+    # Returns one record of the file (the first owner's) or None
+    def first(self, fileHash):
+        owners = self.byHash.get(fileHash)
+        if not owners:
+            return None
+        return next(iter(owners.values()))
+
+    def owners(self, fileHash):
+        return list(self.byHash.get(fileHash, ()))
+
+    def has(self, fileHash, owner):
+        return owner in self.byHash.get(fileHash, ())
+
+    # Returns the hashes of the files that have this file name
+    def findByName(self, fileName):
+        return set(self.byName.get(fileName, ()))
+
+    # Removes every file of an owner, for example when the owner disconnects. Returns the removed records.
+    def removeOwner(self, owner):
+        hashes = self.byOwner.pop(owner, None)
+        if not hashes:
+            return []
+        removed = []
+        for fileHash in hashes:
+            owners = self.byHash[fileHash]
+            wasFirst = next(iter(owners)) == owner
+            record = owners.pop(owner)
+            removed.append(record)
+            self.count -= 1
+            if not owners:
+                del self.byHash[fileHash]
+                self.recordChange(fileHash, None)
+            elif wasFirst and next(iter(owners.values())).fileName != record.fileName:
+                # The file list shows the first owner's name, which is now someone else's
+                self.recordChange(fileHash, next(iter(owners.values())).fileName)
+            # The name index only loses the hash when no owner uses the name for it any more
+            if not any(other.fileName == record.fileName for other in owners.values()):
+                names = self.byName[record.fileName]
+                names.discard(fileHash)
+                if not names:
+                    del self.byName[record.fileName]
+        return removed
+
+    # Removes a file with all of its owners, for example when its shard moves to another tracker. Returns the removed records.
+    def removeFile(self, fileHash):
+        owners = self.byHash.pop(fileHash, None)
+        if not owners:
+            return []
+        for record in owners.values():
+            hashes = self.byOwner[record.owner]
+            hashes.discard(fileHash)
+            if not hashes:
+                del self.byOwner[record.owner]
+            names = self.byName.get(record.fileName)
+            if names is not None:
+                names.discard(fileHash)
+                if not names:
+                    del self.byName[record.fileName]
+        self.count -= len(owners)
+        self.recordChange(fileHash, None)
+        return list(owners.values())
+
+    def recordChange(self, fileHash, fileName):
+        self.version += 1
+        self.changes.append((self.version, fileHash, fileName))
+        if fileName is None:
+            self.index.remove(fileHash)
+        else:
+            self.index.add(fileHash, fileName)
+
+    # Returns the changes after the given version as (added, removed): added is a dictionary of hash: fileName
+    # and removed a list of hashes. Returns None if the changes are no longer in the changelog and a snapshot is needed.
+    def changesSince(self, version):
+        if version is None or version > self.version:
+            return None
+        if version < self.version and (not self.changes or self.changes[0][0] > version + 1):
+            return None
+        added = {}
+        removed = set()
+        start = len(self.changes) - (self.version - version)
+        for _, fileHash, fileName in islice(self.changes, start, None):
+            if fileName is None:
+                added.pop(fileHash, None)
+                removed.add(fileHash)
+            else:
+                added[fileHash] = fileName
+                removed.discard(fileHash)
+        return added, list(removed)
+
+    # Finds files by name. Returns (results, cursor, total): one page of results as dictionaries of hash, fileName, owners and size,
+    # the cursor of the next page (None on the last page) and how many files match in total.
+    def search(self, query, limit=MAX_SEARCH_RESULTS, cursor=None):
+        """
+        Results are ranked by how well the name matches the query, then by name and hash. The rank does not depend on
+        the owners, and the cursor is the rank of the last result of the previous page. So files added or removed and owners
+        joining or leaving between two pages do not make the next page skip or repeat a result, as long as the files keep their names.
+        """
+        limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+        ranked, total = self.searchRanked(query, limit + 1, cursor)
+        results, nextCursor = searchPage(ranked, limit)
+        return results, nextCursor, total
+
+    # Returns the count best matches after the cursor as (rank, result) pairs, best first, and how many files match in total
+    def searchRanked(self, query, count, cursor=None):
+        scores = self.index.match(query)
+        after = tuple(cursor) if cursor else None
+        ranks = []
+        for fileHash, score in scores.items():
+            rank = (-score, self.index.names[fileHash].lower(), fileHash)
+            if after is None or rank > after:
+                ranks.append(rank)
+        ranked = []
+        for rank in heapq.nsmallest(count, ranks):
+            owners = self.byHash[rank[2]]
+            record = next(iter(owners.values()))
+            ranked.append((rank, {"hash": record.hash, "fileName": self.index.names[record.hash], "owners": len(owners), "size": record.size}))
+        return ranked, len(scores)
+
+    # Returns one (hash, fileName) pair for every distinct file, the name is the first owner's name for it
+    def files(self):
+        return [(fileHash, next(iter(owners.values())).fileName) for fileHash, owners in self.byHash.items()]
+
+    def records(self):
+        for owners in self.byHash.values():
+            yield from owners.values()
+
+
+# One page of ranked results. ranked has one pair more than the page if there is a next page, its cursor is the rank of the page's last result.
+def searchPage(ranked, limit):
+    results = [result for _, result in ranked[:limit]]
+    nextCursor = list(ranked[limit - 1][0]) if len(ranked) > limit else None
+    return results, nextCursor
+
@@ -0,0 +1,200 @@
+# DS Final project
+# Content-addressed cache of popular files on the tracker server. Files relayed through the server are written to disk
+# on the way, keyed by their SHA-256 hash, and later downloads of the same hash are sent from disk with sendfile
+# instead of asking the owner to upload the file again. The cache keeps working after the owner has disconnected.
+
+
+'''
+1. parseSize: Takes a size like "10G" as a parameter and returns it in bytes.
+2. isFileHash: Takes a value as a parameter and tells whether it is a SHA-256 hash in hex, the only names the cache uses as file names.
+3. ContentCache: Files named by their hash in one folder, at most capacity bytes in total. The least recently used files are evicted first.
+   The files found in the folder at startup are kept, in the order they were last used.
+4. CacheWriter: Collects one relayed file while it is relayed. commit checks the size and the SHA-256 hash before the file is added,
+   so a cut off transfer or an uploader sending the wrong data never ends up in the cache.
+   The piece hashes are calculated on the way too, downloaders of the cached file check every piece with them.
+'''
+
+import hashlib
+import os
+import re
+from collections import OrderedDict
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+HASH_PATTERN = re.compile(r"[0-9a-f]{64}") # Names of the cached files, anything else in the folder is not the cache's
+PARTIAL_SUFFIX = ".part" # Files still being written, left over ones are removed at startup
+
+
+def parseSize(text):
+    text = str(text).strip().upper().rstrip("B")
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+# Hashes come from clients and become file names, so anything else (e.g. "../x") must never reach os.path.join
+def isFileHash(value):
+    return isinstance(value, str) and HASH_PATTERN.fullmatch(value) is not None
+
+
+class ContentCache:
+    '''
+    Cached files by hash, in least recently used order. Used from the server's event loop only.
+
+    A file is only cached whole (relayed from offset 0 and not compressed), then its hash can be checked.
+    Files bigger than the whole cache are never cached.
+    The piece hashes of the files cached since the start are kept in memory, files found in the folder at startup have none.
+    '''
+
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity
+        self.entries = OrderedDict() # In the form: hash: size, the least recently used first
+        self.manifests = {} # In the form: hash: (piece size, 32 byte hash of every piece concatenated)
+        self.size = 0 # Bytes of all cached files
+        self.filling = set() # Hashes being written right now, a file is only written by one transfer at a time
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(PARTIAL_SUFFIX):
+                os.remove(entry.path)
+            elif HASH_PATTERN.fullmatch(entry.name) and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, fileHash, size in sorted(found):
+            self.entries[fileHash] = size
+            self.size += size
+        self.evict()
+
+    def __contains__(self, fileHash):
+        return isFileHash(fileHash) and fileHash in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def path(self, fileHash):
+        if not isFileHash(fileHash):
+            raise ValueError(f"{fileHash!r} is not a file hash")
+        return os.path.join(self.directory, fileHash)
+
+    # Returns (open file, size) of a cached file and marks it as used, or None on a miss
+    def open(self, fileHash):
+        size = self.entries.get(fileHash) if isFileHash(fileHash) else None
+        if size is None:
+            self.misses += 1
+            return None
+        try:
+            file = open(self.path(fileHash), "rb")
+        except OSError: # Removed from the folder behind the cache's back
+            self.remove(fileHash)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(fileHash)
+        os.utime(file.fileno()) # The modification time keeps the order of use over a restart
+        self.hits += 1
+        return file, size
+
+    # Tells whether a relayed file of this size should be written to the cache
+    def wants(self, fileHash, size):
+        return isFileHash(fileHash) and fileHash not in self.entries and fileHash not in self.filling and 0 < size <= self.capacity
+
+    # Returns a CacheWriter for the file, or None if the cache does not want it
+    def writer(self, fileHash, size, pieceSize):
+        if not self.wants(fileHash, size):
+            return None
+        self.filling.add(fileHash)
+        try:
+            return CacheWriter(self, fileHash, size, pieceSize)
+        except OSError as e:
+            self.filling.discard(fileHash)
+            print(f"Cannot cache {fileHash}: {e!r}")
+            return None
+
+    # Returns (piece size, piece hashes) of a cached file, or None if they are not known
+    def manifest(self, fileHash):
+        return self.manifests.get(fileHash)
+
+    def add(self, fileHash, size, manifest=None):
+        self.entries[fileHash] = size
+        if manifest is not None:
+            self.manifests[fileHash] = manifest
+        self.size += size
+        self.evict(keep=fileHash)
+
+    def remove(self, fileHash):
+        size = self.entries.pop(fileHash, None)
+        if size is None:
+            return
+        self.manifests.pop(fileHash, None)
+        self.size -= size
+        try:
+            os.remove(self.path(fileHash))
+        except OSError:
+            pass # A file being sent stays readable until it is closed
+
+    # Removes the least recently used files until the cache fits in its capacity
+    def evict(self, keep=None):
+        while self.size > self.capacity and self.entries:
+            fileHash = next(iter(self.entries))
+            if fileHash == keep:
+                break
+            self.remove(fileHash)
+
+
+class CacheWriter:
+    '''Writes one file into the cache as it is relayed. The data is hashed on the way, so commit does not read it again.'''
+
+    def __init__(self, cache, fileHash, size, pieceSize):
+        if not isFileHash(fileHash):
+            raise ValueError(f"{fileHash!r} is not a file hash")
+        self.cache = cache
+        self.hash = fileHash
+        self.size = size
+        self.written = 0
+        self.digest = hashlib.sha256()
+        self.pieceSize = pieceSize
+        self.pieces = [] # Hashes of the pieces written so far
+        self.pieceDigest = hashlib.sha256()
+        self.pieceFilled = 0 # Bytes of the current piece written so far
+        self.partialPath = cache.path(fileHash) + PARTIAL_SUFFIX
+        self.file = open(self.partialPath, "wb")
+
+    def write(self, data):
+        self.file.write(data)
+        self.digest.update(data)
+        self.written += len(data)
+        view = memoryview(data)
+        while view:
+            count = min(len(view), self.pieceSize - self.pieceFilled)
+            self.pieceDigest.update(view[:count])
+            self.pieceFilled += count
+            view = view[count:]
+            if self.pieceFilled == self.pieceSize:
+                self.pieces.append(self.pieceDigest.digest())
+                self.pieceDigest = hashlib.sha256()
+                self.pieceFilled = 0
+
+    # Adds the file to the cache if it is complete and its hash matches. Returns True if it was added.
+    def commit(self):
+        self.file.close()
+        self.cache.filling.discard(self.hash)
+        if self.written != self.size or self.digest.hexdigest() != self.hash:
+            print(f"Not caching {self.hash}: {self.written} of {self.size} bytes received, hash {self.digest.hexdigest()}")
+            os.remove(self.partialPath)
+            return False
+        if self.pieceFilled:
+            self.pieces.append(self.pieceDigest.digest())
+        os.replace(self.partialPath, self.cache.path(self.hash))
+        self.cache.add(self.hash, self.size, (self.pieceSize, b"".join(self.pieces)))
+        return True
+
+    def abort(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        self.cache.filling.discard(self.hash)
+        try:
+            os.remove(self.partialPath)
+        except OSError:
+            pass
@@ -0,0 +1,160 @@
+# DS Final project
+# Outgoing side of the tracker server's connections: every client has its own bounded send queue that a writer
+# coroutine drains, so sending to one client never waits for another client.
+
+
+'''
+1. Connection: A client socket with a bounded queue of outgoing frames and a writer coroutine that sends them.
+   - enqueue: Queues an encoded frame. A client whose queue is full is too slow and is disconnected.
+   - enqueueBuild: Queues a function that builds the frame when the writer gets to it.
+   - notify: Queues a notification. Notifications with the same key are merged until the writer gets to them,
+     and the frame is only built then, so a slow client gets one up to date notification instead of a backlog.
+2. Broadcaster: Sends a notification to every connection. Notifications that arrive within FLUSH_INTERVAL are
+   sent together, and queueing them costs the same no matter how slow the slowest client is.
+'''
+
+import asyncio
+import collections
+import time
+
+MAX_QUEUE_BYTES = 4 * 1024 * 1024 # A client that has this much data waiting for it is disconnected as too slow
+SEND_TIMEOUT = 30 # Seconds a client has to take a frame before it is disconnected as too slow
+FLUSH_INTERVAL = 0.05 # Seconds notifications are collected before they are sent to the clients
+
+
+class Connection:
+    '''
+    A client socket and its outgoing queue.
+
+    The queue holds encoded frames, frame builders and notification keys in the order they were queued.
+    Only the writer coroutine writes to the socket.
+    onClose is called once with the connection when it breaks or turns out to be too slow.
+    handler is the task that reads from the connection, it is cancelled when the connection is closed from elsewhere.
+    '''
+    __slots__ = ("sock", "reader", "onClose", "outbox", "queuedBytes", "notifications", "wakeup", "writer", "handler", "closed")
+
+    def __init__(self, sock, reader, onClose=None):
+        self.sock = sock
+        self.reader = reader
+        self.onClose = onClose
+        self.outbox = collections.deque()
+        self.queuedBytes = 0
+        self.notifications = {} # In the form: key: function that builds the frame when the writer gets to it
+        self.wakeup = asyncio.Event()
+        self.writer = None
+        self.handler = None
+        self.closed = False
+
+    def start(self):
+        self.handler = asyncio.current_task()
+        self.writer = asyncio.get_running_loop().create_task(self.writeLoop())
+
+    # Queues an encoded frame. Returns False if the client was too slow and has been disconnected.
+    def enqueue(self, frame):
+        if self.closed:
+            return False
+        # One frame bigger than the limit is fine on its own (for example the whole file list), a backlog is not
+        if self.queuedBytes and self.queuedBytes + len(frame) > MAX_QUEUE_BYTES:
+            self.fail(f"{self.queuedBytes} bytes waiting to be sent")
+            return False
+        self.outbox.append(frame)
+        self.queuedBytes += len(frame)
+        self.wakeup.set()
+        return True
+
+    # Queues a function that builds the frame (or returns None) when everything queued before it has been sent
+    def enqueueBuild(self, build):
+        if self.closed:
+            return
+        self.outbox.append(build)
+        self.wakeup.set()
+
+    # Queues a notification. If one with the same key is still waiting, the new one replaces it.
+    def notify(self, key, build):
+        if self.closed:
+            return
+        if key not in self.notifications:
+            self.outbox.append(key)
+            self.wakeup.set()
+        self.notifications[key] = build
+
+    async def sendRaw(self, data):
+        await asyncio.wait_for(asyncio.get_running_loop().sock_sendall(self.sock, data), SEND_TIMEOUT)
+
+    async def writeLoop(self):
+        try:
+            while True:
+                while not self.outbox:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                item = self.outbox.popleft()
+                if isinstance(item, (bytes, bytearray)):
+                    self.queuedBytes -= len(item)
+                    frame = item
+                elif isinstance(item, str):
+                    frame = self.notifications.pop(item)(self)
+                else:
+                    frame = item(self)
+                if frame is None:
+                    continue
+                await self.sendRaw(frame)
+        except asyncio.CancelledError:
+            pass
+        except (OSError, asyncio.TimeoutError) as e:
+            self.fail(repr(e))
+
+    # Disconnects a client that broke or could not keep up
+    def fail(self, reason):
+        if self.closed:
+            return
+        print(f"Sending to {self} failed ({reason}), disconnecting")
+        if self.onClose is not None:
+            self.onClose(self)
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for task in (self.writer, self.handler):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        self.outbox.clear()
+        self.notifications.clear()
+        self.queuedBytes = 0
+        # The cancelled tasks stop waiting on the socket first, then it is closed
+        asyncio.get_running_loop().call_soon(self.sock.close)
+
+
+class Broadcaster:
+    '''
+    Sends notifications to every connection, at most one per key and connection per FLUSH_INTERVAL.
+
+    connections is a function that returns the current connections. build(connection) is called by each
+    connection's writer and returns the frame for that connection, or None if it has nothing to send.
+    '''
+
+    def __init__(self, connections, interval=FLUSH_INTERVAL, observe=None):
+        self.connections = connections
+        self.interval = interval
+        self.observe = observe # Called after every flush with the seconds it took and the number of notifications queued
+        self.pending = {} # In the form: key: build
+        self.handle = None
+
+    def publish(self, key, build):
+        self.pending[key] = build
+        if self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def flush(self):
+        started = time.perf_counter()
+        self.handle = None
+        pending = self.pending
+        self.pending = {}
+        notified = 0
+        for connection in list(self.connections()):
+            for key, build in pending.items():
+                connection.notify(key, build)
+            notified += len(pending)
+        if self.observe is not None:
+            self.observe(time.perf_counter() - started, notified)
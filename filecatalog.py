@@ -0,0 +1,112 @@
+# DS Final project
+# The client's copy of the tracker's file list (hash -> file name). The listener thread patches it with SYNC
+# messages while the GUI reads it, so every access goes through one lock.
+
+
+'''
+1. FileCatalog: Files available on the network, by hash and by name, and the catalog version they are up to date with.
+   - applySync: Patches the catalog with a SYNC message from the tracker.
+   - findByName: Returns the hashes of the files with this exact name without scanning the catalog.
+   - rows: Returns the files whose name contains a filter text, sorted by name. Typing more letters filters the
+     previous result instead of the whole catalog.
+   - generation: Grows by one with every change, readers compare it to see whether they are out of date.
+'''
+
+import threading
+
+
+class FileCatalog:
+    '''
+    Thread-safe file list of the client.
+
+    Readers get copies or immutable lists, never the dictionaries themselves, so the listener thread can keep
+    applying changes while the GUI works through what it got.
+    '''
+
+    def __init__(self):
+        self.files = {} # In the form: hash: fileName
+        self.byName = {} # In the form: fileName: set of hashes
+        self.version = None # Version of the tracker's catalog the files are up to date with, None until the first SYNC
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.sorted = None # (generation, [(lowercase name, fileName, hash), ...] sorted by name), built when rows are first asked for
+        self.filtered = None # (generation, filter text, rows) of the last rows call
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, fileHash):
+        return fileHash in self.files
+
+    def get(self, fileHash, default=None):
+        return self.files.get(fileHash, default)
+
+    def items(self):
+        with self.lock:
+            return list(self.files.items())
+
+    def add(self, fileHash, fileName):
+        with self.lock:
+            self.put(fileHash, fileName)
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+            self.byName.clear()
+            self.version = None
+            self.generation += 1
+
+    # Patches the catalog with a SYNC message. Returns False if the message starts from a version the catalog is not at,
+    # then the missing changes have to be requested.
+    def applySync(self, message):
+        with self.lock:
+            if message["snapshot"]:
+                self.files.clear()
+                self.byName.clear()
+            elif message["from"] != self.version:
+                # A change that the catalog already has (the reply to a SYNCREQUEST may have included it) can be ignored
+                return self.version is not None and message["version"] <= self.version
+            for fileHash in message["removed"]:
+                self.pop(fileHash)
+            for data in message["added"]:
+                self.put(data["hash"], data["fileName"])
+            self.version = message["version"]
+            self.generation += 1
+            return True
+
+    # Adds or renames a file, the caller holds the lock
+    def put(self, fileHash, fileName):
+        self.pop(fileHash)
+        self.files[fileHash] = fileName
+        self.byName.setdefault(fileName, set()).add(fileHash)
+
+    def pop(self, fileHash):
+        fileName = self.files.pop(fileHash, None)
+        if fileName is None:
+            return
+        hashes = self.byName[fileName]
+        hashes.discard(fileHash)
+        if not hashes:
+            del self.byName[fileName]
+
+    def findByName(self, fileName):
+        with self.lock:
+            return set(self.byName.get(fileName, ()))
+
+    # Returns [(lowercase name, fileName, hash), ...] of the files whose name contains text (case-insensitive), sorted by name
+    def rows(self, text=""):
+        text = text.lower()
+        with self.lock:
+            generation = self.generation
+            if self.sorted is None or self.sorted[0] != generation:
+                self.sorted = (generation, sorted((fileName.lower(), fileName, fileHash) for fileHash, fileName in self.files.items()))
+            rows = self.sorted[1]
+            # The user usually types one more letter, the names that matched before are the only ones that can match now
+            if self.filtered is not None and self.filtered[0] == generation and text.startswith(self.filtered[1]):
+                rows = self.filtered[2]
+        if text:
+            rows = [row for row in rows if text in row[0]]
+        with self.lock:
+            self.filtered = (generation, text, rows)
+        return rows
@@ -0,0 +1,129 @@
+# DS Final project
+# Virtualized list view for the GUI: the Tk listbox only ever holds the rows that fit on the screen, so showing
+# a file list of 100 000 files costs the same as showing 30.
+# Sources:
+# 1. Tk listbox and scrollbar manual pages: https://www.tcl.tk/man/tcl8.6/TkCmd/listbox.htm, https://www.tcl.tk/man/tcl8.6/TkCmd/scrollbar.htm
+
+
+'''
+1. VirtualListView: Shows a window of a long list of rows in a Tk listbox and drives its scrollbar.
+   - setSource: Shows the rows a function returns. If a generation function is given the view checks it every
+     REFRESH_INTERVAL ms on the Tk event loop and fetches the rows again when it has changed, so any number of
+     changes made by other threads in between are drawn once.
+   - setRows: Shows a fixed list of rows.
+   - refresh: Fetches the rows again now, for example when the filter text has changed.
+2. debounce: Takes a widget, a delay and a function as parameters and returns a function that runs it once the
+   calls have stopped for the delay, e.g. to filter the list when the user stops typing.
+'''
+
+import tkinter.font as tkfont
+
+REFRESH_INTERVAL = 200 # Milliseconds between checks whether the rows of the source have changed
+FILTER_DELAY = 150 # Milliseconds after the last key press before the list is filtered
+
+
+class VirtualListView:
+    '''
+    A long list of rows shown through a listbox that holds only the visible ones.
+
+    The rows are any sequence, format(row) turns a row into the text of its line. Scrolling moves the window
+    over the sequence and redraws the listbox, the scrollbar shows where the window is in the whole list.
+    '''
+
+    def __init__(self, listbox, scrollbar):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.rows = []
+        self.source = None
+        self.generation = None
+        self.seenGeneration = None
+        self.format = str
+        self.first = 0 # Index of the first visible row
+        scrollbar.configure(command=self.scroll)
+        listbox.configure(yscrollcommand="")
+        listbox.bind("<Configure>", lambda event: self.render())
+        listbox.bind("<MouseWheel>", self.wheel) # Windows and macOS
+        listbox.bind("<Button-4>", lambda event: self.scrollBy(-3)) # X11
+        listbox.bind("<Button-5>", lambda event: self.scrollBy(3))
+        listbox.bind("<Up>", lambda event: self.scrollBy(-1))
+        listbox.bind("<Down>", lambda event: self.scrollBy(1))
+        listbox.bind("<Prior>", lambda event: self.scrollBy(-self.visibleCount()))
+        listbox.bind("<Next>", lambda event: self.scrollBy(self.visibleCount()))
+        listbox.after(REFRESH_INTERVAL, self.poll)
+
+    def setSource(self, source, generation=None, format=str):
+        self.source = source
+        self.generation = generation
+        self.format = format
+        self.first = 0
+        self.refresh()
+
+    def setRows(self, rows, format=str):
+        self.setSource(lambda: rows, None, format)
+
+    def refresh(self):
+        if self.source is None:
+            return
+        # The generation is read before the rows, a change in between is picked up by the next poll
+        self.seenGeneration = self.generation() if self.generation else None
+        self.rows = self.source()
+        self.render()
+
+    # Runs on the Tk event loop, so the listbox is only ever touched from the GUI thread
+    def poll(self):
+        try:
+            if self.generation is not None and self.generation() != self.seenGeneration:
+                self.refresh()
+        finally:
+            self.listbox.after(REFRESH_INTERVAL, self.poll)
+
+    # Number of rows that fit in the listbox
+    def visibleCount(self):
+        bbox = self.listbox.bbox(0)
+        rowHeight = bbox[3] + 1 if bbox else tkfont.Font(root=self.listbox, font=self.listbox.cget("font")).metrics("linespace") + 2
+        return max(1, self.listbox.winfo_height() // rowHeight)
+
+    def render(self):
+        count = self.visibleCount()
+        total = len(self.rows)
+        self.first = max(0, min(self.first, total - count))
+        self.listbox.delete(0, "end")
+        window = self.rows[self.first:self.first + count]
+        if window:
+            self.listbox.insert("end", *[self.format(row) for row in window])
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + count) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    # Called by the scrollbar: ("moveto", fraction) or ("scroll", amount, "units" or "pages")
+    def scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.first = int(float(amount) * len(self.rows))
+            self.render()
+        else:
+            self.scrollBy(int(amount) * (self.visibleCount() if unit == "pages" else 1))
+
+    def scrollBy(self, rows):
+        self.first += rows
+        self.render()
+        return "break" # The listbox does not scroll itself, it only holds the visible rows
+
+    def wheel(self, event):
+        return self.scrollBy(-3 if event.delta > 0 else 3)
+
+
+# Returns a function that runs function delay milliseconds after it was last called
+def debounce(widget, delay, function):
+    pending = [None]
+
+    def schedule(*args):
+        if pending[0] is not None:
+            widget.after_cancel(pending[0])
+        pending[0] = widget.after(delay, run)
+
+    def run():
+        pending[0] = None
+        function()
+
+    return schedule
@@ -0,0 +1,270 @@
+# DS Final project
+# The graphical user interface of the client. All network work is done by the peer engine (peer.py), this module
+# only draws the window and calls it. client.py imports this module only when the GUI is launched.
+
+
+'''
+1. displayDownloadableFilesList: Takes the file view and the filter entry as parameters. Shows the downloadable files in the virtualized list, filtered as the user types.
+2. formatCatalogRow: Takes a row of the file list as a parameter and returns its line in the list.
+3. filterFileList: Takes the file view as a parameter. Filters the shown list when the user has stopped typing.
+4. displayCurrentFileList: Takes a directory path and the file view as parameters and shows the files of the directory.
+5. displaySearchResults: Takes the file view and a query as parameters. Shows a search in the list, without a query the next page of the last search.
+6. formatSearchResult: Takes a search result as a parameter and returns its line in the list.
+7. main: Builds the window and runs the Tk main loop until the program is closed.
+8. selectLocalDirectory: Takes the file path entry as a parameter and lets the user pick a directory for it.
+9. exitProgram: Disconnects from the tracker and closes the window.
+10. runInBackground: Takes a function and a function for its result as parameters. Runs the first one in a worker thread and hands its result to the second one on the Tk thread.
+'''
+
+import os # Can be used for file operations.
+import threading
+import tkinter as tk #Tkinter is a standard library used for GUI development.
+from tkinter import ttk # for tkinter widget in charge of making a treeview
+import customtkinter as ctk #For modernized tkinter GUI
+from tkinter import filedialog #For local directory selection
+import sv_ttk #credit to: rdbende from github for the ttk theme.
+
+import peer
+from fileview import VirtualListView, debounce, FILTER_DELAY
+
+# Query, next page cursor and results so far of the search shown in the GUI. search counts the searches, so the page of a search
+# that has been replaced by a newer one is not shown, and loading is set while a page is on its way.
+lastSearch = {"query": None, "cursor": None, "rows": [], "search": 0, "loading": False}
+
+
+# Shows the downloadable files whose name contains the filter text. The view only draws the visible rows and
+# redraws by itself on the Tk event loop when SYNC messages change the catalog (see fileview.py).
+def displayDownloadableFilesList(fileView, filterEntry):
+    if peer.nickname:
+        peer.displayFileList() # The file list is fetched the first time it is viewed and kept up to date after that
+    fileView.setSource(lambda: peer.fileCatalog.rows(filterEntry.get()), lambda: peer.fileCatalog.generation, formatCatalogRow)
+
+def formatCatalogRow(row):
+    return f"{row[1]} (Hash: {row[2]})"
+
+# Filters the shown list when the user has stopped typing in the filter entry. Only the downloadable files are filtered.
+def filterFileList(fileView):
+    if fileView.generation is not None:
+        fileView.first = 0
+        fileView.refresh()
+
+def displayCurrentFileList(givenDirectoryPath, fileView):
+# This function tries to find the path of file by its name 
+    global currentFileDirectory
+    currentFileDirectory = givenDirectoryPath
+    #testList = ["file1.txt", "file2.txt", "file3.txt", "file4.txt"] #Test list of files for sharing
+    files=[file for file in os.listdir(givenDirectoryPath) if os.path.isfile(os.path.join(givenDirectoryPath, file))]
+    fileView.setRows(files) #Replaces what the list showed before. Uncomment testList and replace "files" with "testList" if you want to test the function without having to select a directory.
+
+
+# Shows the results of a search in the list. Without a query the next page of the last search is added to the list.
+# The page is fetched in a worker thread and shown when it arrives.
+def displaySearchResults(fileView, query=None):
+    if query is not None:
+        lastSearch.update(query=query, cursor=None, rows=[], loading=False)
+        lastSearch["search"] += 1
+    elif lastSearch["query"] is None or lastSearch["cursor"] is None or lastSearch["loading"]:
+        return # No search yet, the last page is already shown or the next page is on its way
+    search, searchQuery, cursor = lastSearch["search"], lastSearch["query"], lastSearch["cursor"]
+    lastSearch["loading"] = True
+
+    def showPage(page):
+        if lastSearch["search"] != search:
+            return # The user has started another search since
+        results, lastSearch["cursor"], total = page
+        lastSearch["loading"] = False
+        lastSearch["rows"].extend(results)
+        if cursor is None:
+            fileView.setRows(lastSearch["rows"], formatSearchResult)
+            print(f"{total} file(s) match {searchQuery!r}")
+        else:
+            fileView.refresh()
+
+    runInBackground(lambda: peer.searchFiles(peer.client, searchQuery, cursor=cursor), showPage)
+
+def formatSearchResult(result):
+    return f"{result['fileName']} ({result['size']} bytes, {result['owners']} owner(s), Hash: {result['hash']})"
+
+def main():
+    """
+    Main function to handle the user interface and file sharing operations.
+
+    Parameters: None
+
+    Returns: None
+    """
+    global root # This will be the main window. It is global so that other functions can use it. e.g. exitProgram() function.
+    root = ctk.CTk() #root/main window
+    ctk.set_appearance_mode("dark") #Sets the appearance mode of the GUI to dark
+    ctk.set_default_color_theme("green") #Sets the default color theme of the GUI elements to green
+    root.title("File Sharing Application") #Title of the window
+    root.geometry("800x600") #Size of the window
+
+
+
+    #Configuring the grid layout of the window.
+    root.grid_columnconfigure(1, weight=1)
+    root.grid_columnconfigure(4, weight=1)
+    root.grid_rowconfigure((0, 1, 2), weight=1)
+
+    ### commandFrame
+
+    commandFrame=ctk.CTkFrame(root, width=140, corner_radius=0) #Frame in which the command buttons and entries are placed in
+    commandFrame.grid(row=0, column=0, sticky="nsew", rowspan=4) #Places the commandFrame in the main window
+    commandFrame.grid_rowconfigure(19, weight=1) #Configures the row of the commandFrame
+
+    ## commandFrame widgets
+    #Section covers the intro text and places it in the commandFrame at the top
+    introText = ctk.CTkLabel(commandFrame, text="File Sharing Application Text", corner_radius=10)
+    introText.grid(row=0, column=0)
+
+
+
+    #Section covers the connect button and the entry widgets for the username,  IP address, and port number
+    connectInstructionText = ctk.CTkLabel(commandFrame, text="Enter your username. Then IP address and port number to connect to.")
+    connectInstructionText.grid(row=1, column=0)
+    usernameEntry = ctk.CTkEntry(commandFrame, placeholder_text="Enter username")
+    usernameEntry.grid(row=2, column=0)
+    connectEntryIP = ctk.CTkEntry(commandFrame, placeholder_text="IP Address")
+    connectEntryIP.grid(row=3, column=0, pady=1)
+    connectEntryPort = ctk.CTkEntry(commandFrame, placeholder_text="Port Number")
+    connectEntryPort.grid(row=4, column=0)
+    # Connecting hashes and announces the shared folder, the buttons that talk to the tracker do their work in a worker thread
+    connectButton = ctk.CTkButton(commandFrame, text="Connect", command=lambda: runInBackground(lambda serverIP=connectEntryIP.get(), port=connectEntryPort.get(), username=usernameEntry.get(): peer.registerPeer(serverIP, port, username)))
+    connectButton.grid(row=5, column=0, pady=10)
+
+    #Section covers:
+    #1. The "Absolute file path" entry widget to paste the absolute path to the local directory.
+    #2. The "Select directory" button which runs commands that let you choose a directory from your computer and pastes it into the entry widget (it clears the text box before pasting).
+    #3. The "Enter" button to get the absolute directory path from the entry widget and display the files via displayCurrentFileList(*) function.
+    #4. The "View Downloadable Files" button to display the files that are downloadable from the server.
+    filepathInstructionText = ctk.CTkLabel(commandFrame, text="Enter the path of the file folder to select and view.")
+    filepathInstructionText.grid(row=6, column=0)
+    filepathEntry = ctk.CTkEntry(commandFrame, placeholder_text="Absolute file path")
+    filepathEntry.grid(row=7, column=0)
+    #File selection button - opens a file dialog to select a file - then button to display the files from the filepathEntry widget
+    filepathEntryDirectorySelectButton = ctk.CTkButton(commandFrame, text="Select directory", command=lambda: selectLocalDirectory(filepathEntry)) 
+    filepathEntryDirectorySelectButton.grid(row=8, column=0, pady=2)
+    selectButton = ctk.CTkButton(commandFrame, text="Enter", command=lambda: displayCurrentFileList(filepathEntry.get(), fileView))
+    selectButton.grid(row=9, column=0, pady=10)
+    #Display downloadable files
+    displayDownloadableFilesButton = ctk.CTkButton(commandFrame, text="View Downloadable Files", command=lambda: displayDownloadableFilesList(fileView, filterEntry))
+    displayDownloadableFilesButton.grid(row=10, column=0, pady=2)
+
+
+
+
+
+    #Upload and Download file instructions
+    uploadDownloadInstructionText = ctk.CTkLabel(commandFrame, text="Select a file to upload or download.")
+    uploadDownloadInstructionText.grid(row=11, column=0)
+
+
+    #Section covers the "Download" button that will be used to download the selected file
+    downloadEntry = ctk.CTkEntry(commandFrame, placeholder_text="Download file name")
+    downloadEntry.grid(row=12, column=0)
+    downloadButton = ctk.CTkButton(commandFrame, text="Download", command=lambda: runInBackground(lambda fileName=downloadEntry.get(): peer.downloadFile(peer.findFileHash(fileName))))
+    downloadButton.grid(row=13, column=0, pady=2)
+    #Search buttons - show the files whose name matches the text in the download entry, a page at a time
+    searchButton = ctk.CTkButton(commandFrame, text="Search", command=lambda: displaySearchResults(fileView, downloadEntry.get()))
+    searchButton.grid(row=14, column=0, pady=2)
+    moreResultsButton = ctk.CTkButton(commandFrame, text="More results", command=lambda: displaySearchResults(fileView))
+    moreResultsButton.grid(row=15, column=0, pady=2)
+
+
+    #Section covers the "Upload" button that will be used to upload the selected file
+    uploadEntry = ctk.CTkEntry(commandFrame, placeholder_text="Upload file name")
+    uploadEntry.grid(row=16, column=0, pady=2)
+    uploadButton = ctk.CTkButton(commandFrame, text="Upload", command=lambda: runInBackground(lambda fileName=uploadEntry.get(): peer.uploadFile(peer.client, peer.nickname, fileName)))
+    uploadButton.grid(row=17, column=0)
+
+
+
+
+    #Section covers the "Exit" button that will be used to exit the program
+    exitButton = ctk.CTkButton(commandFrame, fg_color="red", text="Disconnect & Exit", command=exitProgram)
+    exitButton.grid(row=18, column=0, pady=20)
+
+
+
+    ### resultsFrame
+
+    resultsFrame=ctk.CTkFrame(root, width=200, height=400, corner_radius=10) #Frame in which the files are displayed
+    resultsFrame.grid(row=0, column=4, sticky="NESW", rowspan=4, columnspan=2) #Places the resultsFrame in the main window
+    resultsFrame.grid_rowconfigure(4, weight=3) #Configures the row of the resultsFrame
+
+    ## resultsFrame widgets 
+    
+    #Filter entry widget - the downloadable files are filtered by name as the user types
+    filterEntry = ctk.CTkEntry(resultsFrame, placeholder_text="Filter downloadable files")
+    filterEntry.pack(side='top', fill='x')
+
+    #Listbox widget for displaying the files
+    listbox = tk.Listbox(resultsFrame)
+    listbox.pack(side='left', fill='both', expand=True)
+
+    # Scrollbar widget for the listbox widget that allows the user to scroll through the list
+    scrollbar = ttk.Scrollbar(resultsFrame, orient='vertical')
+    scrollbar.pack(side='right', fill='y')
+    # The view only puts the visible rows into the listbox and drives the scrollbar itself (see fileview.py)
+    fileView = VirtualListView(listbox, scrollbar)
+    filterEntry.bind("<KeyRelease>", debounce(filterEntry, FILTER_DELAY, lambda: filterFileList(fileView)))
+
+
+    ### Set theme to Sun Valley. Mostly for the scrollbar and listbox widgets.
+    sv_ttk.set_theme("dark") 
+
+    ### Starts the UI (mainloop)
+    root.mainloop()
+
+def selectLocalDirectory(filepathEntry):
+    """
+    Function to select a local directory for file sharing.
+
+    Parameters: filepathEntry - Entry widget for the file path.
+
+    Returns: Absolute path of the selected directory.
+    """
+    directoryPath = filedialog.askdirectory() #Opens a dialog box to select a directory and assigns the selected directory to directoryPath
+    if directoryPath:  # Check if a directory was selected
+        filepathEntry.delete(0, tk.END)  # Clear existing content in the entry
+        filepathEntry.insert(0, directoryPath)  # Insert the new path
+
+
+    """directoryPath = filedialog.askdirectory() #Opens a dialog box to select a directory and assigns the selected directory to directoryPath
+    return directoryPath"""
+
+# Runs work in a worker thread, so the window keeps responding while it waits for the tracker or hashes files.
+# done gets the result on the Tk thread through root.after, the widgets may only be used from that thread.
+def runInBackground(work, done=None):
+    """
+    Parameters:
+    - work: Function without parameters that does the blocking part, e.g. a search on the tracker.
+    - done: Function that takes the result of work and shows it, or None.
+
+    Returns: None
+    """
+    def run():
+        try:
+            result = work()
+        except Exception as e:
+            print(f"Error occured: {e}")
+            return
+        if done is not None:
+            root.after(0, done, result)
+    threading.Thread(target=run, daemon=True).start()
+
+def exitProgram():
+    try:
+        peer.disconnect()
+    except Exception as e:
+        print(f"Error occured while disconnecting: {e}")
+    finally:
+        root.destroy()
+    
+    
+    
+
+if __name__ == "__main__":
+    main() # Main function that starts the GUI via a mainloop. This will loop until the program is stopped (there is no break from the loop).
+        
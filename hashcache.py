@@ -0,0 +1,181 @@
+# DS Final project
+# Persistent cache of file manifests (see peer.calculateFileManifest), so a file is only hashed again when it has changed.
+# Sources:
+# 1. os.stat documentation: https://docs.python.org/3/library/os.html#os.stat_result
+
+
+'''
+1. statKey: Takes an os.stat result as a parameter and returns the (size, mtime_ns, inode) a cached manifest is valid for.
+2. HashCache: Manifests of files by path. Kept in memory and in an append-only index file on disk.
+   - getManifest: Returns the manifest of a file from the cache, or calculates it if the file is new or has changed.
+   - getCached: Returns the manifest of a file from the cache, or None if the file is new or has changed.
+   - lookup / store: Read and write one entry.
+
+Index file format: MAGIC followed by entries. An entry is ENTRY (path length, size, mtime_ns, inode, piece size,
+file hash, Merkle root, piece count), the UTF-8 path and the 32 byte digest of every piece.
+A later entry for the same path replaces an earlier one. The file is rewritten without the replaced entries when they
+take up more than half of it.
+'''
+
+import os
+import struct
+import threading
+
+MAGIC = b"FSHC\x01"
+ENTRY = struct.Struct("!HQqQI32s32sI")
+DIGEST_SIZE = 32
+COMPACT_MIN_ENTRIES = 256 # The index is not compacted before it has this many replaced entries
+
+
+# The stat data a cached manifest is valid for. Any change in size, modification time or inode
+# (the file was replaced with another one) makes the file get hashed again.
+def statKey(stat):
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class HashCache:
+    '''
+    Manifests of files keyed by absolute path and statKey.
+
+    The index file is read on first use. Entries are appended as files are hashed, so a restart with
+    unchanged files reads the manifests from the index instead of hashing anything.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None # In the form: absolute path: (statKey, manifest)
+        self.replaced = 0 # Entries in the index file that a later entry has replaced
+        self.file = None # The index file, opened for appending on the first store
+        self.lock = threading.Lock()
+
+    # Returns the manifest of a file, calculated with calculate(filePath, pieceSize) if the cache does not have it
+    def getManifest(self, filePath, pieceSize, calculate):
+        """
+        Parameters:
+        - filePath: The path to the file. E.g. "C:/Users/User/Documents/file.txt".
+        - pieceSize: The piece size of the manifest. A manifest with another piece size is calculated again.
+        - calculate: The function that hashes the file, e.g. peer.calculateFileManifest.
+
+        Returns:
+        - manifest: The manifest of the file, see peer.calculateFileManifest.
+        """
+        filePath = os.path.abspath(filePath)
+        key = statKey(os.stat(filePath))
+        manifest = self.lookup(filePath, key, pieceSize)
+        if manifest is not None:
+            return manifest
+        manifest = calculate(filePath, pieceSize)
+        # A file that changed while it was hashed is hashed again next time
+        if statKey(os.stat(filePath)) == key:
+            self.store(filePath, key, manifest)
+        return manifest
+
+    def getCached(self, filePath, pieceSize):
+        filePath = os.path.abspath(filePath)
+        return self.lookup(filePath, statKey(os.stat(filePath)), pieceSize)
+
+    def lookup(self, filePath, key, pieceSize):
+        with self.lock:
+            self.load()
+            entry = self.entries.get(filePath)
+        if entry is None or entry[0] != key or entry[1]["pieceSize"] != pieceSize:
+            return None
+        return entry[1]
+
+    def store(self, filePath, key, manifest):
+        record = self.encode(filePath, key, manifest)
+        with self.lock:
+            self.load()
+            if filePath in self.entries:
+                self.replaced += 1
+            self.entries[filePath] = (key, manifest)
+            try:
+                if self.replaced >= COMPACT_MIN_ENTRIES and self.replaced > len(self.entries):
+                    self.compact()
+                else:
+                    if self.file is None:
+                        self.file = open(self.path, "ab")
+                    self.file.write(record)
+                    self.file.flush()
+            except OSError as e:
+                # The cache only saves time, sharing works without it
+                print(f"Could not write the hash cache {self.path}: {e}")
+
+    def encode(self, filePath, key, manifest):
+        path = filePath.encode("utf-8")
+        size, mtimeNs, inode = key
+        return b"".join([
+            ENTRY.pack(len(path), size, mtimeNs, inode, manifest["pieceSize"], bytes.fromhex(manifest["hash"]),
+                       bytes.fromhex(manifest["root"]), len(manifest["pieces"])),
+            path,
+            *manifest["pieces"]
+        ])
+
+    # Reads the index file into memory the first time the cache is used
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            self.create()
+            return
+        except OSError as e:
+            print(f"Could not read the hash cache {self.path}: {e}")
+            return
+        if not data.startswith(MAGIC):
+            self.create() # Unknown format, start over
+            return
+        position = len(MAGIC)
+        count = 0
+        while position + ENTRY.size <= len(data):
+            pathLength, size, mtimeNs, inode, pieceSize, fileHash, root, pieceCount = ENTRY.unpack_from(data, position)
+            end = position + ENTRY.size + pathLength + pieceCount * DIGEST_SIZE
+            if end > len(data):
+                break
+            start = position + ENTRY.size
+            filePath = data[start:start + pathLength].decode("utf-8")
+            start += pathLength
+            pieces = [data[offset:offset + DIGEST_SIZE] for offset in range(start, end, DIGEST_SIZE)]
+            self.entries[filePath] = ((size, mtimeNs, inode), {
+                "hash": fileHash.hex(),
+                "size": size,
+                "pieceSize": pieceSize,
+                "pieces": pieces,
+                "root": root.hex()
+            })
+            count += 1
+            position = end
+        self.replaced = count - len(self.entries)
+        if position < len(data):
+            # A torn entry at the end, left by a crash in the middle of a write
+            with open(self.path, "r+b") as file:
+                file.truncate(position)
+
+    def create(self):
+        try:
+            with open(self.path, "wb") as file:
+                file.write(MAGIC)
+        except OSError as e:
+            print(f"Could not create the hash cache {self.path}: {e}")
+
+    # Rewrites the index file with only the live entries, the new file replaces the old one in one step
+    def compact(self):
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "wb") as file:
+            file.write(MAGIC)
+            for filePath, (key, manifest) in list(self.entries.items()):
+                if not os.path.exists(filePath):
+                    del self.entries[filePath] # Deleted files are dropped from the cache here
+                    continue
+                file.write(self.encode(filePath, key, manifest))
+        self.close()
+        os.replace(temporaryPath, self.path)
+        self.replaced = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
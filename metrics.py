@@ -0,0 +1,208 @@
+# DS Final project
+# Counters, gauges and histograms of the tracker server in the Prometheus text format, and a sampling profiler.
+# Sources:
+# 1. Prometheus exposition format: https://prometheus.io/docs/instrumenting/exposition_formats/
+# 2. sys._current_frames documentation: https://docs.python.org/3/library/sys.html#sys._current_frames
+
+
+'''
+1. Counter: A number that only grows, e.g. messages handled. Optionally one per label value, e.g. per message type.
+2. Gauge: A number read when the metrics are rendered, e.g. the number of connections.
+3. Histogram: Counts observations, e.g. handler latencies, in buckets and keeps their sum.
+4. Registry: The metrics of a program. render() returns all of them in the Prometheus text format.
+5. SamplingProfiler: A thread that samples the stack of another thread (the event loop) at a fixed interval.
+   folded() returns the stacks in the folded format flame graph tools read: "module:function;module:function count".
+'''
+
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_INTERVAL = 0.01 # Seconds between two stack samples of the profiler
+PROFILE_DEPTH = 64 # Frames kept of every sampled stack, counted from the outermost
+
+
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def formatLabels(names, values, extra=()):
+    pairs = [f'{name}="{escapeLabel(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{escapeLabel(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    '''A count that only grows. inc("SEARCH") adds one to the child with that label value.'''
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = collections.defaultdict(float) # In the form: label values: count
+
+    def inc(self, *labelValues, amount=1):
+        self.values[labelValues] += amount
+
+    def render(self):
+        lines = self.header()
+        for labelValues, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{formatLabels(self.labels, labelValues)} {formatValue(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    '''
+    A value read from read() when the metrics are rendered. read returns a number, or a dictionary of
+    label values: number when the gauge has labels.
+    '''
+    type = "gauge"
+
+    def __init__(self, name, help, read, labels=()):
+        super().__init__(name, help, labels)
+        self.read = read
+
+    def render(self):
+        lines = self.header()
+        value = self.read()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labelValues, number in sorted(items):
+            if not isinstance(labelValues, tuple):
+                labelValues = (labelValues,)
+            lines.append(f"{self.name}{formatLabels(self.labels, labelValues)} {formatValue(number)}")
+        return lines
+
+
+class Histogram(Metric):
+    '''Observations counted in buckets of upper bounds. observe(0.002, "SEARCH") records one for that label value.'''
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # In the form: label values: [count of every bucket and +Inf, sum]
+
+    def observe(self, value, *labelValues):
+        entry = self.values.get(labelValues)
+        if entry is None:
+            entry = self.values[labelValues] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self):
+        lines = self.header()
+        for labelValues, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = formatLabels(self.labels, labelValues, [("le", formatValue(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = formatLabels(self.labels, labelValues)
+            lines.append(f"{self.name}_sum{labels} {formatValue(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    '''The metrics of a program, rendered in the order they were created.'''
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, read, labels=()):
+        return self.add(Gauge(name, help, read, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:
+                lines.append(f"# {metric.name} could not be read: {e!r}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    '''
+    Samples the stack of one thread every interval seconds from a thread of its own.
+
+    The sampled thread is not slowed down by tracing, the cost is one stack walk per sample in the profiler
+    thread. A function that shows up in many samples is where the sampled thread spends its time.
+    '''
+
+    def __init__(self, threadId=None, interval=PROFILE_INTERVAL):
+        self.threadId = threading.get_ident() if threadId is None else threadId
+        self.interval = interval
+        self.stacks = collections.Counter() # In the form: folded stack: samples
+        self.samples = 0
+        self.lock = threading.Lock() # folded() is called from the sampled thread while samples are added
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            folded = ";".join(reversed(stack[-PROFILE_DEPTH:]))
+            with self.lock:
+                self.stacks[folded] += 1
+                self.samples += 1
+
+    def folded(self):
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.folded())
@@ -0,0 +1,1505 @@
+"""
+The peer engine: everything a client does on the network, without any user interface.
+client.py runs it from the command line (share, search, get, seed) and gui.py puts the GUI on top of it.
+Importing this module does not import tkinter and does not open any sockets, registerPeer connects to the tracker.
+
+Interaction Example: Downloading a File
+
+1. Search: searchFiles() asks the tracker for the files whose name matches a query, one page at a time.
+2. Download Initiation: downloadFile(fileHash) asks the tracker for the file. requestFile(fileHash) sends the request.
+3. Transfer: The tracker answers with the peers that have the file (downloadFromPeers) or relays it (receiveRelayedFile).
+4. Completion: waitForDownload(fileHash) returns once the file is on disk or the download has failed.
+
+1. File Handling
+
+calculateFileHash(filePath): Generates a unique hash (like SHA-1) to identify the file on the network.
+calculateFileManifest(filePath, pieceSize): Generates the file hash, a hash for every piece and a Merkle root of the piece hashes in one read of the file.
+getFileManifest(filePath): Returns the manifest of a shared file from the hash cache, the file is only hashed if it is new or has changed.
+hashFiles(filePaths): Hashes many files at the same time in a thread pool and returns the manifests in the order they are ready.
+divideFileIntoChunksAndSendChunks(filePath, chunkSize): Splits the file into smaller chunks for efficient transfer and resuming downloads.
+getFilePath(fileName): Path of a file in the shared folder (sharedFolder).
+
+2. File List and Search
+
+displayFileList(): Fetches the list of files available for download from other peers into fileCatalog.
+searchFiles(client, query, limit, cursor): Searches the tracker's catalog by file name and returns one ranked page of results.
+findFileHash(fileName): Finds the hash of a file by its exact name with a search.
+requestCatalogSync(client): Asks the tracker for the changes to the file list since the version fileCatalog is at.
+applyCatalogSync(message): Patches fileCatalog with the files added and removed in a SYNC message.
+getFileName(fileHash): Name of a file on the network, from the file list or from a search.
+updateFileList(): Updates the file list to reflect new files that are added to the folder.
+shareFileList(fileList): Triggered when displayFileList() function from another peer requests a list of files.
+
+3. Connection
+
+registerPeer(serverIP, port, username, shareFolder): Connects to the tracker, picks the nickname, shares the folder and starts the listener thread.
+listenForServerConnection(client, reader, serverIP, port): Handles the messages the tracker sends.
+disconnect(): Tells the tracker this client is leaving and closes the connection.
+
+4. File Exchange
+
+requestFile(fileHash): Send a request to a peer.
+startTransfer(role, message): Runs one relayed upload or download in its own thread over its own data channel.
+openDataChannel(transfer, token, role, address): Opens a new connection to the tracker (or the tracker of the cluster running the transfer) for the data of one transfer.
+sendRelayedFile(message): Sends a file the tracker asked for over a data channel, compressed if the downloader offered a codec and the data compresses.
+sendCompressedRange(sock, filePath, offset, length, codec): Sends a byte range of a file as blocks compressed one by one.
+setUploadLimits(rate, peerRate, transferRate): Limits the bandwidth of the uploads in total, per peer and per transfer (see ratelimit.py).
+offeredCodecs(): Names of the codecs this client offers for relayed downloads.
+receiveRelayedFile(message): Receives a relayed file over a data channel.
+getPieceHashes(header): The piece hashes of a relayed file, checked against its Merkle root, so every piece is checked as it arrives.
+announceFiles(client, username, fileNames): Shares many files with the tracker in a few ANNOUNCE messages.
+downloadFile(fileHash): Get peer list, coordinate requests, and reassemble chunks.
+finishDownload(fileHash, success) / waitForDownload(fileHash, timeout): Tell the ones waiting for a download that it has ended.
+
+Sources for this code: 
+1) 
+
+
+"""
+
+
+
+
+import hashlib # Can be used for generating hash values.
+import os # Can be used for file operations.
+import sys
+import time
+import socket
+import threading
+import collections
+import json
+import itertools
+import protocol
+from protocol import FrameReader, encodeFrame, sendFrame
+from hashcache import HashCache
+from filecatalog import FileCatalog
+import transfercodec
+import ratelimit
+#TODO: Implement the functions below.
+# Source 1) How to use sockets is done based on this video: https://www.youtube.com/watch?v=YwWfKitB8aA
+# Source 2) Sending and receiving chunks of file with TCP connection in Python is based on this: https://stackoverflow.com/questions/27241804/sending-a-file-over-tcp-sockets-in-python
+# Source 3) 
+#+ Documentations of each used library :D
+
+fileCatalog = FileCatalog() # Files available for sharing, hash value of the file -> fileName. Patched by the listener thread, read by the GUI (see filecatalog.py)
+sharedFiles = {}    # Dictionary of the files this client shares with others. Form: hash value of the file as key and fileName as value
+sharedManifests = {} # Manifests of the shared files. Form: hash value of the file as key and the manifest (see calculateFileManifest) as value
+isAlive = True
+CHUNK_SIZE = int(os.environ.get("FILESHARE_CHUNK_SIZE", 256 * 1024)) # Size of the blocks files are read and sent in. Can be changed with the FILESHARE_CHUNK_SIZE environment variable.
+SENDFILE_BLOCK = 8 * 1024 * 1024 # How much the kernel sends per sendfile call. Progress is reported between the calls.
+PROGRESS_INTERVAL = 1.0 # Seconds between progress reports while sending a file
+chunkPaths = []
+username = None
+nickname = None # Nickname of this client on the tracker, set when it connects
+
+DIRECT_TRANSFERS = True # Other peers download this client's files straight from its seeding listener. The tracker relay is the fallback.
+SEEDING_PORT = 0 # Port of the seeding listener. 0 lets the operating system pick a free port.
+PEER_CONNECT_TIMEOUT = 5 # Seconds to wait for a direct connection to another peer before falling back to the relay
+PIECE_SIZE = 1024 * 1024 # Direct downloads are split into pieces of 1 MiB that can come from different peers
+PIECE_TIMEOUT = 20 # Seconds a peer may stay silent while sending a piece before the piece is requested from another peer
+RECEIVE_BUFFER_SIZE = 256 * 1024 # Size of the reusable buffer relayed files are received into
+seedingListener = None
+sendLock = threading.Lock() # Keeps frames sent from different threads (GUI, listener, downloads) from being mixed on the socket
+requestIds = itertools.count(1) # Every request gets its own ID, the server's reply carries the same ID
+HASH_CACHE_PATH = os.environ.get("FILESHARE_HASH_CACHE", os.path.join(os.getcwd(), ".hashcache")) # Manifests of the shared files, see hashcache.py
+hashCache = HashCache(HASH_CACHE_PATH)
+HASH_WORKERS = int(os.environ.get("FILESHARE_HASH_WORKERS", max(2, min(8, os.cpu_count() or 1)))) # Files hashed at the same time, at least two so reading one overlaps hashing another
+ANNOUNCE_INTERVAL = 1.0 # Seconds after which the files hashed so far are announced even if the batch is not full
+ANNOUNCE_BATCH = 1000 # Files per ANNOUNCE message, keeps every message well below protocol.MAX_FRAME_SIZE
+MAX_UPLOADS = 4 # Relayed files sent at the same time, further requests wait for a free slot
+TRANSFER_TIMEOUT = 30 # Seconds a relayed download may stay silent before it is given up
+uploadSlots = threading.BoundedSemaphore(MAX_UPLOADS)
+# Upload bandwidth in bytes per second, in total, per downloading peer and per transfer. Unlimited by default, can be set
+# with the FILESHARE_UPLOAD_LIMIT, FILESHARE_PEER_UPLOAD_LIMIT and FILESHARE_TRANSFER_UPLOAD_LIMIT environment variables (e.g. "2M")
+# or with setUploadLimits. Small files are sent ahead of big ones and the uploads share the total limit in round robin.
+uploadScheduler = ratelimit.BandwidthScheduler(ratelimit.parseRate(os.environ.get("FILESHARE_UPLOAD_LIMIT")),
+                                               ratelimit.parseRate(os.environ.get("FILESHARE_PEER_UPLOAD_LIMIT")),
+                                               ratelimit.parseRate(os.environ.get("FILESHARE_TRANSFER_UPLOAD_LIMIT")))
+activeTransfers = {} # Relayed transfers in progress. Form: transfer ID as key and ("upload" or "download", file hash) as value
+transfersLock = threading.Lock()
+REQUEST_TIMEOUT = 10 # Seconds to wait for the tracker's reply to a request
+LISTENER_JOIN_TIMEOUT = 2 # Seconds disconnect waits for the listener thread to stop before closing the socket
+SEARCH_PAGE_SIZE = 50 # Search results asked for at a time
+pendingReplies = {} # Requests waiting for the tracker's reply. Form: request ID as key and [threading.Event, reply frame] as value
+searchResults = {} # Files found with searchFiles. Form: hash value of the file as key and the search result as value
+downloadResults = {} # Downloads somebody waits for with waitForDownload. Form: hash value of the file as key and [threading.Event, success] as value
+downloadRequests = {} # Download requests sent to the tracker. Form: request ID as key and hash value of the file as value, an ERROR reply ends the download
+COMPRESSION = os.environ.get("FILESHARE_COMPRESSION", "zlib") # Codecs offered for relayed downloads, comma separated (see transfercodec.py). "none" turns compression off.
+sharedFolder = os.path.join(os.getcwd(), "files") # Folder of the shared files, found by their names in it
+downloadFolder = "" # Folder downloaded files are written to, "" is the current folder
+gserverIP = None # Address of the tracker, set by registerPeer
+gport = None
+
+# Socket connected to the tracker and the thread reading it, created by registerPeer
+client = None
+listenerThread = None
+closing = threading.Event() # Set by disconnect, the listener then ends quietly instead of reporting the closed socket as an error
+
+# Sends one message (a frame, see protocol.py) to the tracker server and returns its request ID
+def sendMessage(client, type, body=None):
+    requestId = next(requestIds)
+    sendFrame(client, type, body, requestId, sendLock)
+    return requestId
+
+# Sends a request to the tracker and waits for the reply with the same request ID, which the listener thread hands over.
+# Returns the reply frame, or None if it did not come within timeout seconds.
+def sendRequest(client, type, body=None, timeout=REQUEST_TIMEOUT):
+    requestId = next(requestIds)
+    waiter = [threading.Event(), None]
+    pendingReplies[requestId] = waiter
+    try:
+        sendFrame(client, type, body, requestId, sendLock)
+        waiter[0].wait(timeout)
+        return waiter[1]
+    finally:
+        pendingReplies.pop(requestId, None)
+
+# Hands a reply to the thread waiting for it in sendRequest. Returns False if nobody is waiting for this frame.
+def deliverReply(frame):
+    waiter = pendingReplies.get(frame.requestId)
+    if waiter is None:
+        return False
+    waiter[1] = frame
+    waiter[0].set()
+    return True
+
+
+# 1. File Handling
+# This function calculates hash value for each file in the network
+def calculateFileHash(filePath):
+    """
+    Generates a unique hash (like SHA-1) to identify the file on the network.
+    Parameters:
+    - filePath: The path to the file for which the hash is to be calculated. E.g. "C:/Users/User/Documents/file.txt".
+    Returns:
+    - hashValue: The calculated hash value for the file. E.g. "a1b2c3d4".
+    """
+    # Source for this is the documentation of hash module
+    with open(filePath, "rb", buffering=0) as file: 
+        digest = hashlib.file_digest(file, "sha256")
+
+    hashValue = digest.hexdigest() 
+    return hashValue
+
+# This function calculates the file hash and the piece hashes in the same pass over the file
+def calculateFileManifest(filePath, pieceSize=PIECE_SIZE):
+    """
+    Generates the manifest of a file: the whole-file hash plus a SHA-256 hash of every piece and the Merkle root of them.
+    Downloaders use it to check every piece as soon as it arrives, without waiting for the whole file.
+    Parameters:
+    - filePath: The path to the file. E.g. "C:/Users/User/Documents/file.txt".
+    - pieceSize: The size (in bytes) of each piece. E.g. 1048576 bytes.
+    Returns:
+    - manifest: A dictionary in the form {"hash": "a1b2c3d4", "size": 1234, "pieceSize": 1048576, "pieces": [b"...", ...], "root": "e5f6a7b8"}
+    where pieces holds the 32 byte digest of every piece.
+    """
+    fileDigest = hashlib.sha256()
+    pieces = []
+    size = 0
+    with open(filePath, "rb", buffering=0) as file:
+        # A small file does not need a whole piece worth of buffer
+        buffer = bytearray(min(pieceSize, os.fstat(file.fileno()).st_size + 1))
+        view = memoryview(buffer)
+        if hasattr(os, "posix_fadvise"):
+            # The file is read once from start to end, the kernel can read further ahead
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            # A raw file can return less than asked for, so fill the whole piece before hashing it
+            length = 0
+            while length < pieceSize:
+                count = file.readinto(view[length:])
+                if not count:
+                    break
+                length += count
+            if length == 0:
+                break
+            fileDigest.update(view[:length])
+            pieces.append(hashlib.sha256(view[:length]).digest())
+            size += length
+            if length < pieceSize:
+                break
+    return {
+        "hash": fileDigest.hexdigest(),
+        "size": size,
+        "pieceSize": pieceSize,
+        "pieces": pieces,
+        "root": calculateMerkleRoot(pieces)
+    }
+
+# Returns the manifest of a shared file. Files that have not changed since they were last hashed are not read again.
+def getFileManifest(filePath):
+    return hashCache.getManifest(filePath, PIECE_SIZE, calculateFileManifest)
+
+# Returns the cached manifest of a file if the file has not changed, otherwise None
+def getCachedManifest(filePath):
+    return hashCache.getCached(filePath, PIECE_SIZE)
+
+# Hashes many files at the same time and yields (filePath, manifest, error) for each file as soon as it is ready
+def hashFiles(filePaths, calculate=getFileManifest, workers=HASH_WORKERS, cached=getCachedManifest):
+    """
+    Hashes files in a pool of worker threads. hashlib and file reads release the GIL, so the workers
+    use several cores and keep several disk reads going at once. At most twice as many files as there
+    are workers are in progress at a time, however many files there are.
+
+    Parameters:
+    - filePaths: The paths of the files to hash.
+    - calculate: The function that returns the manifest of one file.
+    - workers: How many files are hashed at the same time.
+    - cached: Returns the manifest of a file that does not need hashing, or None. Those files skip the pool. None turns this off.
+
+    Returns:
+    - A generator of (filePath, manifest, error) in the order the files are ready. error is None or the exception that stopped hashing the file.
+    """
+    if cached is not None:
+        # Unchanged files are answered from the cache right away, only the rest go to the pool
+        uncached = []
+        for filePath in filePaths:
+            try:
+                manifest = cached(filePath)
+            except OSError as e:
+                yield filePath, None, e
+                continue
+            if manifest is None:
+                uncached.append(filePath)
+            else:
+                yield filePath, manifest, None
+        filePaths = uncached
+    import concurrent.futures # Only needed once files are hashed, the headless commands that do not share start faster without it
+    filePaths = iter(filePaths)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as executor:
+        running = {}
+        for filePath in itertools.islice(filePaths, workers * 2):
+            running[executor.submit(calculate, filePath)] = filePath
+        while running:
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                filePath = running.pop(future)
+                error = future.exception()
+                yield filePath, None if error else future.result(), error
+                for nextPath in itertools.islice(filePaths, 1):
+                    running[executor.submit(calculate, nextPath)] = nextPath
+
+# Calculates the Merkle root of a list of piece digests. A node without a pair is moved up to the next level as it is.
+def calculateMerkleRoot(pieces):
+    if not pieces:
+        return hashlib.sha256(b"").hexdigest()
+    level = list(pieces)
+    while len(level) > 1:
+        nextLevel = [hashlib.sha256(level[index] + level[index + 1]).digest() for index in range(0, len(level) - 1, 2)]
+        if len(level) % 2 == 1:
+            nextLevel.append(level[-1])
+        level = nextLevel
+    return level[0].hex()
+
+# This function sends the data of a file to the server, right after the FILE frame that announces it
+def divideFileIntoChunksAndSendChunks(client, filePath, chunkSize, offset=0, flow=None):
+    """
+    Splits the file into smaller chunks for efficient transfer
+
+    Parameters:
+    - client: The socket created for this client
+    - filePath: The path to the file to be divided into chunks. E.g. "C:/Users/User/Documents/file.txt".
+    - chunkSize: The size (in bytes) of each chunk when the file cannot be sent with sendfile. E.g. 262144 bytes.
+    - offset: The position in the file to start sending from. Used when the downloader resumes an interrupted download.
+    - flow: The upload's ratelimit.Flow, None sends at full speed.
+
+    Returns:
+    - None """
+    try:
+        length = os.path.getsize(filePath) - offset
+        sendFileRange(client, filePath, offset, length, chunkSize, reportProgress=True, flow=flow)
+        print("File send to the server")
+    except FileNotFoundError:
+        print("Check the file name and try again")
+    except Exception as e: 
+        print(f"Try again, error: {e}")
+
+# This function sends one byte range of a file without closing the connection
+def sendFileRange(sock, filePath, offset, length, chunkSize=CHUNK_SIZE, reportProgress=False, zeroCopy=True, flow=None):
+    """
+    Sends length bytes of the file starting at offset.
+    Where the operating system supports it the kernel copies the file straight to the socket with sendfile (zero-copy).
+    Otherwise the file is read into one reusable buffer of chunkSize bytes and sent with sendall.
+
+    Parameters:
+    - sock: The connection to the peer or the server.
+    - filePath: The path to the file. E.g. "C:/Users/User/Documents/file.txt".
+    - offset: The position of the first byte to send.
+    - length: The number of bytes to send.
+    - chunkSize: The size (in bytes) of each read when sendfile cannot be used. E.g. 262144 bytes.
+    - reportProgress: Print the progress at most once every PROGRESS_INTERVAL seconds.
+    - zeroCopy: Use sendfile when it is available.
+    - flow: The upload's ratelimit.Flow. A limited flow sends one quantum at a time at the pace of uploadScheduler.
+
+    Returns:
+    - None """
+    progress = SendProgress(length) if reportProgress else None
+    if flow is not None and not flow.limited:
+        flow = None
+    with open(filePath, "rb", buffering=0) as file:
+        # Sockets with a timeout are non-blocking underneath, sendfile is only used on blocking sockets
+        if zeroCopy and hasattr(os, "sendfile") and sock.gettimeout() is None:
+            position = offset
+            end = offset + length
+            while position < end:
+                wanted = min(SENDFILE_BLOCK, end - position) if flow is None else flow.acquire(min(ratelimit.QUANTUM, end - position))
+                sent = os.sendfile(sock.fileno(), file.fileno(), position, wanted)
+                if flow is not None:
+                    flow.refund(wanted - sent)
+                if sent == 0:
+                    raise EOFError(f"{filePath} is shorter than expected")
+                position += sent
+                if progress:
+                    progress.update(sent)
+        else:
+            file.seek(offset)
+            buffer = bytearray(min(chunkSize, max(length, 1)))
+            view = memoryview(buffer)
+            remaining = length
+            while remaining > 0:
+                wanted = min(len(buffer), remaining) if flow is None else flow.acquire(min(len(buffer), ratelimit.QUANTUM, remaining))
+                count = file.readinto(view[:wanted])
+                if not count:
+                    raise EOFError(f"{filePath} is shorter than expected")
+                if flow is not None:
+                    flow.refund(wanted - count)
+                sock.sendall(view[:count])
+                remaining -= count
+                if progress:
+                    progress.update(count)
+    if progress:
+        progress.finish()
+
+class SendProgress:
+    """
+    Prints how far a file transfer is, at most once every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.start = time.time()
+        self.lastReport = self.start
+
+    def update(self, count):
+        self.sent += count
+        now = time.time()
+        if now - self.lastReport >= PROGRESS_INTERVAL:
+            self.lastReport = now
+            self.report(now)
+
+    def finish(self):
+        self.report(time.time())
+
+    def report(self, now):
+        speed = self.sent / max(now - self.start, 1e-6) / 1024 / 1024
+        percent = 100 * self.sent / self.total if self.total else 100
+        print(f"Sent {self.sent / 1024 / 1024:.1f}/{self.total / 1024 / 1024:.1f} MB ({percent:.0f}%), {speed:.1f} MB/s")
+
+#def reassembleFile(fileHash, fileName, chunkPaths):
+    """
+    Combines chunks into the complete file after downloading.
+
+    Parameters:
+    - fileHash: The hash value identifying the file. E.g. "a1b2c3d4".
+
+    Returns:
+    - filePath: The path to the reassembled file. E.g. "C:/Users/User/Documents/file.txt".
+    """
+
+
+
+def getFilePath(fileName):
+    try:
+        if(fileName):
+            path = os.path.join(sharedFolder, fileName)
+            #path = os.path.join(currentFileDirectory, fileName)
+            return path
+        else: 
+            return None
+    except FileNotFoundError as e:
+        print(f"File not found: {e}")
+
+def displayFileList():
+    requestCatalogSync(client)
+
+# Asks the tracker for the changes to the file list since the version fileCatalog is at
+def requestCatalogSync(client):
+    sendMessage(client, protocol.SYNCREQUEST, {"version": fileCatalog.version})
+
+# Applies a SYNC message from the tracker to fileCatalog
+def applyCatalogSync(message):
+    """
+    Patches fileCatalog with the files added and removed since the version it is at.
+
+    Parameters:
+    - message: The body of a SYNC message. E.g. {"from": 4, "version": 5, "snapshot": False, "added": [{"hash": "a1b2c3d4", "fileName": "test.txt"}], "removed": []}
+
+    Returns:
+    - applied: False if the message starts from a version fileCatalog is not at, then the missing changes have to be requested.
+    """
+    return fileCatalog.applySync(message)
+
+# Finds the hash of a file by its exact name, in the file list if it has been fetched, otherwise with a search on the tracker.
+# Other files whose names contain the same words may rank higher, so the search goes on page by page until the name is found.
+def findFileHash(fileName):
+    hashes = fileCatalog.findByName(fileName)
+    if hashes:
+        return min(hashes) # Files with the same name but other content have other hashes, any of them is fine
+    cursor = None
+    while True:
+        results, cursor, _ = searchFiles(client, fileName, cursor=cursor)
+        for result in results:
+            if fileName == result["fileName"]:
+                return result["hash"]
+        if cursor is None:
+            return None
+
+# Searches the tracker's catalog by file name, the whole catalog is never downloaded
+def searchFiles(client, query, limit=SEARCH_PAGE_SIZE, cursor=None):
+    """
+    Parameters:
+    - client: The socket connected to the tracker server.
+    - query: Words of the file name. E.g. "test report" finds "Test_Report-2.pdf". Words can be the start or a part of a word of the name.
+    - limit: How many results to return.
+    - cursor: The cursor returned with the previous page, None for the first page.
+
+    Returns:
+    - results, cursor, total: The results in ranked order as dictionaries of hash, fileName, owners and size,
+    the cursor of the next page (None if there are no more results) and how many files match in total.
+    """
+    reply = sendRequest(client, protocol.SEARCH, {"query": query, "limit": limit, "cursor": cursor})
+    if reply is None:
+        print("The tracker did not answer the search")
+        return [], None, 0
+    if reply.type == protocol.ERROR:
+        print("Search failed: " + reply.body["message"])
+        return [], None, 0
+    for result in reply.body["results"]:
+        searchResults[result["hash"]] = result
+    return reply.body["results"], reply.body["cursor"], reply.body["total"]
+
+# Name of a file on the network, from the file list or from a search
+def getFileName(fileHash):
+    fileName = fileCatalog.get(fileHash)
+    if fileName is not None:
+        return fileName
+    if fileHash in searchResults:
+        return searchResults[fileHash]["fileName"]
+    return fileHash
+
+    
+
+def updateFileList(message):
+    #TODO: rewrite this. Requirements changed. This functionality needs to exist, but the implementation will be different.
+    """
+    Updates the file list to reflect new files that are added to the folder. i.e. a button that triggers the update and adds it to fileList = [].
+
+    Parameters: None
+
+    Returns: None
+    """
+    #message = client.recv(.decode("utf-8"))
+    counter = 0
+    for data in message:
+        if counter%2 == 0 > counter == 0:
+            counter += 1
+            fileCatalog.add(data, message[counter])
+        else:
+            counter += 1
+            continue
+    print(fileCatalog.items())
+
+
+def shareFileList(fileList):
+    #TODO: rewrite this. Requirements changed. This functionality needs to exist, but the implementation will be different.
+    """
+    Triggered when displayFileList() function from another peer requests a list of files.
+
+    Parameters:
+    - fileList: The list of files available for sharing. E.g. ["file1.txt", "file2.txt"].
+
+    Returns: None
+    """
+
+
+def enterUsername(usernameEntry):
+    status = "INVALID"
+    username = usernameEntry
+
+
+    sendMessage(client, protocol.NICKNAME, {"nickname": username})
+    status = FrameReader(client).readFrame()
+    if(status is not None and status.body["valid"]):
+        sendFileNamesToServer(client, username)
+    else:
+        print("Error: Invalid username, try again")
+        username = None
+    
+# Connects to the tracker. Returns True if the connection is up and the listener thread is running.
+# share=False connects without seeding or sharing the folder, for example to search or to download a file.
+def registerPeer(serverIP, port, username, share=True):
+    #serverIP = sys.argv[1]
+    #port = int(sys.argv[2])
+    global nickname
+    nickname = username
+    
+    global gport 
+    gport = int(port)
+    global gserverIP
+    gserverIP = serverIP
+    global client
+    closing.clear()
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if not connectToTargetServer(client, gserverIP, gport):
+        client.close()
+        return False
+    reader = FrameReader(client) # Every message from the server is read through this one reader
+    nickname = listenForNicknameStatus(client, reader, nickname, share)
+    if nickname is None:
+        client.close()
+        return False
+    # The file list is only fetched when the user asks to view it (displayFileList), files are found with searchFiles.
+    # Versions of an earlier connection mean nothing to this one, the tracker may have restarted.
+    fileCatalog.clear()
+    global listenerThread
+    listenerThread = threading.Thread(target=listenForServerConnection, args=(client, reader, gserverIP, gport,))
+    listenerThread.start()
+    return True
+
+# Tells the tracker this client is leaving, which removes its files from the catalog, and closes the connection.
+# The listener thread ends when the socket is shut down, the socket is only closed after that so its recv does not fail.
+def disconnect():
+    if client is None:
+        return
+    closing.set()
+    try:
+        if nickname:
+            sendMessage(client, protocol.DISCONNECT)
+        client.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass # The tracker has closed the connection already
+    finally:
+        if listenerThread is not None and listenerThread is not threading.current_thread():
+            listenerThread.join(LISTENER_JOIN_TIMEOUT)
+        client.close()
+
+# 3. File Exchange/Transfer
+
+# Names of the codecs this client can decompress and wants relayed files compressed with
+def offeredCodecs():
+    names = [name.strip() for name in COMPRESSION.split(",")]
+    return [name for name in names if transfercodec.getCodec(name) is not None]
+
+# This function sends request to the target server about the file the client wants to download
+# The target server checks if any currently connected client has the file
+def requestFile(client, fileHash):
+    """
+    Send a request to the tracker server.
+    If an earlier download of the file was interrupted, the request tells where to continue from.
+    """
+    offset = getResumeOffset(getDownloadFileName(getFileName(fileHash)), fileHash)
+    if offset > 0:
+        print(f"Resuming the download from byte {offset}")
+    waiter = [threading.Event(), None]
+    with transfersLock:
+        downloadResults[fileHash] = waiter
+        requestId = sendMessage(client, protocol.DOWNLOADREQUEST, {"hash": fileHash, "offset": offset, "codecs": offeredCodecs()})
+        downloadRequests[requestId] = fileHash
+    print("File request send")
+    return waiter
+
+# Tells whoever waits for the download of a file (see waitForDownload) that it has ended
+def finishDownload(fileHash, success):
+    with transfersLock:
+        for requestId in [requestId for requestId, requestedHash in downloadRequests.items() if requestedHash == fileHash]:
+            del downloadRequests[requestId]
+        waiter = downloadResults.pop(fileHash, None)
+    if waiter is not None:
+        waiter[1] = success
+        waiter[0].set()
+
+# Waits until a download started with downloadFile has ended.
+# Returns True if the file is on disk, False if the download failed and None if it did not end within timeout seconds.
+def waitForDownload(waiter, timeout=None):
+    waiter[0].wait(timeout)
+    return waiter[1]
+
+# This function sends the information about file which is uploaded to the target server which saves
+# that information into database that is JSON format.
+# Client sends their own username, name of the file and hash value of the file
+def uploadFile(client, username, fileName):
+    filePath = getFilePath(fileName)
+    if (filePath):
+        manifest = getFileManifest(filePath)
+        fileHash = manifest["hash"]
+        try:
+            sendMessage(client, protocol.UPLOADREQUEST, {
+                "owner": username,
+                "fileName": fileName,
+                "hash": fileHash,
+                "size": manifest["size"],
+                "pieceSize": manifest["pieceSize"],
+                "root": manifest["root"]
+            })
+            sharedFiles[fileHash] = fileName
+            sharedManifests[fileHash] = manifest
+            print("Upload request sent successfully")
+        except Exception as error: 
+            print(f"Upload request failed, error{error}")
+    else:
+        print("File path not found!")
+
+# Shares many files with one ANNOUNCE message per ANNOUNCE_BATCH files instead of one UPLOADREQUEST per file
+def announceFiles(client, username, fileNames):
+    """
+    Tells the tracker about many shared files at once. The tracker adds each message to its catalog in one go
+    and notifies the other clients once. The files are hashed in parallel (see hashFiles) and announced while
+    the rest are still being hashed, at least every ANNOUNCE_INTERVAL seconds.
+
+    Parameters:
+    - client: The socket connected to the tracker server.
+    - username: The nickname of this client.
+    - fileNames: Names of the files in the files folder. E.g. ["test.txt", "test.pdf"].
+
+    Returns:
+    - announced: The number of files announced.
+    """
+    batch = []
+    announced = 0
+    lastAnnounce = time.monotonic()
+    fileNamesByPath = {getFilePath(fileName): fileName for fileName in fileNames}
+    for filePath, manifest, error in hashFiles(fileNamesByPath):
+        fileName = fileNamesByPath[filePath]
+        if error is not None:
+            print(f"Skipping {fileName}: {error}")
+            continue
+        sharedFiles[manifest["hash"]] = fileName
+        sharedManifests[manifest["hash"]] = manifest
+        batch.append({
+            "fileName": fileName,
+            "hash": manifest["hash"],
+            "size": manifest["size"],
+            "pieceSize": manifest["pieceSize"],
+            "root": manifest["root"]
+        })
+        if len(batch) == ANNOUNCE_BATCH or time.monotonic() - lastAnnounce >= ANNOUNCE_INTERVAL:
+            sendMessage(client, protocol.ANNOUNCE, {"files": batch})
+            announced += len(batch)
+            batch = []
+            lastAnnounce = time.monotonic()
+    if batch:
+        sendMessage(client, protocol.ANNOUNCE, {"files": batch})
+        announced += len(batch)
+    return announced
+
+def sendFileNamesToServer(client, username):
+    try:
+        filesDirPath = sharedFolder
+        fileList = [file for file in os.listdir(filesDirPath) if os.path.isfile(os.path.join(filesDirPath, file))]
+        if (len(fileList) > 0):
+            announced = announceFiles(client, username, fileList)
+            print(f"Shared {announced} file(s) with the network")
+    except Exception as e:
+        print(f"Error occured file sending file list: {e}")
+
+
+# This function tries to connect the client to the tracker server
+def connectToTargetServer(client, gserverIP, gport):
+    try:
+        client.connect((gserverIP, gport))
+        return True
+    except Exception as e: 
+        print(f"Exception occurred in connecting to the target server: {e}")
+        return False
+# This function listens for messages that are coming from the server and responds to them
+# based on the options it has which are FILELIST, UPLOAD, NEWFILE, FILESENDREQUEST, FILE
+
+
+def listenForNicknameStatus(client, reader, username, share=True):
+    print("Welcome to use the program!")
+    while True:
+        #username = input("Give your username: ")
+        sendMessage(client, protocol.NICKNAME, {"nickname": username})
+        status = reader.readFrame()
+        if status is None:
+            print("Server closed the connection")
+            return None
+        if(status.body["valid"]):
+            if share:
+                advertiseSeedingAddress(client)
+                sendFileNamesToServer(client, username)
+            break
+        else:
+            # Asking again with the same name would be refused forever, the user has to pick another one
+            print("Invalid username, try again")
+            return None
+    return username
+
+# Starts the seeding listener and tells the tracker where other peers can download this client's files from.
+# If the listener cannot be started nothing is advertised and the tracker relays this client's files instead.
+def advertiseSeedingAddress(client):
+    if not DIRECT_TRANSFERS:
+        return
+    host = client.getsockname()[0]
+    port = startSeedingListener(host)
+    if port is not None:
+        sendMessage(client, protocol.PEERADDRESS, {"host": host, "port": port})
+
+def listenForServerConnection(client, reader, serverIP, port):
+    """
+    messages server can be received from the target server:
+    FILELIST -- Updates the dictionary (fileCatalog) containing files that are available for sharing
+    SYNC -- Files added to or removed from the network since the version of fileCatalog, fileCatalog is patched with them
+    UPLOAD -- Tells the status of the uploading file info to the database
+    ANNOUNCED -- Tells how many of the files of an ANNOUNCE message were added
+    NEWFILE -- Server informs the client to update their fileCatalog because some other client has uploaded new files to the network
+    FILESENDREQUEST -- Client receives this request when some other client asks to download the file through the target server
+    -- When this message is received, the client opens a data channel for the transfer and sends the file over it (see sendRelayedFile)
+    TRANSFER -- The server relays a file to this client. It is received over a data channel of its own (see receiveRelayedFile)
+    PEERLIST -- Owners of the requested file that accept direct connections. The file is downloaded straight from them with downloadFromPeers
+    ERROR -- The server could not do what was asked
+    """
+
+    while True:
+        try:
+            # Here we receive the message from the tracker server and act according it
+            frame = reader.readFrame()
+            if frame is None:
+                if not closing.is_set():
+                    print("Connection to server closed, closing program..")
+                break
+            if deliverReply(frame):
+                continue # A reply somebody is waiting for in sendRequest, for example SEARCHRESULTS
+            option = frame.type
+            message = frame.body
+            if(option == protocol.FILELIST): # Here we update the list of files
+                print("Updating file list..")
+
+                for data in message["files"]:
+                    fileCatalog.add(data["hash"], data["fileName"])
+
+            elif(option == protocol.SYNC): # The tracker pushes every change of the file list, only the change is sent
+                if not applyCatalogSync(message):
+                    requestCatalogSync(client)
+
+            elif(option == protocol.UPLOAD): # 
+                uploadStatus = message["status"]
+                print("Upload state: " + uploadStatus)
+            elif(option == protocol.ANNOUNCED):
+                print(f"Tracker added {message['added']} shared file(s), {message['duplicates']} were already shared")
+                if message.get("rejected"):
+                    print(f"Tracker rejected {message['rejected']} file(s) with an invalid hash")
+            elif(option == protocol.NEWFILE):
+                print("Updating file list..")
+                requestCatalogSync(client)
+            elif(option == protocol.FILESENDREQUEST):
+                print(f"Received request for sending file to the server (transfer {message['transfer']})")
+                startTransfer("upload", message)
+
+            elif(option == protocol.PEERLIST):
+                peers = [(host, port) for host, port in message["peers"]]
+                threadDownload = threading.Thread(target=downloadFromPeers, args=(client, message["hash"], message["size"], message["pieceSize"], message["root"], peers), daemon=True)
+                threadDownload.start()
+
+            elif(option == protocol.TRANSFER):
+                startTransfer("download", message)
+
+            elif(option == protocol.ERROR):
+                print("Server error: " + message["message"])
+                with transfersLock:
+                    fileHash = downloadRequests.get(frame.requestId)
+                if fileHash is not None: # Nobody shares the requested file any more
+                    finishDownload(fileHash, False)
+        except ConnectionResetError:
+            print("Target server has closed the connection probably due crashing, enter 0 to exit the program")
+            break
+        except ConnectionAbortedError:
+            print("Connection to server closed, closing program..")
+            break
+        except Exception as e: 
+            if isinstance(e, OSError) and closing.is_set():
+                break # This client disconnected, the socket was shut down under the reader
+            print(f"Error occured: {e}")
+            fileCatalog.clear()
+            return
+
+# Runs one relayed transfer in a thread of its own, so the listener keeps reading the control connection
+# and any number of files can be sent and received at the same time
+def startTransfer(role, message):
+    with transfersLock:
+        activeTransfers[message["transfer"]] = (role, message["hash"])
+    target = sendRelayedFile if role == "upload" else receiveRelayedFile
+    threadTransfer = threading.Thread(target=runTransfer, args=(target, message), daemon=True)
+    threadTransfer.start()
+
+def runTransfer(target, message):
+    success = False
+    try:
+        success = target(message)
+    except Exception as e:
+        print(f"Transfer {message['transfer']} failed: {e}")
+    finally:
+        with transfersLock:
+            role, fileHash = activeTransfers.pop(message["transfer"], (None, None))
+        if role == "download":
+            finishDownload(fileHash, bool(success))
+
+# Opens a new connection to the tracker for the data of one transfer. The tracker recognises it by the transfer ID and token.
+def openDataChannel(transfer, token, role, address=None):
+    """
+    Parameters:
+    - transfer: The transfer ID from the FILESENDREQUEST or TRANSFER message.
+    - token: The token from the same message.
+    - role: "upload" or "download".
+    - address: (host, port) of the tracker running the transfer if it is not this client's tracker, e.g. the downloader's tracker in a cluster.
+
+    Returns:
+    - channel: The connected socket, the DATACHANNEL frame has been sent on it.
+    """
+    channel = socket.create_connection(tuple(address) if address else (gserverIP, gport), timeout=PEER_CONNECT_TIMEOUT)
+    channel.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    channel.settimeout(None)
+    sendFrame(channel, protocol.DATACHANNEL, {"transfer": transfer, "token": token, "role": role})
+    return channel
+
+# Sends a file the tracker asked for over a data channel of its own
+def sendRelayedFile(message):
+    """
+    Parameters:
+    - message: The FILESENDREQUEST message: {"hash", "offset", "transfer", "token", "codecs", "downloader"}, and "relay" when another tracker of the cluster runs the transfer.
+
+    Returns:
+    - None
+    """
+    fileHash = message["hash"]
+    offset = message.get("offset", 0)
+    filePath = getFilePath(sharedFiles.get(fileHash, fileCatalog.get(fileHash)))
+    if filePath is None:
+        print(f"Transfer {message['transfer']}: {fileHash} is not shared")
+        return
+    with uploadSlots:
+        channel = openDataChannel(message["transfer"], message["token"], "upload", message.get("relay"))
+        flow = None
+        try:
+            # The FILE frame tells how many bytes of file data follow it
+            length = os.path.getsize(filePath) - offset
+            flow = uploadScheduler.open((message.get("downloader"),), length)
+            with open(filePath, "rb") as file:
+                file.seek(offset)
+                sample = file.read(min(CHUNK_SIZE, length))
+            codec = transfercodec.chooseCodec(filePath, sample, message.get("codecs"))
+            header = {"hash": fileHash, "offset": offset, "length": length}
+            manifest = sharedManifests.get(fileHash)
+            if manifest is not None:
+                header["pieces"] = b"".join(manifest["pieces"]) # The downloader checks every piece with these
+            if codec is None:
+                channel.sendall(encodeFrame(protocol.FILE, header))
+                divideFileIntoChunksAndSendChunks(channel, filePath, CHUNK_SIZE, offset, flow)
+            else:
+                channel.sendall(encodeFrame(protocol.FILE, {**header, "codec": codec.name}))
+                stats = sendCompressedRange(channel, filePath, offset, length, codec, flow=flow)
+                print(f"File send to the server, {stats}")
+        finally:
+            if flow is not None:
+                flow.close()
+            channel.close()
+
+# Sends a byte range of a file as compressed blocks (see transfercodec.py) and closes the sending side when done,
+# the tracker relays a compressed transfer until the end of the stream because its size is only known at the end
+def sendCompressedRange(sock, filePath, offset, length, codec, chunkSize=CHUNK_SIZE, flow=None):
+    """
+    Parameters:
+    - sock: The data channel of the transfer.
+    - filePath: The path to the file. E.g. "C:/Users/User/Documents/file.txt".
+    - offset: The position of the first byte to send.
+    - length: The number of bytes of the file to send.
+    - codec: The transfercodec.Codec the blocks are compressed with.
+    - chunkSize: The size (in bytes) of the file data in each block. E.g. 262144 bytes.
+    - flow: The upload's ratelimit.Flow. The compressed blocks count against its limits, as that is what goes over the network.
+
+    Returns:
+    - stats: The transfercodec.CompressionStats of the transfer.
+    """
+    stats = transfercodec.CompressionStats(codec)
+    progress = SendProgress(length)
+    with open(filePath, "rb", buffering=0) as file:
+        file.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = file.read(min(chunkSize, transfercodec.BLOCK_SIZE, remaining))
+            if not data:
+                raise EOFError(f"{filePath} is shorter than expected")
+            block = transfercodec.encodeBlock(codec, data, stats)
+            if flow is not None and flow.limited:
+                flow.acquire(len(block))
+            sock.sendall(block)
+            remaining -= len(data)
+            progress.update(len(data))
+    progress.finish()
+    sock.shutdown(socket.SHUT_WR)
+    return stats
+
+# Limits the upload bandwidth, in bytes per second. None is no limit. Uploads that have already started keep the old limits.
+def setUploadLimits(rate=None, peerRate=None, transferRate=None):
+    global uploadScheduler
+    uploadScheduler = ratelimit.BandwidthScheduler(rate, peerRate, transferRate)
+
+# Receives a relayed file over a data channel of its own and writes it into the partial download of the file
+def receiveRelayedFile(message):
+    """
+    Parameters:
+    - message: The TRANSFER message: {"hash", "offset", "transfer", "token"}.
+
+    Returns:
+    - success: True if the whole file was received and matches its hash.
+    """
+    channel = openDataChannel(message["transfer"], message["token"], "download")
+    try:
+        channel.settimeout(TRANSFER_TIMEOUT)
+        reader = FrameReader(channel)
+        frame = reader.readFrame()
+        if frame is None or frame.type != protocol.FILE:
+            print(f"Transfer {message['transfer']}: the file did not arrive")
+            return False
+        header = frame.body
+        fileHash = header["hash"]
+        fileName = getFileName(fileHash)
+        codec = None
+        if header.get("codec"):
+            codec = transfercodec.getCodec(header["codec"])
+            if codec is None:
+                print(f"Transfer {message['transfer']}: unknown compression {header['codec']}")
+                return False
+        pieceHashes = getPieceHashes(header)
+        if pieceHashes is False:
+            print(f"Transfer {message['transfer']}: the piece hashes do not match the Merkle root of the file")
+            return False
+        download = PartialDownload(getDownloadFileName(fileName), fileHash, header["size"], header["pieceSize"])
+        if pieceHashes is not None and len(pieceHashes) != download.pieceCount:
+            print(f"Transfer {message['transfer']}: {len(pieceHashes)} piece hashes for {download.pieceCount} pieces")
+            download.close()
+            return False
+        print("Waiting for the file...")
+        try:
+            stats = transfercodec.CompressionStats(codec) if codec else None
+            receivedBytes, digest, failedPieces = receiveFile(reader, download, header["offset"], header["length"], codec, stats, pieceHashes)
+            if stats is not None:
+                print(f"Received compressed, {stats}")
+        except (OSError, ValueError) as e:
+            print(f"Error occured while receiving {fileName}: {e}")
+            download.close()
+            return False
+        success = False
+        if failedPieces:
+            download.close()
+            print(f"{len(failedPieces)} piece(s) did not match their hash, request the file again to fetch them again")
+        elif not download.isComplete():
+            download.close()
+            print("Download was interrupted, request the file again to resume it")
+        elif digest.hexdigest() != fileHash:
+            download.discard()
+            print("Received file does not match its hash and was deleted, request the file again")
+        else:
+            download.complete()
+            print("File received")
+            success = True
+        print("Received bytes: " + str(receivedBytes))
+        return success
+    finally:
+        channel.close()
+
+# Returns the piece hashes a FILE header carries, None if it has none and False if they do not match the Merkle root
+# the tracker has for the file. Piece hashes without a root come from the tracker's content cache, which has checked them.
+def getPieceHashes(header):
+    data = header.get("pieces")
+    if data is None:
+        return None
+    pieceHashes = [bytes(data[index:index + 32]) for index in range(0, len(data), 32)]
+    if header.get("root") and calculateMerkleRoot(pieceHashes) != header["root"]:
+        return False
+    return pieceHashes
+
+# Name of the local copy of a downloaded file. E.g. "test.pdf" -> "test_copy.pdf"
+def getDownloadFileName(fileName):
+    name, extension = os.path.splitext(os.path.basename(fileName)) # basename keeps names from other peers from pointing outside this folder
+    return os.path.join(downloadFolder, name + "_copy" + extension)
+
+# Receives the data that follows a FILE frame and writes it into the partial download, starting at offset.
+def receiveFile(reader, download, offset, length, codec=None, stats=None, pieceHashes=None):
+    """
+    Receives the file data into one reusable buffer and writes it sequentially into the .part file.
+    The SHA-256 of the file is updated while the data arrives, so it can be compared with the advertised
+    hash at the end without reading the file again. Every piece is marked done as soon as the stream has passed its end.
+    With pieceHashes every piece is checked first. A piece that does not match is cleared in the bitmap instead,
+    so the next request of the file fetches it again and the pieces that did match are kept.
+
+    Parameters:
+    - reader: The FrameReader of the connection the file data arrives from.
+    - download: The PartialDownload the data is written into.
+    - offset: The position in the file the data starts from.
+    - length: The number of bytes of the file that follow the FILE frame.
+    - codec: The transfercodec.Codec the data was compressed with, None for raw data.
+    - stats: transfercodec.CompressionStats that count the compressed blocks, or None.
+    - pieceHashes: The 32 byte SHA-256 of every piece of the file, or None to only mark the pieces done.
+
+    Returns:
+    - receivedBytes, digest, failedPieces: The number of bytes received, the SHA-256 of the file from its start up to the last byte received
+    and the pieces that did not match their hash.
+    """
+    digest = hashlib.sha256()
+    if offset > 0:
+        download.hashPrefix(digest, offset) # The bytes received before the download was interrupted
+    buffer = bytearray(RECEIVE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    position = offset
+    end = offset + length
+    piece = (offset + download.pieceSize - 1) // download.pieceSize # First piece that starts inside the stream
+    pieceDigest = hashlib.sha256() # Of the part of the current piece received so far
+    failedPieces = []
+    while position < end:
+        if codec is None:
+            received = reader.recvInto(view, min(len(buffer), end - position))
+            if received == 0:
+                break # Connection was closed in the middle of the file
+            data = view[:received]
+        else:
+            # Every block decompresses on its own, so pieces are still written and marked done as the blocks arrive
+            try:
+                data = transfercodec.readBlock(codec, reader.readExactly, stats, end - position)
+            except protocol.ProtocolError:
+                break # Connection was closed in the middle of the file or sent a malformed block
+            if len(data) > end - position:
+                raise ValueError("Compressed transfer is longer than the file")
+            received = len(data)
+        download.write(position, data)
+        digest.update(data)
+        start = position
+        position += received
+        while piece < download.pieceCount and download.pieceEnd(piece) <= position:
+            if pieceHashes is None:
+                download.markDone(piece)
+            else:
+                pieceDigest.update(memoryview(data)[max(0, piece * download.pieceSize - start):download.pieceEnd(piece) - start])
+                if pieceDigest.digest() == pieceHashes[piece]:
+                    download.markDone(piece)
+                else:
+                    download.clearPiece(piece)
+                    failedPieces.append(piece)
+                pieceDigest = hashlib.sha256()
+            piece += 1
+        if pieceHashes is not None and piece < download.pieceCount and piece * download.pieceSize < position:
+            pieceDigest.update(memoryview(data)[max(0, piece * download.pieceSize - start):])
+    return position - offset, digest, failedPieces
+
+class PartialDownload:
+    """
+    A download that can be resumed after it has been interrupted.
+
+    The data is written straight into a preallocated "<file>.part" file. The pieces that are completely on
+    disk are recorded in a small "<file>.part.state" sidecar next to it: one JSON header line with the hash,
+    size and piece size of the file, followed by a bitmap with one bit per piece. When the same file is
+    downloaded again the pieces whose bit is set are kept and only the missing ones are fetched. Once every
+    piece is there the .part file is renamed to its final name and the sidecar is removed.
+    """
+
+    def __init__(self, filePath, fileHash, fileSize, pieceSize):
+        self.filePath = filePath
+        self.partPath = filePath + ".part"
+        self.statePath = self.partPath + ".state"
+        self.fileHash = fileHash
+        self.fileSize = fileSize
+        self.pieceSize = pieceSize
+        self.pieceCount = (fileSize + pieceSize - 1) // pieceSize
+        self.lock = threading.Lock()
+
+        header = {"hash": fileHash, "size": fileSize, "pieceSize": pieceSize}
+        headerLine = (json.dumps(header) + "\n").encode("utf-8")
+        self.headerLength = len(headerLine)
+        state = readPartialState(self.statePath)
+        if state is not None and state[0] == header and os.path.isfile(self.partPath) and os.path.getsize(self.partPath) == fileSize:
+            self.bitmap = bytearray(state[1].ljust((self.pieceCount + 7) // 8, b"\0"))
+            self.file = open(self.partPath, "r+b")
+        else:
+            # Nothing usable from earlier, start over with an empty preallocated file
+            self.bitmap = bytearray((self.pieceCount + 7) // 8)
+            self.file = open(self.partPath, "w+b")
+            self.file.truncate(fileSize)
+            if hasattr(os, "posix_fallocate") and fileSize > 0:
+                try:
+                    os.posix_fallocate(self.file.fileno(), 0, fileSize)
+                except OSError:
+                    pass # File system cannot preallocate, the file stays sparse
+            with open(self.statePath, "wb") as stateFile:
+                stateFile.write(headerLine + self.bitmap)
+        self.stateFile = open(self.statePath, "r+b")
+
+    def pieceEnd(self, piece):
+        return min((piece + 1) * self.pieceSize, self.fileSize)
+
+    def hasPiece(self, piece):
+        return bool(self.bitmap[piece // 8] & (1 << (piece % 8)))
+
+    def missingPieces(self):
+        return [piece for piece in range(self.pieceCount) if not self.hasPiece(piece)]
+
+    def isComplete(self):
+        return all(self.hasPiece(piece) for piece in range(self.pieceCount))
+
+    # Writes data into the .part file at offset. Safe to call from several threads.
+    def write(self, offset, data):
+        with self.lock:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    # Records a piece as complete. The data is flushed first so the bitmap never claims data that is not in the file.
+    def markDone(self, piece):
+        with self.lock:
+            self.file.flush()
+            self.bitmap[piece // 8] |= 1 << (piece % 8)
+            self.stateFile.seek(self.headerLength + piece // 8)
+            self.stateFile.write(self.bitmap[piece // 8:piece // 8 + 1])
+            self.stateFile.flush()
+
+    # Records a piece as missing again, e.g. when data that did not match its hash has been written over it
+    def clearPiece(self, piece):
+        with self.lock:
+            self.bitmap[piece // 8] &= ~(1 << (piece % 8))
+            self.stateFile.seek(self.headerLength + piece // 8)
+            self.stateFile.write(self.bitmap[piece // 8:piece // 8 + 1])
+            self.stateFile.flush()
+
+    def close(self):
+        self.file.close()
+        self.stateFile.close()
+
+    # Adds the first length bytes of the .part file to a running hash
+    def hashPrefix(self, digest, length):
+        with self.lock:
+            self.file.flush()
+            with open(self.partPath, "rb", buffering=0) as file:
+                buffer = bytearray(RECEIVE_BUFFER_SIZE)
+                view = memoryview(buffer)
+                while length > 0:
+                    count = file.readinto(view[:min(len(buffer), length)])
+                    if not count:
+                        break
+                    digest.update(view[:count])
+                    length -= count
+
+    # Moves the finished download to its final name in one atomic rename and removes the sidecar
+    def complete(self):
+        self.close()
+        os.replace(self.partPath, self.filePath)
+        os.remove(self.statePath)
+
+    # Throws away a download that turned out to be corrupted, so the next attempt starts from the beginning
+    def discard(self):
+        self.close()
+        os.remove(self.partPath)
+        os.remove(self.statePath)
+
+# Reads the sidecar of a partial download. Returns (header, bitmap) or None if there is no usable sidecar.
+def readPartialState(statePath):
+    try:
+        with open(statePath, "rb") as stateFile:
+            header = json.loads(stateFile.readline().decode("utf-8"))
+            return header, stateFile.read()
+    except (OSError, ValueError):
+        return None
+
+# Tells where an interrupted download of the file can continue from: the start of its first missing piece.
+def getResumeOffset(filePath, fileHash):
+    state = readPartialState(filePath + ".part.state")
+    if state is None or state[0].get("hash") != fileHash or not os.path.isfile(filePath + ".part"):
+        return 0
+    header, bitmap = state
+    pieceCount = (header["size"] + header["pieceSize"] - 1) // header["pieceSize"]
+    for piece in range(pieceCount):
+        if piece // 8 >= len(bitmap) or not bitmap[piece // 8] & (1 << (piece % 8)):
+            return piece * header["pieceSize"]
+    return header["size"]
+
+# This function starts the seeding listener that other peers download files from directly
+def startSeedingListener(host):
+    """
+    Starts listening for direct download requests from other peers.
+
+    Parameters:
+    - host: The local address other peers can reach this client from. E.g. "192.168.1.10".
+
+    Returns:
+    - port: The port the listener is bound to, or None if incoming connections cannot be accepted.
+    """
+    global seedingListener
+    if seedingListener is not None:
+        return seedingListener.getsockname()[1]
+    try:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind((host, SEEDING_PORT))
+        listener.listen(16)
+    except OSError as e:
+        print(f"Seeding listener could not be started, the tracker will relay this client's files: {e}")
+        return None
+    seedingListener = listener
+    threadSeeding = threading.Thread(target=listenForPeerConnections, args=(listener,), daemon=True)
+    threadSeeding.start()
+    print(f"Seeding on {host}:{listener.getsockname()[1]}")
+    return listener.getsockname()[1]
+
+# Accepts direct connections from other peers, each one is served in its own thread
+def listenForPeerConnections(listener):
+    while True:
+        try:
+            peer, address = listener.accept()
+        except OSError:
+            break # Listener has been closed
+        threadPeer = threading.Thread(target=handlePeerConnection, args=(peer, address), daemon=True)
+        threadPeer.start()
+
+# Serves the direct download requests of one peer. The connection stays open so the peer can ask for many pieces.
+# PIECEREQUEST {"hash", "offset", "length"} is answered with a PIECE frame followed by that byte range of the file.
+# MANIFESTREQUEST {"hash"} is answered with a MANIFEST frame holding the 32 byte hash of every piece.
+def handlePeerConnection(peer, address):
+    reader = FrameReader(peer)
+    flow = uploadScheduler.open((address[0],)) # The pieces sent to one peer count against its per-peer limit together
+    try:
+        while True:
+            frame = reader.readFrame()
+            if frame is None:
+                break # Peer has finished downloading
+            message = frame.body
+            if frame.type == protocol.PIECEREQUEST:
+                filePath = getFilePath(sharedFiles.get(message["hash"]))
+                if filePath is None or not os.path.isfile(filePath):
+                    sendFrame(peer, protocol.ERROR, {"message": "File is not shared"}, frame.requestId)
+                    break
+                fileSize = os.path.getsize(filePath)
+                offset = message["offset"]
+                length = max(0, min(message["length"], fileSize - offset))
+                peer.sendall(encodeFrame(protocol.PIECE, {"length": length}, frame.requestId))
+                flow.small = fileSize <= ratelimit.SMALL_TRANSFER # Pieces of small files go ahead of the pieces of big ones
+                sendFileRange(peer, filePath, offset, length, flow=flow)
+            elif frame.type == protocol.MANIFESTREQUEST:
+                manifest = sharedManifests.get(message["hash"])
+                if manifest is None:
+                    sendFrame(peer, protocol.ERROR, {"message": "File is not shared"}, frame.requestId)
+                    break
+                sendFrame(peer, protocol.MANIFEST, {"pieces": b"".join(manifest["pieces"])}, frame.requestId)
+            else:
+                sendFrame(peer, protocol.ERROR, {"message": f"Unexpected message {frame.name}"}, frame.requestId)
+    except Exception as e:
+        print(f"Error occured while serving {address}: {e}")
+    finally:
+        flow.close()
+        peer.close()
+
+class SwarmDownload:
+    """
+    Downloads one file from every peer that has it at the same time.
+
+    The file is split into PIECE_SIZE pieces. Each peer gets its own connection and thread, which keeps taking
+    the next missing piece from a shared queue. All owners have the whole file, so this is round-robin
+    scheduling where faster peers simply end up fetching more pieces. A peer that fails or stays silent for
+    PIECE_TIMEOUT seconds is dropped and its piece goes back to the queue for the others. When the queue is
+    empty, idle peers also fetch the pieces still in flight (endgame), so one slow peer cannot hold up the end
+    of the download.
+
+    The pieces are written into a PartialDownload, so an interrupted swarm download continues with the
+    pieces that are still missing the next time the file is requested.
+
+    Before the download starts the piece hashes are fetched from a peer and checked against the Merkle root
+    the tracker stores for the file. Every piece is checked as soon as it lands, in the thread that received
+    it, and a piece that does not match is fetched again from another peer.
+    """
+
+    def __init__(self, fileHash, fileSize, peers, filePath, pieceSize=PIECE_SIZE, root=None):
+        self.fileHash = fileHash
+        self.fileSize = fileSize
+        self.peers = peers
+        self.filePath = filePath
+        self.pieceSize = pieceSize
+        self.root = root
+        self.pieceHashes = None
+        self.pieceCount = (fileSize + pieceSize - 1) // pieceSize
+        self.download = None
+        self.queue = collections.deque() # Pieces nobody is fetching
+        self.inFlight = {} # In the form: piece: (start time, number of peers fetching it)
+        self.done = set()
+        self.receivedFrom = {} # In the form: (host, port): bytes received
+        self.condition = threading.Condition()
+
+    def run(self):
+        """
+        Downloads the file into filePath.
+
+        Returns:
+        - True if every piece was received, False if the peers ran out before that.
+        """
+        if self.root is not None:
+            self.pieceHashes = self.fetchManifest()
+            if self.pieceHashes is None:
+                print("None of the peers could give a valid manifest for the file")
+                return False
+        self.download = PartialDownload(self.filePath, self.fileHash, self.fileSize, self.pieceSize)
+        for piece in range(self.pieceCount):
+            if self.download.hasPiece(piece):
+                self.done.add(piece)
+            else:
+                self.queue.append(piece)
+        if self.done:
+            print(f"Resuming the download, {len(self.done)}/{self.pieceCount} pieces are already on disk")
+        start = time.time()
+        workers = []
+        for peer in self.peers:
+            worker = threading.Thread(target=self.fetchFromPeer, args=(peer,), daemon=True)
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        elapsed = max(time.time() - start, 1e-6)
+        for peer, receivedBytes in self.receivedFrom.items():
+            print(f"Received {receivedBytes} bytes from {peer[0]}:{peer[1]}")
+        print(f"Swarm download: {len(self.done)}/{self.pieceCount} pieces from {len(self.peers)} peers, {sum(self.receivedFrom.values()) / elapsed / 1024 / 1024:.1f} MB/s")
+        if len(self.done) == self.pieceCount:
+            self.download.complete()
+            return True
+        self.download.close()
+        return False
+
+    # Fetches the piece hashes from the first peer whose list matches the Merkle root from the tracker
+    def fetchManifest(self):
+        for address in self.peers:
+            try:
+                with socket.create_connection(address, timeout=PEER_CONNECT_TIMEOUT) as peer:
+                    peer.settimeout(PIECE_TIMEOUT)
+                    sendFrame(peer, protocol.MANIFESTREQUEST, {"hash": self.fileHash})
+                    frame = FrameReader(peer).readFrame()
+                    if frame is None or frame.type != protocol.MANIFEST:
+                        raise ConnectionError(frame.body.get("message") if frame else "Connection closed")
+                    data = frame.body["pieces"]
+                    if len(data) != self.pieceCount * 32:
+                        raise ConnectionError("Manifest has the wrong number of pieces")
+                pieceHashes = [bytes(data[index:index + 32]) for index in range(0, len(data), 32)]
+                if calculateMerkleRoot(pieceHashes) == self.root:
+                    return pieceHashes
+                print(f"Manifest from {address[0]}:{address[1]} does not match the Merkle root")
+            except Exception as e:
+                print(f"Could not get the manifest from {address[0]}:{address[1]}: {e}")
+        return None
+
+    # Gives the next piece for a peer to fetch, or None when there is nothing left for it to do
+    def nextPiece(self):
+        with self.condition:
+            while len(self.done) < self.pieceCount:
+                if self.queue:
+                    piece = self.queue.popleft()
+                    self.inFlight[piece] = (time.time(), 1)
+                    return piece
+                # Endgame: help with the piece that has been in flight the longest
+                candidates = [piece for piece, (started, fetchers) in self.inFlight.items() if fetchers < 2]
+                if candidates:
+                    piece = min(candidates, key=lambda piece: self.inFlight[piece][0])
+                    started, fetchers = self.inFlight[piece]
+                    self.inFlight[piece] = (started, fetchers + 1)
+                    return piece
+                self.condition.wait(0.5)
+            return None
+
+    def pieceFinished(self, piece, address):
+        with self.condition:
+            if piece not in self.done:
+                self.receivedFrom[address] = self.receivedFrom.get(address, 0) + min(self.pieceSize, self.fileSize - piece * self.pieceSize)
+                self.download.markDone(piece)
+            self.done.add(piece)
+            self.inFlight.pop(piece, None)
+            self.condition.notify_all()
+
+    def pieceFailed(self, piece):
+        with self.condition:
+            if piece in self.done:
+                return
+            started, fetchers = self.inFlight.get(piece, (0, 1))
+            if fetchers > 1:
+                self.inFlight[piece] = (started, fetchers - 1)
+            else:
+                self.inFlight.pop(piece, None)
+                self.queue.appendleft(piece)
+            self.condition.notify_all()
+
+    # Requests one piece over an open connection and writes it to its place in the file
+    def fetchPiece(self, peer, reader, buffer, piece):
+        offset = piece * self.pieceSize
+        length = min(self.pieceSize, self.fileSize - offset)
+        sendFrame(peer, protocol.PIECEREQUEST, {"hash": self.fileHash, "offset": offset, "length": length}, piece)
+        frame = reader.readFrame()
+        if frame is None or frame.type != protocol.PIECE or frame.body["length"] != length:
+            raise ConnectionError(frame.body.get("message", "Wrong piece length") if frame else "Connection closed")
+        view = memoryview(buffer)[:length]
+        received = 0
+        while received < length:
+            count = reader.recvInto(view[received:])
+            if count == 0:
+                raise ConnectionError("Peer closed the connection in the middle of a piece")
+            received += count
+        if self.pieceHashes is not None and hashlib.sha256(view).digest() != self.pieceHashes[piece]:
+            raise ValueError(f"Piece {piece} does not match its hash")
+        self.download.write(offset, view)
+
+    # Thread that keeps fetching pieces from one peer until the file is complete or the peer fails
+    def fetchFromPeer(self, address):
+        piece = None
+        try:
+            with socket.create_connection(address, timeout=PEER_CONNECT_TIMEOUT) as peer:
+                peer.settimeout(PIECE_TIMEOUT)
+                reader = FrameReader(peer)
+                buffer = bytearray(self.pieceSize)
+                while True:
+                    piece = self.nextPiece()
+                    if piece is None:
+                        break
+                    self.fetchPiece(peer, reader, buffer, piece)
+                    self.pieceFinished(piece, address)
+                    piece = None
+        except Exception as e:
+            print(f"Dropping peer {address[0]}:{address[1]}: {e}")
+            if piece is not None:
+                self.pieceFailed(piece)
+
+# Downloads a file straight from its owners. If none of them can deliver it, the tracker is asked to relay the file instead.
+def downloadFromPeers(client, fileHash, fileSize, pieceSize, root, peers):
+    fileName = getFileName(fileHash)
+    print(f"Downloading the file directly from {len(peers)} peer(s)...")
+    swarm = SwarmDownload(fileHash, fileSize, peers, getDownloadFileName(fileName), pieceSize, root)
+    try:
+        if swarm.run():
+            print("File received")
+            finishDownload(fileHash, True)
+            return
+    except Exception as e:
+        print(f"Error occured while downloading from peers: {e}")
+    print("Direct download failed, asking the tracker to relay the rest of the file")
+    offset = getResumeOffset(getDownloadFileName(fileName), fileHash)
+    with transfersLock:
+        requestId = sendMessage(client, protocol.RELAYREQUEST, {"hash": fileHash, "offset": offset, "codecs": offeredCodecs()})
+        downloadRequests[requestId] = fileHash
+
+#TODO: Add in the functions from above to the main below to make them work.
+# Main
+def printFileList():
+    index = 0
+    for hash, fileName in fileCatalog.items(): 
+       print(fileName, index)
+       index = index + 1
+
+# Starts downloading a file. Returns the waiter to pass to waitForDownload, or None if there is no such file.
+def downloadFile(requestedFileHash):
+    print("Download file..")
+    # The tracker answers with an ERROR if nobody shares the file any more
+    if requestedFileHash is None:
+        print("File not found, search for it to see the files that are available")
+        return None
+    return requestFile(client, requestedFileHash)
+
+
+       
@@ -0,0 +1,410 @@
+# DS Final project
+# Wire protocol shared by the tracker server and the clients.
+# Sources:
+# 1. MessagePack specification (the body encoding is a subset of it): https://github.com/msgpack/msgpack/blob/master/spec.md
+# 2. Python struct documentation: https://docs.python.org/3/library/struct.html
+
+
+'''
+Every message is one frame:
+
+    +----------------+--------------+-----------------+----------------------+
+    | body length u32| type u8      | request ID u32  | body (length bytes)  |
+    +----------------+--------------+-----------------+----------------------+
+
+All numbers are big-endian. The body is a MessagePack encoded value, normally a map such as
+{"hash": "a1b2c3d4", "offset": 0}. Replies carry the request ID of the request they answer.
+A FILE or PIECE frame is followed by exactly body["length"] bytes of raw file data, which lets
+the data be sent and relayed without copying it through the frame encoder.
+
+1. encodeFrame: Takes the message type, the body and the request ID as parameters and returns the frame as bytes.
+2. sendFrame: Takes a socket, the message type, the body and the request ID as parameters and sends the frame.
+3. FrameReader: Buffered reader that takes frames out of a socket one by one, several frames can arrive in one recv.
+4. AsyncFrameReader: The same reader for non-blocking sockets driven by an asyncio event loop (used by the tracker server).
+5. packValue / unpackValue: Encode and decode the MessagePack subset used for the bodies.
+'''
+
+import struct
+
+# Message types. The names are the ones used before the protocol had frames.
+NICKNAME = 1            # Client -> server: {"nickname"}
+NICKNAMESTATUS = 2      # Server -> client: {"valid"}
+PEERADDRESS = 3         # Client -> server: {"host", "port"} of the client's seeding listener
+UPLOADREQUEST = 4       # Client -> server: {"owner", "fileName", "hash", "size", "pieceSize", "root"}
+UPLOAD = 5              # Server -> client: {"status"}
+FILELISTREQUEST = 6     # Client -> server: {}
+FILELIST = 7            # Server -> client: {"files": [{"hash", "fileName"}, ...]}
+NEWFILE = 8             # Server -> client: {}
+DOWNLOADREQUEST = 9     # Client -> server: {"hash", "offset", "codecs"}, codecs are the compression codecs the client can decompress
+PEERLIST = 10           # Server -> client: {"hash", "size", "pieceSize", "root", "peers": [[host, port], ...]}
+RELAYREQUEST = 11       # Client -> server: {"hash", "offset", "codecs"}
+FILESENDREQUEST = 12    # Server -> uploader: {"hash", "offset", "transfer", "token", "codecs", "downloader"}, send the file over a data channel
+FILE = 13               # Uploader -> server -> downloader on data channels: {"hash", "offset", "length", "codec", "pieces", "root", ...} followed by the data, in compressed blocks if codec is set
+DISCONNECT = 14         # Client -> server: {}
+ERROR = 15              # Either way: {"message"}
+PIECEREQUEST = 16       # Peer -> seeder: {"hash", "offset", "length"}
+PIECE = 17              # Seeder -> peer: {"length"} followed by the data
+MANIFESTREQUEST = 18    # Peer -> seeder: {"hash"}
+MANIFEST = 19           # Seeder -> peer: {"pieces": <32 byte digest of every piece, concatenated>}
+SYNCREQUEST = 20        # Client -> server: {"version"} of the catalog the client has, None if it has nothing yet
+SYNC = 21               # Server -> client: {"from", "version", "snapshot", "added": [{"hash", "fileName"}, ...], "removed": [hash, ...]}
+ANNOUNCE = 22           # Client -> server: {"files": [{"fileName", "hash", "size", "pieceSize", "root"}, ...]}, many files in one message
+ANNOUNCED = 23          # Server -> client: {"added", "duplicates", "rejected"} counts of one ANNOUNCE, rejected files have an invalid hash
+TRANSFER = 24           # Server -> downloader: {"transfer", "token", "hash", "offset"}, fetch the relayed file over a data channel
+DATACHANNEL = 25        # Client -> server, first frame of a new connection: {"transfer", "token", "role": "upload" or "download"}
+SEARCH = 26             # Client -> server: {"query", "limit", "cursor"}, cursor is None for the first page
+SEARCHRESULTS = 27      # Server -> client: {"results": [{"hash", "fileName", "owners", "size"}, ...], "cursor", "total"}, cursor is None on the last page
+
+# Messages between the trackers of a multi-tracker deployment (see sharding.py). They also use SEARCH -> SEARCHRESULTS with
+# "ranks" and without "cursor", FILELISTREQUEST -> FILELIST for the shard's files, NEWFILE when a shard has changed,
+# FILESENDREQUEST with "uploader" to reach a client of another tracker, and ERROR.
+NODE = 28               # Tracker -> tracker, first frame of a new connection and its reply: {"node", "nodes", "secret"}, the sender's address, the trackers it knows and the cluster's secret if it has one
+SHARDANNOUNCE = 29      # Home tracker -> shard's tracker: {"owner", "home", "address", "files": [...]}, files of a client of the home tracker. Answered with ANNOUNCED
+SHARDOWNER = 30         # Home tracker -> trackers: {"owner", "home", "address"}, the client's seeding address has changed
+SHARDFORGET = 31        # Home tracker -> trackers: {"owner"}, the client has left and its files are removed
+SHARDLOOKUP = 32        # Home tracker -> shard's tracker: {"hash"}
+SHARDRECORDS = 33       # Shard's tracker -> home tracker: {"records": [{"hash", "owner", "fileName", "size", "pieceSize", "root", "home", "address"}, ...]}
+CLAIM = 34              # Home tracker -> nickname's tracker: {"nickname", "home"}, answered with NICKNAMESTATUS. Nicknames are unique in the whole cluster
+RELEASE = 35            # Home tracker -> nickname's tracker: {"nickname", "home"}, the client has left
+LEAVE = 36              # Tracker -> trackers: {"node"}, the tracker has left the cluster and is taken off the ring
+
+MESSAGE_NAMES = {value: name for name, value in list(globals().items()) if name.isupper() and isinstance(value, int)}
+
+HEADER = struct.Struct("!IBI")
+MAX_FRAME_SIZE = 64 * 1024 * 1024 # Larger frames are treated as a broken connection
+READ_SIZE = 64 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Frame:
+    __slots__ = ("type", "requestId", "body")
+
+    def __init__(self, type, requestId, body):
+        self.type = type
+        self.requestId = requestId
+        self.body = body
+
+    @property
+    def name(self):
+        return MESSAGE_NAMES.get(self.type, str(self.type))
+
+
+# Builds one frame
+def encodeFrame(type, body=None, requestId=0):
+    data = packValue({} if body is None else body)
+    return HEADER.pack(len(data), type, requestId) + data
+
+
+# Sends one frame. The lock keeps frames from different threads from being mixed on the same socket.
+def sendFrame(sock, type, body=None, requestId=0, lock=None):
+    frame = encodeFrame(type, body, requestId)
+    if lock is None:
+        sock.sendall(frame)
+    else:
+        with lock:
+            sock.sendall(frame)
+
+
+class FrameReader:
+    """
+    Reads frames from a socket through one buffer.
+
+    A single recv can bring in many frames (for example a client sending a batch of requests at once)
+    or only part of one. readFrame() hands them out one at a time, and recvInto() gives out raw data
+    that follows a FILE or PIECE frame, including the part of it that is already in the buffer.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.position = 0 # Start of the unread data in buffer
+
+    def buffered(self):
+        return len(self.buffer) - self.position
+
+    def fill(self):
+        # Drop what has been read already before the buffer grows
+        if self.position:
+            del self.buffer[:self.position]
+            self.position = 0
+        data = self.sock.recv(READ_SIZE)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    # Tells how many bytes the next frame needs in total, or the header size if not even the header is here yet
+    def needed(self):
+        if self.buffered() < HEADER.size:
+            return HEADER.size
+        length = HEADER.unpack_from(self.buffer, self.position)[0]
+        if length > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Frame of {length} bytes is too large")
+        return HEADER.size + length
+
+    # Takes the next frame out of the buffer, or returns None if it has not arrived completely yet
+    def takeFrame(self):
+        if self.buffered() < self.needed():
+            return None
+        length, type, requestId = HEADER.unpack_from(self.buffer, self.position)
+        start = self.position + HEADER.size
+        body = unpackValue(bytes(self.buffer[start:start + length]))
+        self.position = start + length
+        return Frame(type, requestId, body)
+
+    def readFrame(self):
+        """
+        Returns the next frame, or None if the connection was closed between frames.
+        """
+        frame = self.takeFrame()
+        while frame is None:
+            if not self.fill():
+                if self.buffered():
+                    raise ProtocolError("Connection closed in the middle of a frame")
+                return None
+            frame = self.takeFrame()
+        return frame
+
+    # Takes up to limit bytes of raw data that are already in the buffer
+    def takeBuffered(self, limit):
+        count = min(limit, self.buffered())
+        data = bytes(self.buffer[self.position:self.position + count])
+        self.position += count
+        return data
+
+    # Works like socket.recv_into, but gives out the buffered data first
+    def recvInto(self, view, size=0):
+        size = size or len(view)
+        if self.buffered():
+            data = self.takeBuffered(size)
+            view[:len(data)] = data
+            return len(data)
+        return self.sock.recv_into(view, size)
+
+    # Reads exactly size bytes of raw data
+    def readExactly(self, size):
+        data = bytearray(size)
+        view = memoryview(data)
+        received = 0
+        while received < size:
+            count = self.recvInto(view[received:])
+            if count == 0:
+                raise ProtocolError("Connection closed in the middle of the data")
+            received += count
+        return bytes(data)
+
+
+class AsyncFrameReader(FrameReader):
+    """
+    FrameReader for a non-blocking socket served by an asyncio event loop.
+
+    Waiting for the next frame has no time limit, so idle connections can stay open for as long as they like.
+    Once a frame has started to arrive the rest of it has to come within frameTimeout seconds.
+    """
+
+    def __init__(self, sock, frameTimeout=None):
+        super().__init__(sock)
+        self.frameTimeout = frameTimeout
+
+    async def fill(self):
+        if self.position:
+            del self.buffer[:self.position]
+            self.position = 0
+        import asyncio # Imported here so the clients, which only use blocking sockets, start without loading asyncio
+        loop = asyncio.get_running_loop()
+        if self.buffered() and self.frameTimeout is not None:
+            data = await asyncio.wait_for(loop.sock_recv(self.sock, READ_SIZE), self.frameTimeout)
+        else:
+            data = await loop.sock_recv(self.sock, READ_SIZE)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    async def readFrame(self):
+        frame = self.takeFrame()
+        while frame is None:
+            if not await self.fill():
+                if self.buffered():
+                    raise ProtocolError("Connection closed in the middle of a frame")
+                return None
+            frame = self.takeFrame()
+        return frame
+
+    async def recvInto(self, view, size=0):
+        size = size or len(view)
+        if self.buffered():
+            data = self.takeBuffered(size)
+            view[:len(data)] = data
+            return len(data)
+        import asyncio
+        return await asyncio.get_running_loop().sock_recv_into(self.sock, memoryview(view)[:size])
+
+
+# MessagePack subset: None, bool, int, float, str, bytes, list/tuple and dict
+def packValue(value):
+    output = bytearray()
+    packInto(output, value)
+    return bytes(output)
+
+
+def packInto(output, value):
+    if value is None:
+        output.append(0xc0)
+    elif value is True:
+        output.append(0xc3)
+    elif value is False:
+        output.append(0xc2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            output.append(value)
+        elif -32 <= value < 0:
+            output.append(value & 0xff)
+        elif value >= 0:
+            for code, format, limit in ((0xcc, "!BB", 0xff), (0xcd, "!BH", 0xffff), (0xce, "!BI", 0xffffffff), (0xcf, "!BQ", 0xffffffffffffffff)):
+                if value <= limit:
+                    output += struct.pack(format, code, value)
+                    break
+            else:
+                raise ProtocolError(f"Integer {value} is too large")
+        else:
+            for code, format, limit in ((0xd0, "!Bb", 0x80), (0xd1, "!Bh", 0x8000), (0xd2, "!Bi", 0x80000000), (0xd3, "!Bq", 0x8000000000000000)):
+                if value >= -limit:
+                    output += struct.pack(format, code, value)
+                    break
+            else:
+                raise ProtocolError(f"Integer {value} is too large")
+    elif isinstance(value, float):
+        output += struct.pack("!Bd", 0xcb, value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        if len(data) < 32:
+            output.append(0xa0 | len(data))
+        else:
+            packLength(output, len(data), 0xd9, 0xda, 0xdb)
+        output += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        packLength(output, len(value), 0xc4, 0xc5, 0xc6)
+        output += value
+    elif isinstance(value, (list, tuple)):
+        if len(value) < 16:
+            output.append(0x90 | len(value))
+        else:
+            packLength(output, len(value), None, 0xdc, 0xdd)
+        for item in value:
+            packInto(output, item)
+    elif isinstance(value, dict):
+        if len(value) < 16:
+            output.append(0x80 | len(value))
+        else:
+            packLength(output, len(value), None, 0xde, 0xdf)
+        for key, item in value.items():
+            packInto(output, key)
+            packInto(output, item)
+    else:
+        raise ProtocolError(f"Cannot encode {type(value).__name__}")
+
+
+def packLength(output, length, code8, code16, code32):
+    if code8 is not None and length < 0x100:
+        output += struct.pack("!BB", code8, length)
+    elif length < 0x10000:
+        output += struct.pack("!BH", code16, length)
+    else:
+        output += struct.pack("!BI", code32, length)
+
+
+# Every malformed body raises ProtocolError, so readers only have to catch that one
+def unpackValue(data):
+    try:
+        value, position = unpackFrom(data, 0)
+    except RecursionError:
+        raise ProtocolError("Body is nested too deeply")
+    if position != len(data):
+        raise ProtocolError("Extra data after the body")
+    return value
+
+
+# Fixed size formats of the MessagePack types that are not "fix" types
+SIZED = {
+    0xcc: "!B", 0xcd: "!H", 0xce: "!I", 0xcf: "!Q",
+    0xd0: "!b", 0xd1: "!h", 0xd2: "!i", 0xd3: "!q",
+    0xca: "!f", 0xcb: "!d",
+}
+LENGTHS = {0xd9: "!B", 0xda: "!H", 0xdb: "!I", 0xc4: "!B", 0xc5: "!H", 0xc6: "!I", 0xdc: "!H", 0xdd: "!I", 0xde: "!H", 0xdf: "!I"}
+
+
+def unpackFrom(data, position):
+    try:
+        code = data[position]
+    except IndexError:
+        raise ProtocolError("Body ends too early")
+    position += 1
+    if code < 0x80:
+        return code, position
+    if code >= 0xe0:
+        return code - 0x100, position
+    if 0xa0 <= code <= 0xbf:
+        length = code & 0x1f
+        return decodeText(readBytes(data, position, length)), position + length
+    if 0x90 <= code <= 0x9f:
+        return unpackArray(data, position, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return unpackMap(data, position, code & 0x0f)
+    if code == 0xc0:
+        return None, position
+    if code == 0xc2:
+        return False, position
+    if code == 0xc3:
+        return True, position
+    if code in SIZED:
+        size = struct.calcsize(SIZED[code])
+        return struct.unpack_from(SIZED[code], readBytes(data, position, size))[0], position + size
+    if code in LENGTHS:
+        size = struct.calcsize(LENGTHS[code])
+        length = struct.unpack_from(LENGTHS[code], readBytes(data, position, size))[0]
+        position += size
+        if code in (0xd9, 0xda, 0xdb):
+            return decodeText(readBytes(data, position, length)), position + length
+        if code in (0xc4, 0xc5, 0xc6):
+            return readBytes(data, position, length), position + length
+        if code in (0xdc, 0xdd):
+            return unpackArray(data, position, length)
+        return unpackMap(data, position, length)
+    raise ProtocolError(f"Unsupported type code 0x{code:02x}")
+
+
+def readBytes(data, position, length):
+    if position + length > len(data):
+        raise ProtocolError("Body ends too early")
+    return bytes(data[position:position + length])
+
+
+def decodeText(data):
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise ProtocolError("String is not valid UTF-8")
+
+
+def unpackArray(data, position, length):
+    items = []
+    for _ in range(length):
+        item, position = unpackFrom(data, position)
+        items.append(item)
+    return items, position
+
+
+def unpackMap(data, position, length):
+    items = {}
+    for _ in range(length):
+        key, position = unpackFrom(data, position)
+        item, position = unpackFrom(data, position)
+        try:
+            items[key] = item
+        except TypeError:
+            raise ProtocolError(f"Map key of type {type(key).__name__} cannot be used")
+    return items, position
@@ -0,0 +1,238 @@
+# DS Final project
+# Bandwidth scheduling for file transfers: token buckets for global, per-peer and per-transfer rate limits, and
+# deficit round robin between the transfers that share the global limit. Used by the tracker's relay (relay.py)
+# and by the peer's sender (peer.py).
+# Sources:
+# 1. Token bucket: https://en.wikipedia.org/wiki/Token_bucket
+# 2. M. Shreedhar and G. Varghese, Efficient Fair Queuing using Deficit Round Robin, SIGCOMM 1995
+
+
+'''
+1. parseRate: Takes a rate like "10M" (bytes per second) as a parameter and returns it as a number, None for no limit.
+2. TokenBucket: Refills at rate bytes per second up to burst bytes. reserve(n) takes n bytes and tells how long to wait for them.
+3. Flow: One transfer in a BandwidthScheduler: its own bucket, the buckets of its peers and its deficit counter.
+   - acquire / acquireAsync: Wait until the next amount bytes may be sent, from a thread or from an asyncio coroutine.
+   - refund: Gives back bytes that were granted but not sent.
+4. BandwidthScheduler: Hands out the bandwidth of a global limit to the flows that wait for it.
+   Small transfers (at most SMALL_TRANSFER bytes) are served before bulk ones, so they finish quickly under load.
+   Between flows of the same class the bytes are shared with deficit round robin: every flow gets QUANTUM bytes per round.
+
+Without any limit acquire returns at once and the callers keep their fastest path (splice, sendfile).
+'''
+
+import asyncio
+import collections
+import threading
+import time
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+QUANTUM = 64 * 1024 # Bytes a flow may send per round of the deficit round robin, also the largest amount asked for at a time
+BURST_SECONDS = 0.1 # A bucket holds this many seconds worth of its rate, so an idle flow cannot send a long burst afterwards
+SMALL_TRANSFER = 4 * 1024 * 1024 # Transfers of at most this many bytes go ahead of the bulk ones
+
+
+def parseRate(text):
+    if text is None or str(text).strip().lower() in ("", "0", "none", "off"):
+        return None
+    text = str(text).strip().upper().removesuffix("/S").removesuffix("B")
+    if text[-1] in UNITS:
+        return float(text[:-1]) * UNITS[text[-1]]
+    return float(text)
+
+
+class TokenBucket:
+    '''
+    rate bytes per second with bursts of up to burst bytes. Safe to use from several threads.
+
+    reserve() always takes the bytes, the bucket may go below zero. The caller waits the returned time, so the
+    requests are served in the order they came in and nobody has to poll.
+    '''
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(self.rate * BURST_SECONDS, QUANTUM)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Takes amount bytes and returns the seconds until they are covered
+    def reserve(self, amount):
+        with self.lock:
+            self.refill(time.monotonic())
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def refund(self, amount):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + amount)
+
+
+class Flow:
+    '''One transfer of a BandwidthScheduler. Asks for its bytes one chunk at a time and has one request waiting at most.'''
+    __slots__ = ("scheduler", "peers", "size", "small", "buckets", "deficit", "amount", "waiter", "sent")
+
+    def __init__(self, scheduler, peers, size, buckets):
+        self.scheduler = scheduler
+        self.peers = peers
+        self.size = size
+        self.small = size is not None and size <= SMALL_TRANSFER
+        self.buckets = buckets # The per-transfer and per-peer buckets this flow is limited by
+        self.deficit = 0 # Bytes the flow may still send in this round of the deficit round robin
+        self.amount = 0 # Size of the waiting request
+        self.waiter = None # Called with the amount when the request is granted
+        self.sent = 0
+
+    @property
+    def limited(self):
+        return bool(self.buckets) or self.scheduler.bucket is not None
+
+    # Seconds to wait for the flow's own limits
+    def localDelay(self, amount):
+        delay = 0.0
+        for bucket in self.buckets:
+            delay = max(delay, bucket.reserve(amount))
+        return delay
+
+    # Blocks the calling thread until amount bytes may be sent. Returns amount.
+    def acquire(self, amount):
+        delay = self.localDelay(amount)
+        if delay:
+            time.sleep(delay)
+        if self.scheduler.bucket is not None:
+            granted = threading.Event()
+            self.scheduler.enqueue(self, amount, lambda amount: granted.set())
+            granted.wait()
+        self.sent += amount
+        return amount
+
+    # Waits on the event loop until amount bytes may be sent. Returns amount.
+    async def acquireAsync(self, amount):
+        delay = self.localDelay(amount)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.scheduler.bucket is not None:
+            loop = asyncio.get_running_loop()
+            granted = loop.create_future()
+
+            def grant(amount):
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(amount))
+
+            self.scheduler.enqueue(self, amount, grant)
+            await granted
+        self.sent += amount
+        return amount
+
+    # Gives back granted bytes that were not sent, e.g. the uploader had less data than asked for
+    def refund(self, amount):
+        if amount <= 0:
+            return
+        self.sent -= amount
+        for bucket in self.buckets:
+            bucket.refund(amount)
+        if self.scheduler.bucket is not None:
+            self.scheduler.bucket.refund(amount)
+
+    def close(self):
+        self.scheduler.close(self)
+
+
+class BandwidthScheduler:
+    '''
+    Global, per-peer and per-transfer rate limits of the transfers of one program. Any of them can be None (no limit).
+
+    Only the global limit is shared by all flows, so only it needs a scheduler: the flows that wait for it queue up
+    in two deficit round robin queues, small transfers first. A dispatcher thread hands out the bytes in that order
+    as the global bucket refills. Per-peer buckets are shared by the flows of the same peer and dropped with the last one.
+    '''
+
+    def __init__(self, rate=None, peerRate=None, transferRate=None, quantum=QUANTUM):
+        self.bucket = TokenBucket(rate) if rate else None
+        self.peerRate = peerRate
+        self.transferRate = transferRate
+        self.quantum = quantum
+        self.peerBuckets = {} # In the form: peer: [TokenBucket, number of open flows]
+        self.queues = (collections.deque(), collections.deque()) # Flows waiting for the global bucket: small, bulk
+        self.condition = threading.Condition()
+        self.dispatcher = None
+
+    @property
+    def limited(self):
+        return bool(self.bucket or self.peerRate or self.transferRate)
+
+    # Starts a flow for one transfer. peers are the ones the per-peer limit applies to, size is the transfer's length if known.
+    def open(self, peers=(), size=None, rate=None):
+        buckets = []
+        rate = rate or self.transferRate
+        if rate:
+            buckets.append(TokenBucket(rate))
+        if self.peerRate:
+            with self.condition:
+                for peer in peers:
+                    entry = self.peerBuckets.get(peer)
+                    if entry is None:
+                        entry = self.peerBuckets[peer] = [TokenBucket(self.peerRate), 0]
+                    entry[1] += 1
+                    buckets.append(entry[0])
+        return Flow(self, tuple(peers) if self.peerRate else (), size, buckets)
+
+    def close(self, flow):
+        with self.condition:
+            for peer in flow.peers:
+                entry = self.peerBuckets.get(peer)
+                if entry is not None:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del self.peerBuckets[peer]
+            for queue in self.queues:
+                if flow in queue:
+                    queue.remove(flow)
+            flow.peers = ()
+
+    def enqueue(self, flow, amount, waiter):
+        with self.condition:
+            flow.amount = amount
+            flow.waiter = waiter
+            self.queues[0 if flow.small else 1].append(flow)
+            if self.dispatcher is None:
+                self.dispatcher = threading.Thread(target=self.dispatch, name="bandwidth", daemon=True)
+                self.dispatcher.start()
+            self.condition.notify()
+
+    # Deficit round robin: the flow at the head gets a quantum per round until its deficit covers its request
+    def nextFlow(self):
+        for queue in self.queues:
+            while queue:
+                flow = queue.popleft()
+                flow.deficit += self.quantum
+                if flow.deficit >= flow.amount:
+                    flow.deficit = min(flow.deficit - flow.amount, self.quantum) # Unused credit is not saved up
+                    return flow
+                queue.append(flow)
+        return None
+
+    def waiting(self):
+        return sum(len(queue) for queue in self.queues)
+
+    # Dispatcher thread: grants the waiting requests in round robin order as fast as the global bucket allows.
+    # A grant puts the bucket in debt and the next flow is picked only once the debt is paid, so a small transfer
+    # that asks again in the meantime is still served first.
+    def dispatch(self):
+        while True:
+            with self.condition:
+                while not self.waiting():
+                    self.condition.wait()
+            delay = self.bucket.reserve(0)
+            if delay:
+                time.sleep(delay)
+            with self.condition:
+                flow = self.nextFlow()
+                if flow is None: # Closed while waiting
+                    continue
+                amount, waiter = flow.amount, flow.waiter
+                flow.waiter = None
+            self.bucket.reserve(amount)
+            waiter(amount)
@@ -0,0 +1,307 @@
+# DS Final project
+# Streaming relay used by the tracker server to forward file data from an uploader to a downloader.
+# Sources:
+# 1. splice(2) manual page: https://man7.org/linux/man-pages/man2/splice.2.html
+# 2. Python os.splice documentation: https://docs.python.org/3/library/os.html#os.splice
+
+
+'''
+1. canSplice: Takes two sockets as parameters and tells whether they can be relayed with zero-copy splice.
+2. relayStream: Takes the uploader and downloader sockets as parameters and forwards bytes between them as they arrive.
+3. spliceStream: Zero-copy relay (Linux). Moves the data socket -> pipe -> socket inside the kernel.
+4. copyStream: Portable relay. Moves the data through one reusable buffer with recv_into and sendall.
+5. relayStreamAsync: relayStream for non-blocking sockets owned by an asyncio event loop (used by the tracker server).
+6. spliceStreamAsync: Non-blocking splice that waits on the event loop instead of blocking a thread.
+7. copyStreamAsync: Portable asyncio relay through one reusable buffer. Can also hand a copy of the data to a sink (the tracker's content cache).
+8. scheduledStreamAsync: asyncio relay limited by a bandwidth scheduler flow (ratelimit.py), one quantum at a time.
+9. sendFileAsync: Sends a byte range of a file to a non-blocking socket with sendfile, waiting on the event loop when the socket is full.
+'''
+
+import asyncio
+import errno
+import os
+
+import ratelimit
+
+try:
+    import fcntl
+except ImportError: # Windows does not have fcntl
+    fcntl = None
+
+# The relay never holds more than this many bytes of a file at a time, no matter how big the file is.
+# When the downloader is slower than the uploader the buffer fills up, the relay stops reading and
+# TCP flow control slows the uploader down (backpressure).
+RELAY_BUFFER_SIZE = 256 * 1024
+SPLICE_FLAGS = getattr(os, "SPLICE_F_MOVE", 0) | getattr(os, "SPLICE_F_MORE", 0)
+SPLICE_NONBLOCK_FLAGS = SPLICE_FLAGS | getattr(os, "SPLICE_F_NONBLOCK", 0)
+# An asyncio relay gives up when neither side makes progress for this many seconds
+RELAY_IDLE_TIMEOUT = 60
+
+
+# Tells whether the zero-copy path can be used for these sockets
+def canSplice(source, destination):
+    if not hasattr(os, "splice"):
+        return False
+    # Sockets with a timeout are non-blocking underneath, splice would fail with EAGAIN on them
+    return source.gettimeout() is None and destination.gettimeout() is None
+
+
+# Forwards bytes from the uploader to the downloader as they arrive
+def relayStream(source, destination, count=None, bufferSize=RELAY_BUFFER_SIZE):
+    """
+    Forwards bytes from source to destination until source reaches EOF or count bytes have been relayed.
+
+    Parameters:
+    - source: The uploader's socket.
+    - destination: The downloader's socket.
+    - count: How many bytes to relay. None relays until EOF.
+    - bufferSize: The size of the bounded relay buffer in bytes.
+
+    Returns:
+    - relayed: The number of bytes relayed.
+    """
+    if canSplice(source, destination):
+        relayed = spliceStream(source, destination, count, bufferSize)
+        if relayed is not None:
+            return relayed
+    return copyStream(source, destination, count, bufferSize)
+
+
+# Zero-copy relay, the file data never enters the Python process.
+# Returns None if the kernel refuses to splice these sockets before anything was moved.
+def spliceStream(source, destination, count=None, bufferSize=RELAY_BUFFER_SIZE):
+    pipeRead, pipeWrite = openPipe(bufferSize)
+    try:
+        sourceFd = source.fileno()
+        destinationFd = destination.fileno()
+        relayed = 0
+        while count is None or relayed < count:
+            wanted = bufferSize if count is None else min(bufferSize, count - relayed)
+            try:
+                received = os.splice(sourceFd, pipeWrite, wanted, flags=SPLICE_FLAGS)
+            except OSError as e:
+                if relayed == 0 and e.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+                    return None
+                raise
+            if received == 0: # Uploader has closed its side
+                break
+            pending = received
+            while pending:
+                pending -= os.splice(pipeRead, destinationFd, pending, flags=SPLICE_FLAGS)
+            relayed += received
+        return relayed
+    finally:
+        os.close(pipeRead)
+        os.close(pipeWrite)
+
+
+# Portable relay through one reusable buffer
+def copyStream(source, destination, count=None, bufferSize=RELAY_BUFFER_SIZE):
+    buffer = bytearray(bufferSize)
+    view = memoryview(buffer)
+    relayed = 0
+    while count is None or relayed < count:
+        wanted = bufferSize if count is None else min(bufferSize, count - relayed)
+        received = source.recv_into(view, wanted)
+        if received == 0:
+            break
+        destination.sendall(view[:received])
+        relayed += received
+    return relayed
+
+
+# Opens the pipe used by splice and makes it as big as the relay buffer
+def openPipe(bufferSize, blocking=True):
+    pipeRead, pipeWrite = os.pipe()
+    if not blocking:
+        os.set_blocking(pipeRead, False)
+        os.set_blocking(pipeWrite, False)
+    if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(pipeWrite, fcntl.F_SETPIPE_SZ, bufferSize)
+        except OSError:
+            pass # Keep the default pipe size (64 KiB) if the limit is lower than bufferSize
+    return pipeRead, pipeWrite
+
+
+# Forwards bytes between two sockets of an asyncio event loop
+async def relayStreamAsync(source, destination, count=None, bufferSize=RELAY_BUFFER_SIZE, timeout=RELAY_IDLE_TIMEOUT, flow=None, sink=None):
+    """
+    Forwards bytes from source to destination without blocking the event loop.
+
+    Parameters:
+    - source: The uploader's socket (non-blocking).
+    - destination: The downloader's socket (non-blocking).
+    - count: How many bytes to relay. None relays until EOF.
+    - bufferSize: The size of the bounded relay buffer in bytes.
+    - timeout: Seconds without progress after which asyncio.TimeoutError is raised.
+    - flow: The transfer's ratelimit.Flow. A limited flow is relayed at the scheduler's pace, otherwise at full speed.
+    - sink: Gets a copy of every relayed block with sink.write, e.g. a contentcache.CacheWriter. The data then goes through a buffer instead of splice.
+
+    Returns:
+    - relayed: The number of bytes relayed.
+    """
+    if flow is not None and flow.limited:
+        return await scheduledStreamAsync(source, destination, flow, count, timeout, sink)
+    if sink is not None:
+        return await copyStreamAsync(source, destination, count, bufferSize, timeout, sink)
+    if hasattr(os, "splice"):
+        relayed = await spliceStreamAsync(source, destination, count, bufferSize, timeout)
+        if relayed is not None:
+            return relayed
+    return await copyStreamAsync(source, destination, count, bufferSize, timeout)
+
+
+# Waits until one of the file descriptors is ready: readFd to be read or writeFd to be written
+async def waitReady(loop, readFd, writeFd, timeout):
+    ready = loop.create_future()
+
+    def wake():
+        if not ready.done():
+            ready.set_result(None)
+
+    if readFd is not None:
+        loop.add_reader(readFd, wake)
+    if writeFd is not None:
+        loop.add_writer(writeFd, wake)
+    try:
+        await asyncio.wait_for(ready, timeout)
+    finally:
+        if readFd is not None:
+            loop.remove_reader(readFd)
+        if writeFd is not None:
+            loop.remove_writer(writeFd)
+
+
+# Zero-copy asyncio relay. Both splice calls are non-blocking, when neither can move anything the relay
+# waits on the event loop until the uploader has data or the downloader has room.
+# Returns None if the kernel refuses to splice these sockets before anything was moved.
+async def spliceStreamAsync(source, destination, count=None, bufferSize=RELAY_BUFFER_SIZE, timeout=RELAY_IDLE_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    pipeRead, pipeWrite = openPipe(bufferSize, blocking=False)
+    try:
+        sourceFd = source.fileno()
+        destinationFd = destination.fileno()
+        pulled = 0 # Bytes moved from the uploader into the pipe
+        relayed = 0 # Bytes moved from the pipe to the downloader
+        finished = False
+        while not finished or pulled > relayed:
+            moved = False
+            if not finished and pulled - relayed < bufferSize:
+                wanted = bufferSize - (pulled - relayed)
+                if count is not None:
+                    wanted = min(wanted, count - pulled)
+                try:
+                    received = os.splice(sourceFd, pipeWrite, wanted, flags=SPLICE_NONBLOCK_FLAGS)
+                    if received == 0: # Uploader has closed its side
+                        finished = True
+                    pulled += received
+                    moved = True
+                except BlockingIOError:
+                    pass
+                except OSError as e:
+                    if pulled == 0 and e.errno in (errno.EINVAL, errno.EOPNOTSUPP):
+                        return None
+                    raise
+                if count is not None and pulled >= count:
+                    finished = True
+            if pulled > relayed:
+                try:
+                    relayed += os.splice(pipeRead, destinationFd, pulled - relayed, flags=SPLICE_NONBLOCK_FLAGS)
+                    moved = True
+                except BlockingIOError:
+                    pass
+            if not moved:
+                canPull = not finished and pulled - relayed < bufferSize
+                await waitReady(loop, sourceFd if canPull else None, destinationFd if pulled > relayed else None, timeout)
+        return relayed
+    finally:
+        os.close(pipeRead)
+        os.close(pipeWrite)
+
+
+# Portable asyncio relay through one reusable buffer
+async def copyStreamAsync(source, destination, count=None, bufferSize=RELAY_BUFFER_SIZE, timeout=RELAY_IDLE_TIMEOUT, sink=None):
+    loop = asyncio.get_running_loop()
+    buffer = bytearray(bufferSize)
+    view = memoryview(buffer)
+    relayed = 0
+    while count is None or relayed < count:
+        wanted = bufferSize if count is None else min(bufferSize, count - relayed)
+        received = await asyncio.wait_for(loop.sock_recv_into(source, view[:wanted]), timeout)
+        if received == 0:
+            break
+        await asyncio.wait_for(loop.sock_sendall(destination, view[:received]), timeout)
+        if sink is not None:
+            sink.write(view[:received])
+        relayed += received
+    return relayed
+
+
+# Rate limited asyncio relay. Asks the flow for at most one quantum only when the uploader has data, so a stalled
+# uploader does not hold bandwidth the other transfers could use. Bytes granted but not received are given back.
+async def scheduledStreamAsync(source, destination, flow, count=None, timeout=RELAY_IDLE_TIMEOUT, sink=None):
+    loop = asyncio.get_running_loop()
+    buffer = bytearray(ratelimit.QUANTUM)
+    view = memoryview(buffer)
+    relayed = 0
+    while count is None or relayed < count:
+        await waitReady(loop, source.fileno(), None, timeout)
+        wanted = await flow.acquireAsync(len(buffer) if count is None else min(len(buffer), count - relayed))
+        try:
+            received = source.recv_into(view[:wanted])
+        except BlockingIOError:
+            received = -1
+        flow.refund(wanted - max(received, 0))
+        if received == 0:
+            break
+        if received > 0:
+            await asyncio.wait_for(loop.sock_sendall(destination, view[:received]), timeout)
+            if sink is not None:
+                sink.write(view[:received])
+            relayed += received
+    return relayed
+
+
+# Sends count bytes of an open file from offset to a socket of an asyncio event loop. Zero-copy where sendfile is available.
+# Like the relay it gives up only when the downloader takes nothing for timeout seconds, however long the whole file takes.
+async def sendFileAsync(destination, file, offset, count, timeout=RELAY_IDLE_TIMEOUT, flow=None):
+    loop = asyncio.get_running_loop()
+    if flow is not None and not flow.limited:
+        flow = None
+    if not hasattr(os, "sendfile"):
+        buffer = bytearray(ratelimit.QUANTUM if flow is not None else RELAY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        file.seek(offset)
+        sent = 0
+        while sent < count:
+            wanted = min(len(buffer), count - sent)
+            if flow is not None:
+                await flow.acquireAsync(wanted)
+            read = file.readinto(view[:wanted])
+            if not read:
+                raise EOFError(f"{file.name} is shorter than expected")
+            await asyncio.wait_for(loop.sock_sendall(destination, view[:read]), timeout)
+            sent += read
+        return sent
+    destinationFd = destination.fileno()
+    sent = 0
+    while sent < count:
+        if flow is not None:
+            await waitReady(loop, None, destinationFd, timeout)
+            wanted = await flow.acquireAsync(min(ratelimit.QUANTUM, count - sent))
+        else:
+            wanted = count - sent
+        try:
+            moved = os.sendfile(destinationFd, file.fileno(), offset + sent, wanted)
+        except BlockingIOError:
+            moved = None
+        if flow is not None:
+            flow.refund(wanted - (moved or 0))
+        if moved == 0:
+            raise EOFError(f"{file.name} is shorter than expected")
+        if moved is None:
+            await waitReady(loop, None, destinationFd, timeout)
+        else:
+            sent += moved
+    return sent
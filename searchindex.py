@@ -0,0 +1,127 @@
+# DS Final project
+# Inverted index of file names for the tracker's SEARCH message, so clients can find files without downloading the whole catalog.
+
+
+'''
+1. tokenize: Takes a file name or a query as a parameter and returns its lowercase words. E.g. "Test_Report-2.PDF" -> ["test", "report", "2", "pdf"]
+2. trigrams: Takes a word as a parameter and returns the three letter substrings of it.
+3. SearchIndex: File names by hash, indexed by word. The words themselves are indexed by trigram and by their first
+   one or two letters, so a query word also finds the names with a longer word that starts with it or contains it.
+   - add / remove: Index or forget the name of a file.
+   - match: Returns the files whose name matches every word of a query, with a score of how well they match.
+'''
+
+import re
+
+WORD = re.compile(r"[^\W_]+")
+EXACT, PREFIX, INFIX = 3, 2, 1 # Score of a query word that is a word of the name, the start of one or inside one
+SHORT_PREFIX = 2 # Query words shorter than a trigram are matched as prefixes of the name's words
+
+
+def tokenize(text):
+    return WORD.findall(text.lower())
+
+
+def trigrams(word):
+    return {word[index:index + 3] for index in range(len(word) - 2)}
+
+
+class SearchIndex:
+    '''
+    Name index of the catalog's files.
+
+    Every name costs one entry per word in postings. Trigrams and short prefixes index the distinct words only,
+    which are far fewer than the files, so the index stays small for catalogs of millions of files.
+    '''
+
+    def __init__(self):
+        self.names = {} # In the form: hash: fileName
+        self.postings = {} # In the form: word: set of hashes
+        self.grams = {} # In the form: trigram: set of words
+        self.prefixes = {} # In the form: first one or two letters: set of words
+
+    def __len__(self):
+        return len(self.names)
+
+    # Indexes the name of a file, a file that is already indexed gets the new name
+    def add(self, fileHash, fileName):
+        if fileHash in self.names:
+            self.remove(fileHash)
+        self.names[fileHash] = fileName
+        for word in set(tokenize(fileName)):
+            hashes = self.postings.get(word)
+            if hashes is None:
+                hashes = self.postings[word] = set()
+                for gram in trigrams(word):
+                    self.insert(self.grams, gram, word)
+                for length in range(1, min(SHORT_PREFIX, len(word)) + 1):
+                    self.insert(self.prefixes, word[:length], word)
+            hashes.add(fileHash)
+
+    def remove(self, fileHash):
+        fileName = self.names.pop(fileHash, None)
+        if fileName is None:
+            return
+        for word in set(tokenize(fileName)):
+            hashes = self.postings[word]
+            hashes.discard(fileHash)
+            if hashes:
+                continue
+            # No file uses the word any more, it is dropped from the word indexes too
+            del self.postings[word]
+            for gram in trigrams(word):
+                self.discard(self.grams, gram, word)
+            for length in range(1, min(SHORT_PREFIX, len(word)) + 1):
+                self.discard(self.prefixes, word[:length], word)
+
+    @staticmethod
+    def insert(index, key, word):
+        words = index.get(key)
+        if words is None:
+            index[key] = {word}
+        else:
+            words.add(word)
+
+    @staticmethod
+    def discard(index, key, word):
+        words = index[key]
+        words.discard(word)
+        if not words:
+            del index[key]
+
+    # Returns the indexed words that contain the query word, starting from the rarest of its trigrams
+    def findWords(self, term):
+        if len(term) <= SHORT_PREFIX:
+            return self.prefixes.get(term, ())
+        sets = sorted((self.grams.get(gram, set()) for gram in trigrams(term)), key=len)
+        words = set(sets[0])
+        for other in sets[1:]:
+            words &= other
+        return [word for word in words if term in word]
+
+    # Returns {hash: score} of the files whose name matches every word of the query.
+    # A query word scores EXACT, PREFIX or INFIX for the best matching word of the name and the scores are added up.
+    def match(self, query):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return {}
+        scores = None
+        for term in terms:
+            termScores = {}
+            for word in self.findWords(term):
+                score = EXACT if word == term else PREFIX if word.startswith(term) else INFIX
+                for fileHash in self.postings[word]:
+                    if termScores.get(fileHash, 0) < score:
+                        termScores[fileHash] = score
+            if scores is None:
+                scores = termScores
+            else:
+                scores = {fileHash: score + termScores[fileHash] for fileHash, score in scores.items() if fileHash in termScores}
+            if not scores:
+                return {}
+        # The whole name typed in exactly comes first
+        wanted = query.strip().lower()
+        for fileHash in scores:
+            if self.names[fileHash].lower() == wanted:
+                scores[fileHash] += EXACT * len(terms)
+        return scores
@@ -0,0 +1,318 @@
+# DS Final project
+# Multi-tracker mode. Several tracker servers split the catalog between them by consistent hashing of the file hash:
+# every file hash (and every nickname) belongs to the one tracker whose point follows it on a hash ring.
+# Clients stay connected to their home tracker, which forwards what belongs to other shards to the tracker that owns it.
+# Sources:
+# 1. D. Karger et al., Consistent Hashing and Random Trees, STOC 1997
+# 2. Consistent hashing: https://en.wikipedia.org/wiki/Consistent_hashing
+
+
+'''
+1. parseNode: Takes a tracker address "host:port" as a parameter and returns (host, port).
+2. HashRing: Consistent hash ring with VIRTUAL_NODES points per tracker. owner(key) is the tracker of the first point after the key.
+   Adding a tracker to N others moves only about 1/(N+1) of the keys, all of them to the new tracker.
+3. NodeLink: Connection from this tracker to another one. A request gets a request ID and the reply with the same ID is its answer.
+4. Cluster: The trackers of the deployment: this tracker's address, the ring and a NodeLink to each of the others.
+   Trackers tell each other the addresses they know when they connect, so a new tracker only has to know one of the others.
+   admits decides whether a NODE frame comes from a tracker of the cluster, forget takes a tracker that has left off the ring.
+'''
+
+import asyncio
+import bisect
+import hashlib
+import hmac
+import itertools
+import socket
+
+import protocol
+from fanout import Connection
+from protocol import AsyncFrameReader, encodeFrame
+
+VIRTUAL_NODES = 128 # Points per tracker on the ring, more points spread the keys more evenly
+NODE_TIMEOUT = 5 # Seconds another tracker has to connect and to answer a request
+
+
+class ClusterError(Exception):
+    '''Another tracker answered a request with an ERROR.'''
+
+
+def parseNode(node):
+    host, _, port = node.rpartition(":")
+    return host, int(port)
+
+
+# Position of a key on the ring. Keys are file hashes and nicknames, hashing them again spreads both evenly.
+def ringPosition(key):
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    '''Trackers on a consistent hash ring. owner(key) takes O(log(points)) time.'''
+
+    def __init__(self, nodes=(), virtualNodes=VIRTUAL_NODES):
+        self.virtualNodes = virtualNodes
+        self.nodes = set()
+        self.positions = [] # Sorted positions of the points
+        self.owners = [] # Tracker of each point, in the same order
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    # Adds a tracker. Returns False if it was already on the ring.
+    def add(self, node):
+        if node in self.nodes:
+            return False
+        self.nodes.add(node)
+        for replica in range(self.virtualNodes):
+            position = ringPosition(f"{node}#{replica}")
+            index = bisect.bisect(self.positions, position)
+            self.positions.insert(index, position)
+            self.owners.insert(index, node)
+        return True
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return False
+        self.nodes.discard(node)
+        points = [(position, owner) for position, owner in zip(self.positions, self.owners) if owner != node]
+        self.positions = [position for position, _ in points]
+        self.owners = [owner for _, owner in points]
+        return True
+
+    # Returns the tracker the key belongs to, None if the ring is empty
+    def owner(self, key):
+        if not self.positions:
+            return None
+        index = bisect.bisect(self.positions, ringPosition(key)) % len(self.positions)
+        return self.owners[index]
+
+
+class NodeLink:
+    '''
+    This tracker's connection to another tracker, opened on first use and again after it breaks.
+
+    The connection starts with a NODE frame carrying this tracker's address and the trackers it knows, the other
+    tracker answers with the ones it knows. Requests and replies are frames of protocol.py matched by request ID.
+    '''
+
+    def __init__(self, cluster, node):
+        self.cluster = cluster
+        self.node = node
+        self.connection = None
+        self.replies = {} # In the form: request ID: future of the reply frame
+        self.requestIds = itertools.count(1)
+        self.lock = None # Only one coroutine connects at a time, created on the event loop
+
+    async def connect(self):
+        if self.connection is not None and not self.connection.closed:
+            return self.connection
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.connection is not None and not self.connection.closed:
+                return self.connection
+            loop = asyncio.get_running_loop()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, parseNode(self.node)), NODE_TIMEOUT)
+            except BaseException:
+                sock.close()
+                raise
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(sock, AsyncFrameReader(sock), self.closed)
+            connection.handler = loop.create_task(self.readLoop(connection))
+            self.connection = connection
+            try:
+                hello = await self.exchange(connection, protocol.NODE, self.cluster.hello())
+            except BaseException:
+                self.closed(connection)
+                connection.close()
+                raise
+            if not self.cluster.hasSecret(hello.body):
+                self.closed(connection)
+                connection.close()
+                raise ClusterError(f"{self.node} does not know the cluster's secret")
+            self.cluster.learn([self.node, *hello.body.get("nodes", ())])
+            return connection
+
+    # Sends a request and returns the reply frame. Raises ClusterError for an ERROR reply and ConnectionError if the link breaks.
+    async def request(self, type, body=None):
+        connection = await self.connect()
+        return await self.exchange(connection, type, body)
+
+    async def exchange(self, connection, type, body):
+        requestId = next(self.requestIds)
+        reply = asyncio.get_running_loop().create_future()
+        self.replies[requestId] = reply
+        try:
+            if not connection.enqueue(encodeFrame(type, body, requestId)):
+                raise ConnectionError(f"Connection to {self.node} is closed")
+            frame = await asyncio.wait_for(reply, NODE_TIMEOUT)
+        finally:
+            self.replies.pop(requestId, None)
+        if frame.type == protocol.ERROR:
+            raise ClusterError(f"{self.node}: {frame.body.get('message')}")
+        return frame
+
+    # Sends a message that has no reply
+    async def send(self, type, body=None):
+        connection = await self.connect()
+        if not connection.enqueue(encodeFrame(type, body)):
+            raise ConnectionError(f"Connection to {self.node} is closed")
+
+    async def readLoop(self, connection):
+        connection.writer = asyncio.get_running_loop().create_task(connection.writeLoop())
+        try:
+            while True:
+                frame = await connection.reader.readFrame()
+                if frame is None:
+                    break
+                reply = self.replies.get(frame.requestId)
+                if reply is not None and not reply.done():
+                    reply.set_result(frame)
+        except (OSError, protocol.ProtocolError) as e:
+            print(f"Connection to tracker {self.node} broke: {e!r}")
+        finally:
+            self.closed(connection)
+            connection.close()
+
+    # The waiting requests fail at once instead of waiting for their timeout
+    def closed(self, connection):
+        if self.connection is connection:
+            self.connection = None
+        for reply in self.replies.values():
+            if not reply.done():
+                reply.set_exception(ConnectionError(f"Connection to {self.node} closed"))
+
+
+class Cluster:
+    '''
+    The trackers of a multi-tracker deployment as seen from this tracker (node).
+
+    onJoin is called with the trackers that were added to the ring, so the caller can hand the keys that now belong
+    to them over. A tracker stays on the ring while it is down, its shard is unavailable until it is back, unless it is
+    removed with forget. onLeave is then called with it, its keys belong to the trackers that follow it on the ring.
+
+    With a secret, any tracker that sends it in its NODE frame may join. Without one, only the trackers this one was started
+    with or has heard of from them are accepted, and only from an address their host name resolves to.
+    '''
+
+    def __init__(self, node, nodes=(), onJoin=None, onLeave=None, secret=None):
+        self.node = node
+        self.ring = HashRing([node, *nodes])
+        self.links = {} # In the form: tracker address: NodeLink
+        self.onJoin = onJoin
+        self.onLeave = onLeave
+        self.secret = secret
+        self.tasks = set() # Keeps the messages sent with post alive until they are sent
+
+    def owner(self, key):
+        return self.ring.owner(key)
+
+    def isLocal(self, key):
+        return self.ring.owner(key) == self.node
+
+    def others(self):
+        return sorted(node for node in self.ring.nodes if node != self.node)
+
+    def hello(self):
+        hello = {"node": self.node, "nodes": sorted(self.ring.nodes)}
+        if self.secret is not None:
+            hello["secret"] = self.secret
+        return hello
+
+    # Tells whether a NODE frame carries the cluster's secret, always True when the cluster has none
+    def hasSecret(self, hello):
+        if self.secret is None:
+            return True
+        secret = hello.get("secret")
+        return isinstance(secret, str) and hmac.compare_digest(secret.encode("utf-8"), self.secret.encode("utf-8"))
+
+    # Tells whether the NODE frame of a connection from peerHost comes from a tracker of the cluster
+    async def admits(self, hello, peerHost):
+        node = hello.get("node")
+        if not isinstance(node, str) or node == self.node:
+            return False
+        try:
+            host, port = parseNode(node)
+            if self.secret is not None:
+                return self.hasSecret(hello)
+            if node not in self.ring:
+                return False
+            addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (ValueError, OSError):
+            return False
+        return peerHost in {address[4][0] for address in addresses}
+
+    # Adds the trackers this one did not know yet to the ring. Returns the new ones.
+    def learn(self, nodes):
+        new = [node for node in dict.fromkeys(nodes) if node and self.ring.add(node)]
+        if new:
+            print(f"Trackers joined the cluster: {', '.join(new)} ({len(self.ring)} in total)")
+            if self.onJoin is not None:
+                self.onJoin(new)
+        return new
+
+    # Takes a tracker off the ring for good. Returns False if it was not on it.
+    def forget(self, node):
+        if node == self.node or not self.ring.remove(node):
+            return False
+        link = self.links.pop(node, None)
+        if link is not None and link.connection is not None:
+            link.connection.close()
+        print(f"Tracker {node} left the cluster ({len(self.ring)} in total)")
+        if self.onLeave is not None:
+            self.onLeave(node)
+        return True
+
+    def link(self, node):
+        link = self.links.get(node)
+        if link is None:
+            link = self.links[node] = NodeLink(self, node)
+        return link
+
+    # Connects to every known tracker, which tells them about this one. Trackers that are not up yet connect here when they start.
+    async def start(self):
+        nodes = self.others()
+        results = await asyncio.gather(*(self.link(node).connect() for node in nodes), return_exceptions=True)
+        for node, result in zip(nodes, results):
+            if isinstance(result, Exception):
+                print(f"Tracker {node} is not reachable yet: {result!r}")
+
+    async def request(self, node, type, body=None):
+        return await self.link(node).request(type, body)
+
+    # Sends the same request to every other tracker at once. Returns {tracker: reply frame or the exception it failed with}.
+    async def gather(self, type, body=None, nodes=None):
+        nodes = self.others() if nodes is None else list(nodes)
+        results = await asyncio.gather(*(self.request(node, type, body) for node in nodes), return_exceptions=True)
+        return dict(zip(nodes, results))
+
+    # Sends a message without waiting for it, for callers that cannot wait (e.g. a client disconnecting)
+    def post(self, node, type, body=None):
+        task = asyncio.get_running_loop().create_task(self.sendLogged(node, type, body))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def postAll(self, type, body=None):
+        for node in self.others():
+            self.post(node, type, body)
+
+    async def sendLogged(self, node, type, body):
+        try:
+            await self.link(node).send(type, body)
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"Could not send {protocol.MESSAGE_NAMES.get(type, type)} to tracker {node}: {e!r}")
+
+    # Splits items between the trackers that own them. Returns {tracker: [items]}.
+    def group(self, items, key):
+        groups = {}
+        for item in items:
+            groups.setdefault(self.owner(key(item)), []).append(item)
+        return groups
@@ -0,0 +1,7 @@
+# DS Final project
+# The modules live in the repository root, the tests import them from there.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
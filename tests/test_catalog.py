@@ -0,0 +1,103 @@
+# DS Final project
+# File list versions of catalog.py: changesSince at the edges of the changelog, and deltas that bring a copy of the
+# file list up to date the way clients apply SYNC messages.
+
+import random
+
+import pytest
+
+import catalog as catalogModule
+from catalog import Catalog, FileRecord
+
+CHANGELOG = 8 # A short changelog, so its edges are easy to reach
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(catalogModule, "CHANGELOG_SIZE", CHANGELOG)
+    return Catalog()
+
+
+def fileHash(index):
+    return f"{index:064x}"
+
+
+def share(catalog, index, owner="alice", fileName=None):
+    return catalog.add(FileRecord(fileHash(index), owner, fileName or f"file{index}.txt", 100 + index))
+
+
+def testUnknownVersionsNeedSnapshot(catalog):
+    share(catalog, 1)
+    assert catalog.changesSince(None) is None
+    assert catalog.changesSince(catalog.version + 1) is None
+
+
+def testCurrentVersionHasNoChanges(catalog):
+    assert catalog.changesSince(0) == ({}, [])
+    share(catalog, 1)
+    assert catalog.changesSince(catalog.version) == ({}, [])
+
+
+def testOldestKeptVersionAndOneBefore(catalog):
+    for index in range(CHANGELOG + 3):
+        share(catalog, index)
+    oldest = catalog.version - CHANGELOG
+    added, removed = catalog.changesSince(oldest)
+    assert set(added) == {fileHash(index) for index in range(3, CHANGELOG + 3)}
+    assert removed == []
+    assert catalog.changesSince(oldest - 1) is None
+    assert catalog.changesSince(0) is None
+
+
+def testChangelogExactlyFull(catalog):
+    for index in range(CHANGELOG):
+        share(catalog, index)
+    added, _ = catalog.changesSince(0)
+    assert len(added) == CHANGELOG
+
+
+def testAddedThenRemovedIsOnlyRemoved(catalog):
+    share(catalog, 1)
+    version = catalog.version
+    share(catalog, 2)
+    catalog.removeOwner("alice")
+    added, removed = catalog.changesSince(version)
+    assert added == {}
+    assert sorted(removed) == [fileHash(1), fileHash(2)]
+
+
+def testRemovedThenAddedIsOnlyAdded(catalog):
+    share(catalog, 1)
+    version = catalog.version
+    catalog.removeOwner("alice")
+    share(catalog, 1, "bob", "renamed.txt")
+    assert catalog.changesSince(version) == ({fileHash(1): "renamed.txt"}, [])
+
+
+def testOtherOwnersDoNotChangeTheList(catalog):
+    share(catalog, 1)
+    version = catalog.version
+    share(catalog, 1, "bob")
+    assert catalog.version == version
+    assert catalog.changesSince(version) == ({}, [])
+
+
+def testDeltasKeepACopyInSync(catalog):
+    generator = random.Random(11)
+    copy, copyVersion = {}, None
+    for _ in range(400):
+        if generator.random() < 0.7:
+            share(catalog, generator.randrange(30), generator.choice("abcd"))
+        else:
+            catalog.removeOwner(generator.choice("abcd"))
+        if generator.random() < 0.3:
+            changes = catalog.changesSince(copyVersion)
+            if changes is None:
+                copy = dict(catalog.files())
+            else:
+                added, removed = changes
+                for removedHash in removed:
+                    copy.pop(removedHash, None)
+                copy.update(added)
+            copyVersion = catalog.version
+            assert copy == dict(catalog.files())
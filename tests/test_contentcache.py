@@ -0,0 +1,58 @@
+# DS Final project
+# Content cache of contentcache.py: a relayed file is only cached under its own hash, and hashes that are not
+# SHA-256 hashes in hex never become file names.
+
+import hashlib
+
+import pytest
+
+from contentcache import CacheWriter, ContentCache
+
+DATA = b"cached file\n" * 100
+HASH = hashlib.sha256(DATA).hexdigest()
+PIECE_SIZE = 256
+INVALID_HASHES = ["../escape", "/tmp/x", HASH.upper(), HASH[:-1], HASH + "0", "", None, 1, ["list"]]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ContentCache(str(tmp_path / "cache"), 1024 * 1024)
+
+
+def testCommitAddsFile(cache):
+    writer = cache.writer(HASH, len(DATA), PIECE_SIZE)
+    writer.write(DATA)
+    assert writer.commit()
+    file, size = cache.open(HASH)
+    with file:
+        assert file.read() == DATA and size == len(DATA)
+
+
+@pytest.mark.parametrize("chunk", [1, 100, PIECE_SIZE, 1000, len(DATA)])
+def testPieceHashesDoNotDependOnHowTheDataArrives(cache, chunk):
+    writer = cache.writer(HASH, len(DATA), PIECE_SIZE)
+    for start in range(0, len(DATA), chunk):
+        writer.write(DATA[start:start + chunk])
+    assert writer.commit()
+    pieces = b"".join(hashlib.sha256(DATA[start:start + PIECE_SIZE]).digest() for start in range(0, len(DATA), PIECE_SIZE))
+    assert cache.manifest(HASH) == (PIECE_SIZE, pieces)
+    cache.remove(HASH)
+    assert cache.manifest(HASH) is None
+
+
+def testWrongDataIsNotCached(cache):
+    writer = cache.writer(HASH, len(DATA), PIECE_SIZE)
+    writer.write(DATA[:-1] + b"?")
+    assert not writer.commit()
+    assert HASH not in cache and cache.open(HASH) is None
+
+
+@pytest.mark.parametrize("fileHash", INVALID_HASHES)
+def testInvalidHashIsRejected(cache, tmp_path, fileHash):
+    assert not cache.wants(fileHash, len(DATA))
+    assert cache.writer(fileHash, len(DATA), PIECE_SIZE) is None
+    assert cache.open(fileHash) is None
+    assert fileHash not in cache
+    with pytest.raises(ValueError):
+        CacheWriter(cache, fileHash, len(DATA), PIECE_SIZE)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["cache"]
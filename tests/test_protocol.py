@@ -0,0 +1,126 @@
+# DS Final project
+# Wire format of protocol.py: the MessagePack subset of the bodies and the length-prefixed frames.
+
+import socket
+import threading
+
+import pytest
+
+import protocol
+from protocol import FrameReader, ProtocolError, encodeFrame, packValue, unpackValue
+
+# Values on both sides of every size boundary of the format
+INTEGERS = [0, 1, 127, 128, 255, 256, 65535, 65536, 2 ** 32 - 1, 2 ** 32, 2 ** 64 - 1,
+            -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31, -2 ** 31 - 1, -2 ** 63]
+STRINGS = ["", "a", "ä€😀", "x" * 31, "x" * 32, "x" * 255, "x" * 256, "x" * 65535, "x" * 65536]
+BLOBS = [b"", b"\x00", bytes(range(256)), b"\xff" * 65535, b"\xff" * 65536]
+
+
+@pytest.mark.parametrize("value", [None, True, False, 0.5, -1.25e300, *INTEGERS, *STRINGS, *BLOBS])
+def testScalarRoundTrip(value):
+    assert unpackValue(packValue(value)) == value
+
+
+@pytest.mark.parametrize("length", [0, 15, 16, 65535, 65536])
+def testContainerRoundTrip(length):
+    array = list(range(length))
+    mapping = {f"key{index}": [index, {"nested": str(index)}] for index in range(min(length, 4096))}
+    assert unpackValue(packValue(array)) == array
+    assert unpackValue(packValue(mapping)) == mapping
+
+
+def testTypicalBodyRoundTrip():
+    body = {"hash": "ab" * 32, "offset": 0, "codecs": ["zlib"], "peers": [["127.0.0.1", 40000]], "cursor": None,
+            "ranks": [[[-3.0, -2, "name.txt", "ab" * 32], {"fileName": "name.txt", "size": 2 ** 40}]]}
+    assert unpackValue(packValue(body)) == body
+
+
+@pytest.mark.parametrize("value", [2 ** 64, -2 ** 63 - 1, object(), {1, 2}])
+def testUnsupportedValues(value):
+    with pytest.raises(ProtocolError):
+        packValue(value)
+
+
+def testEveryTruncatedBodyIsRejected():
+    data = packValue({"files": [{"hash": "ab" * 32, "fileName": "a.txt", "size": 123456789}], "version": 70000})
+    for end in range(len(data)):
+        with pytest.raises(ProtocolError):
+            unpackValue(data[:end])
+
+
+def testExtraDataAfterBodyIsRejected():
+    with pytest.raises(ProtocolError):
+        unpackValue(packValue({"a": 1}) + b"\x00")
+
+
+@pytest.mark.parametrize("data", [
+    b"\xa2\xff\xfe", # fixstr that is not UTF-8
+    b"\xd9\x01\xc3", # str8 that is not UTF-8
+    b"\x81\x91\x01\x02", # map with a list as a key
+    b"\x81\x80\x01", # map with a map as a key
+    b"\x91" * 100000 + b"\x01", # arrays nested deeper than the interpreter allows
+])
+def testMalformedBodiesRaiseProtocolError(data):
+    with pytest.raises(ProtocolError):
+        unpackValue(data)
+
+
+def testUnknownTypeCodeIsRejected():
+    with pytest.raises(ProtocolError):
+        unpackValue(b"\xc1")
+
+
+# Sends data over a socket pair one byte at a time from another thread, then closes the sending side
+def feed(data, chunk=1):
+    sender, receiver = socket.socketpair()
+
+    def send():
+        for start in range(0, len(data), chunk):
+            sender.sendall(data[start:start + chunk])
+        sender.close()
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    return FrameReader(receiver), thread
+
+
+def testFramesSplitAcrossReads():
+    frames = [(protocol.SEARCH, {"query": "report", "limit": 7, "cursor": None}, 3),
+              (protocol.NEWFILE, None, 0),
+              (protocol.FILE, {"length": 5}, 9)]
+    reader, thread = feed(b"".join(encodeFrame(*frame) for frame in frames) + b"hello")
+    for type, body, requestId in frames:
+        frame = reader.readFrame()
+        assert (frame.type, frame.body, frame.requestId) == (type, {} if body is None else body, requestId)
+    assert reader.readExactly(5) == b"hello" # Raw data after a FILE frame
+    assert reader.readFrame() is None # Closed between frames
+    thread.join()
+
+
+def testManyFramesInOneRead():
+    reader, thread = feed(b"".join(encodeFrame(protocol.ANNOUNCED, {"added": index}, index) for index in range(100)), chunk=65536)
+    assert [reader.readFrame().body["added"] for _ in range(100)] == list(range(100))
+    thread.join()
+
+
+@pytest.mark.parametrize("cut", [1, protocol.HEADER.size, protocol.HEADER.size + 3])
+def testConnectionClosedInsideFrame(cut):
+    reader, thread = feed(encodeFrame(protocol.SYNCREQUEST, {"version": 12})[:cut])
+    with pytest.raises(ProtocolError):
+        reader.readFrame()
+    thread.join()
+
+
+def testConnectionClosedInsideRawData():
+    reader, thread = feed(encodeFrame(protocol.PIECE, {"length": 10}) + b"12345")
+    reader.readFrame()
+    with pytest.raises(ProtocolError):
+        reader.readExactly(10)
+    thread.join()
+
+
+def testOversizedFrameIsRejected():
+    reader, thread = feed(protocol.HEADER.pack(protocol.MAX_FRAME_SIZE + 1, protocol.FILE, 0), chunk=64)
+    with pytest.raises(ProtocolError):
+        reader.readFrame()
+    thread.join()
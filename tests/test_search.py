@@ -0,0 +1,98 @@
+# DS Final project
+# Paged search of catalog.py: the cursor is the rank of the last result, so files added or removed between two
+# pages neither repeat nor skip the files that were there all along. Pages of several catalogs merge the same way.
+
+import random
+
+from catalog import Catalog, FileRecord, searchPage
+
+
+def fileHash(index):
+    return f"{index:064x}"
+
+
+def share(catalog, index, owner="alice"):
+    catalog.add(FileRecord(fileHash(index), owner, f"report {index:03d}.txt", index))
+
+
+def allPages(catalog, query, limit, betweenPages=None):
+    seen, cursor = [], None
+    while True:
+        results, cursor, _ = catalog.search(query, limit, cursor)
+        seen.extend(result["hash"] for result in results)
+        if cursor is None:
+            return seen
+        if betweenPages is not None:
+            betweenPages()
+
+
+def testPagesCoverEveryMatchOnceInRankOrder():
+    catalog = Catalog()
+    for index in range(53):
+        share(catalog, index)
+    share(catalog, 7, "bob")
+    seen = allPages(catalog, "report", 10)
+    assert seen == [fileHash(index) for index in range(53)] # The names only differ by their number
+    results, cursor, total = catalog.search("report", 100)
+    assert [result["hash"] for result in results] == seen and cursor is None and total == 53
+
+
+def testInsertsAndRemovalsBetweenPagesDoNotRepeatOrSkip():
+    catalog = Catalog()
+    for index in range(0, 200, 2):
+        share(catalog, index, f"owner{index}")
+    stable = {fileHash(index) for index in range(0, 200, 4)} # Never removed
+    generator = random.Random(5)
+    added = iter(range(1, 200, 2))
+
+    def churn():
+        for _ in range(3):
+            share(catalog, next(added)) # New files land before and after the cursor
+        victim = generator.choice([index for index in range(2, 200, 4) if fileHash(index) in catalog])
+        catalog.removeOwner(f"owner{victim}")
+
+    seen = allPages(catalog, "report", 7, churn)
+    assert len(seen) == len(set(seen))
+    assert stable <= set(seen)
+
+
+def testOwnersJoiningAndLeavingBetweenPagesDoNotMoveResults():
+    catalog = Catalog()
+    for index in range(60):
+        share(catalog, index)
+    generator = random.Random(7)
+
+    def churn():
+        index = generator.randrange(60)
+        share(catalog, index, f"extra{index}")
+        catalog.removeOwner(f"extra{generator.randrange(60)}")
+
+    assert allPages(catalog, "report", 7, churn) == [fileHash(index) for index in range(60)]
+
+
+def testLastPageHasNoCursor():
+    catalog = Catalog()
+    for index in range(10):
+        share(catalog, index)
+    results, cursor, _ = catalog.search("report", 10)
+    assert len(results) == 10 and cursor is None
+    assert searchPage([], 10) == ([], None)
+
+
+def testMergedShardsPageLikeOneCatalog():
+    whole, shards = Catalog(), [Catalog(), Catalog(), Catalog()]
+    for index in range(80):
+        owner = f"owner{index % 5}"
+        share(whole, index, owner)
+        share(shards[index % 3], index, owner)
+    limit, cursor, merged = 9, None, []
+    while True:
+        ranked = []
+        for shard in shards:
+            ranked.extend(shard.searchRanked("report", limit + 1, cursor)[0])
+        ranked.sort(key=lambda entry: entry[0])
+        results, cursor = searchPage(ranked[:limit + 1], limit)
+        merged.extend(result["hash"] for result in results)
+        if cursor is None:
+            break
+    assert merged == allPages(whole, "report", limit)
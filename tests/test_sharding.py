@@ -0,0 +1,84 @@
+# DS Final project
+# Consistent hashing of sharding.py: adding a tracker moves only its share of the keys, all of them to the new tracker.
+# Which NODE frames a Cluster trusts, and taking a tracker off its ring.
+
+import asyncio
+import hashlib
+
+import pytest
+
+from sharding import Cluster, HashRing, parseNode
+
+KEYS = [hashlib.sha256(str(index).encode()).hexdigest() for index in range(20000)]
+
+
+def tracker(index):
+    return f"10.0.0.{index}:12345"
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 7])
+def testAddingATrackerMovesAboutItsShareToIt(count):
+    ring = HashRing([tracker(index) for index in range(count)])
+    before = [ring.owner(key) for key in KEYS]
+    ring.add(tracker(count))
+    after = [ring.owner(key) for key in KEYS]
+    moved = [new for old, new in zip(before, after) if old != new]
+    assert set(moved) == {tracker(count)}
+    assert abs(len(moved) / len(KEYS) - 1 / (count + 1)) < 0.25 / (count + 1)
+
+
+def testOwnerDoesNotDependOnTheOrderTrackersJoined():
+    trackers = [tracker(index) for index in range(5)]
+    forward, backward = HashRing(trackers), HashRing(reversed(trackers))
+    assert all(forward.owner(key) == backward.owner(key) for key in KEYS[:2000])
+
+
+def testRemovingATrackerOnlyMovesItsKeys():
+    ring = HashRing([tracker(index) for index in range(4)])
+    before = [ring.owner(key) for key in KEYS]
+    ring.remove(tracker(2))
+    after = [ring.owner(key) for key in KEYS]
+    assert all(old == new for old, new in zip(before, after) if old != tracker(2))
+    assert tracker(2) not in after
+
+
+def testKeysAreSpreadEvenly():
+    ring = HashRing([tracker(index) for index in range(4)])
+    shares = {}
+    for key in KEYS:
+        owner = ring.owner(key)
+        shares[owner] = shares.get(owner, 0) + 1
+    assert max(shares.values()) < 1.25 * len(KEYS) / 4
+
+
+def testRingBasics():
+    ring = HashRing()
+    assert ring.owner("anything") is None
+    assert ring.add(tracker(0)) and not ring.add(tracker(0))
+    assert len(ring) == 1 and tracker(0) in ring
+    assert ring.owner(KEYS[0]) == tracker(0)
+    assert parseNode("127.0.0.1:23801") == ("127.0.0.1", 23801)
+
+
+@pytest.mark.parametrize("secret, hello, peerHost, admitted", [
+    (None, {"node": "127.0.0.1:2"}, "127.0.0.1", True),
+    (None, {"node": "127.0.0.1:2"}, "10.0.0.9", False), # A known address sent from another host
+    (None, {"node": "127.0.0.1:3"}, "127.0.0.1", False), # Not configured and not heard of
+    (None, {"node": "127.0.0.1:1"}, "127.0.0.1", False), # This tracker itself
+    (None, {"node": ["127.0.0.1:2"]}, "127.0.0.1", False),
+    ("s3", {"node": "10.0.0.9:3", "secret": "s3"}, "10.0.0.9", True), # A new tracker that knows the secret may join
+    ("s3", {"node": "127.0.0.1:2", "secret": "wrong"}, "127.0.0.1", False),
+    ("s3", {"node": "127.0.0.1:2"}, "127.0.0.1", False),
+    ("s3", {"node": "no port", "secret": "s3"}, "127.0.0.1", False),
+])
+def testAdmits(secret, hello, peerHost, admitted):
+    cluster = Cluster("127.0.0.1:1", ["127.0.0.1:2"], secret=secret)
+    assert asyncio.run(cluster.admits(hello, peerHost)) is admitted
+
+
+def testForget():
+    left = []
+    cluster = Cluster(tracker(0), [tracker(1), tracker(2)], onLeave=left.append)
+    assert cluster.forget(tracker(1)) and not cluster.forget(tracker(1)) and not cluster.forget(tracker(0))
+    assert left == [tracker(1)] and cluster.others() == [tracker(2)]
+    assert all(cluster.owner(key) != tracker(1) for key in KEYS[:2000])
@@ -0,0 +1,28 @@
+# DS Final project
+# Compressed transfers of transfercodec.py: blocks round trip, and block headers a hostile uploader could send are rejected.
+
+import io
+
+import pytest
+
+import transfercodec
+from protocol import ProtocolError
+from transfercodec import BLOCK_HEADER, BLOCK_SIZE, ZlibCodec, encodeBlock, readBlock
+
+
+def reader(data):
+    return io.BytesIO(data).read
+
+
+@pytest.mark.parametrize("data", [b"x", b"a" * 100000, bytes(range(256)) * 64])
+def testBlockRoundTrip(data):
+    codec = ZlibCodec()
+    stats = transfercodec.CompressionStats(codec)
+    assert readBlock(codec, reader(encodeBlock(codec, data)), stats) == data
+    assert stats.dataBytes == len(data)
+
+
+@pytest.mark.parametrize("size", [0, BLOCK_SIZE + 1, 2 ** 32 - 1])
+def testBlockSizeOutOfRange(size):
+    with pytest.raises(ProtocolError):
+        readBlock(ZlibCodec(), reader(BLOCK_HEADER.pack(size, 0) + b"x" * 16))
@@ -7,162 +7,757 @@
 
 
 '''
-1. broadcast: Takes a message as a parameter and sends it to all clients
-2. clientDisconnect: Takes the nickname of the client as a parameter and removes their files from the file database (fileDB)
-3. sendFileList: Takes the client socket as a parameter and and sends the filelist to a client requesting it.
-4. handle: Takes client nickname and sokcket as parameters. Handles message exchange between two clients or client and server.
-5. server_main: Takes no parameters. Handles the new clients and connections.
+Messages are frames of protocol.py: a length-prefixed header with the message type and request ID, and a MessagePack body.
+The server runs on one asyncio event loop. Every client is a coroutine instead of a thread, so thousands of idle
+clients only cost a socket and a small buffer each.
+
+1. Client: One connected client: its socket, frame reader and send queue (see fanout.py) and how far its file list is synced.
+2. sendTo: Takes the nickname, message type, body and request ID as parameters and queues a frame for one client.
+3. broadcast: Takes a message type and body as parameters and queues it for all clients
+4. clientDisconnect: Takes the nickname of the client as a parameter and removes their files from the catalog
+5. sendFileList: Takes the client connection and request ID as parameters and sends the filelist to a client requesting it.
+6. syncBody: Takes a catalog version as a parameter and builds a SYNC message with the changes since that version, or a snapshot.
+7. syncFrame: Takes a catalog version as a parameter and returns the encoded SYNC push from it, shared by all clients at that version.
+8. sendCatalogSync: Takes the client connection, its catalog version and request ID as parameters and queues a SYNC reply for it.
+9. catalogNotification: Takes a client connection as a parameter and builds the catalog change notification for it.
+10. publishChanges: Takes no parameters. Tells every client that the catalog has changed.
+11. Transfer: One file relayed through the server: its ID and token, the uploader, the downloader and their data channels.
+12. requestRelay: Takes the file hash, the uploader's nickname, the downloader's nickname, the start offset, the downloader's compression codecs, the file's record, the uploader's tracker and the downloader's request ID as parameters. Starts a transfer and asks both clients to open a data channel for it, or only the downloader when the file is in the content cache.
+13. attachDataChannel: Takes a new socket, its frame reader and the DATACHANNEL message as parameters and hands the socket to its transfer.
+14. relayFile: Takes a transfer as a parameter and forwards the file data from the uploader's data channel to the downloader's.
+15. sendCachedFile: Takes a transfer and an open file of the content cache as parameters and sends the file to the downloader's data channel, the owner is not involved.
+16. handle: Takes the client's connection as a parameter. Handles message exchange between two clients or client and server.
+17. handshake: Takes a new socket as a parameter and asks for a nickname until the client picks a free one, or attaches a data channel. Returns the NODE frame of another tracker.
+18. handleClient: Takes a new socket and its address as parameters. Runs the handshake and then handle for the client, or handleNode for another tracker.
+19. serveStats: Answers a connection to the stats port with the metrics (see metrics.py) or the profiler's stacks.
+20. server_main: Takes the host, port, stats address, profile file, relay bandwidth limits, content cache and the other trackers of a cluster as parameters. Starts the stats port and the profiler.
+21. acceptClients: Takes the host and port as parameters. Accepts new clients and starts a coroutine for each of them.
+22. observeBroadcast: Takes the duration and the number of notifications of a broadcast as parameters and records them in the metrics.
+
+Multi-tracker mode (--cluster, see sharding.py): the catalog is split between the trackers by the file hash. Clients connect to
+any tracker, their home, which sends their files to the trackers that own them and asks those trackers when a client downloads.
+23. ownerInfo: Takes an owner's nickname as a parameter and returns their home tracker and seeding address.
+24. lookupFile: Takes a file hash as a parameter and returns its records with the owners' home trackers and addresses, from the tracker that owns the hash.
+25. announceFiles: Takes the owner's nickname and file records as parameters, adds them on the trackers that own them and returns how many were added.
+26. searchCluster: Takes a query, page size and cursor as parameters and merges the ranked results of every tracker into one page.
+27. clusterFiles: Takes no parameters. Returns the cluster's file list version and the files of every tracker, gathered once per version.
+28. claimNickname / releaseNickname: Take a nickname as a parameter. Nicknames are unique in the cluster, the tracker that owns the nickname keeps track of them.
+29. handleNode: Takes another tracker's socket, frame reader and NODE frame as parameters and answers its requests.
+30. rebalance: Takes no parameters. Hands the files and nicknames that belong to a tracker that has joined over to it.
+31. clusterLeft: Takes the address of a tracker that has left as a parameter and removes the files and nicknames of its clients.
+32. leaveCluster: Takes no parameters. Hands this tracker's shard over to the other trackers when it shuts down and tells them it has left.
+33. removeNode: Takes a tracker's address as a parameter and takes it off the ring of every tracker, for a tracker that is gone for good.
 '''
 
-import threading
+import argparse
+import asyncio
+import itertools
+import secrets
 import socket
-from pysondb import db
+import threading
 import os
 import time
+import random
+from urllib.parse import parse_qs, urlsplit
+import protocol
+from protocol import AsyncFrameReader, encodeFrame
+from relay import relayStreamAsync, sendFileAsync
+from fanout import Connection, Broadcaster
+from catalog import Catalog, FileRecord, MAX_SEARCH_RESULTS, searchPage
+from metrics import Registry, SamplingProfiler
+from ratelimit import BandwidthScheduler, parseRate
+from contentcache import ContentCache, isFileHash, parseSize
+from sharding import Cluster, ClusterError, parseNode
+
+try:
+    import resource
+except ImportError: # Windows does not have resource
+    resource = None
 
 # Create data strucktures for handling clients and connections
-download_queue = {} # In the form: fileHash: downloaderNickname
-connections = {} # In the form: nickname: clientSocket
+transfers = {} # In the form: transferId: Transfer
+transferIds = itertools.count(1)
+connections = {} # In the form: nickname: Connection
+pendingNicknames = set() # Nicknames in the middle of a handshake, reserved until the client is in connections or has failed
+peer_addresses = {} # In the form: nickname: (host, port) of the client's seeding listener
+backgroundTasks = set() # Keeps tasks started outside of a client's coroutine alive until they finish
+syncFrames = {} # In the form: ("from", version): encoded SYNC frame from that version to the current one
+# Bandwidth of the relay (see ratelimit.py). Unlimited unless server_main is given limits with --relay-limit, --peer-limit or --transfer-limit.
+# Small files are relayed ahead of bulk transfers and the transfers share the global limit in round robin.
+relayScheduler = BandwidthScheduler()
+# Popular files kept on the server's disk (see contentcache.py), so they are not uploaded by their owner for every download
+# and stay available when the owner leaves. None unless the server runs with --cache-dir.
+contentCache = None
+# The trackers of a multi-tracker deployment (see sharding.py), None when this tracker runs alone.
+# The local catalog then holds this tracker's shard: the files whose hash the ring gives to it, whoever's client owns them.
+cluster = None
+shardOwners = {} # In the form: nickname: (home tracker, (host, port) or None) of the owners connected to other trackers
+claims = {} # In the form: nickname: home tracker, the connected clients whose nickname belongs to this tracker's part of the ring
+clusterVersion = 1 # Version of the whole cluster's file list, goes up whenever any tracker's shard changes
+clusterSnapshot = (None, None) # (clusterVersion, task gathering the file list of that version)
+CLUSTER_ERRORS = (ClusterError, OSError, asyncio.TimeoutError) # Another tracker is down, slow or answered with an ERROR
+
+# Shared files of the connected clients, indexed by hash, owner and file name (see catalog.py).
+catalog = Catalog()
+
+# Instrumentation, served in the Prometheus text format on the stats port (see metrics.py and serveStats)
+metrics = Registry()
+messagesHandled = metrics.counter("tracker_messages_total", "Messages handled, by message type", ["type"])
+handleLatency = metrics.histogram("tracker_handle_seconds", "Time handle() spent on a message, by message type", ["type"])
+transfersFinished = metrics.counter("tracker_transfers_total", "Relayed transfers that have ended, by result", ["result"])
+relayBytes = metrics.counter("tracker_relay_bytes_total", "Bytes relayed from uploaders to downloaders")
+transferDuration = metrics.histogram("tracker_transfer_seconds", "Duration of the relayed transfers that completed",
+                                     buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800))
+transferSpeed = metrics.histogram("tracker_transfer_megabytes_per_second", "Throughput of the relayed transfers that completed",
+                                  buckets=(0.1, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+broadcastDuration = metrics.histogram("tracker_broadcast_flush_seconds", "Time to queue a batch of catalog notifications for every client")
+broadcastNotifications = metrics.counter("tracker_broadcast_notifications_total", "Catalog notifications queued to clients")
+metrics.gauge("tracker_connections", "Connected clients", lambda: len(connections))
+metrics.gauge("tracker_transfers_active", "Relayed transfers in progress", lambda: len(transfers))
+metrics.gauge("tracker_relay_waiting_transfers", "Relayed transfers waiting for the global bandwidth limit", lambda: relayScheduler.waiting())
+metrics.gauge("tracker_seeders", "Clients that accept direct connections", lambda: len(peer_addresses))
+metrics.gauge("tracker_catalog_records", "Shared files, one per owner", lambda: len(catalog))
+metrics.gauge("tracker_catalog_files", "Distinct shared files", lambda: len(catalog.byHash))
+metrics.gauge("tracker_catalog_owners", "Clients that share at least one file", lambda: len(catalog.byOwner))
+metrics.gauge("tracker_catalog_version", "Version of the file list", lambda: catalog.version)
+metrics.gauge("tracker_cluster_trackers", "Trackers in the cluster, this one included", lambda: len(cluster.ring) if cluster else 1)
+metrics.gauge("tracker_send_queue_bytes", "Bytes waiting in the send queues of all clients", lambda: sum(connection.queuedBytes for connection in connections.values()))
+metrics.gauge("tracker_tasks", "Coroutines alive on the event loop", lambda: len(asyncio.all_tasks()))
+metrics.gauge("tracker_threads", "Threads alive", threading.active_count)
+metrics.gauge("process_cpu_seconds_total", "CPU time used by the server", time.process_time)
+cacheBytesSent = metrics.counter("tracker_cache_sent_bytes_total", "Bytes sent to downloaders from the content cache")
+metrics.gauge("tracker_cache_bytes", "Bytes of the files in the content cache", lambda: contentCache.size if contentCache else 0)
+metrics.gauge("tracker_cache_files", "Files in the content cache", lambda: len(contentCache) if contentCache else 0)
+metrics.gauge("tracker_cache_hits_total", "Relayed downloads sent from the content cache", lambda: contentCache.hits if contentCache else 0)
+metrics.gauge("tracker_cache_misses_total", "Relayed downloads the content cache did not have", lambda: contentCache.misses if contentCache else 0)
+profiler = None # SamplingProfiler of the event loop when the server runs with --profile
 
-# Recreate the database when server restarts
-os.remove("fileDB.json")
-fileDB = db.getDb("fileDB.json")
+# Records how long queueing one batch of catalog notifications took and how many were queued
+def observeBroadcast(seconds, notifications):
+    broadcastDuration.observe(seconds)
+    broadcastNotifications.inc(amount=notifications)
 
-# Define and start the server
+broadcaster = Broadcaster(lambda: connections.values(), observe=observeBroadcast) # Sends the catalog changes to every client
+
+# Default address of the server, can be changed with --host and --port
 HOST = socket.gethostbyname(socket.gethostname())
 PORT = 12345
 ALIVE = False
 FILESIZE = 1024
+MAX_SWARM_PEERS = 50 # At most this many owners are given to a downloader, a random sample spreads the load between owners
+BACKLOG = socket.SOMAXCONN # How many connections may wait to be accepted before new ones start getting rejected
+HANDSHAKE_TIMEOUT = 10 # Seconds a new client has to pick a nickname
+LEAVE_TIMEOUT = 10 # Seconds a tracker of a cluster has to hand its shard over when it shuts down
+DEFAULT_PIECE_SIZE = 1024 * 1024 # Piece size told to downloaders of a cached file nobody shares anymore, the clients' default
+CACHE_SIZE = "4G" # Disk space of the content cache, can be changed with --cache-size
+FRAME_TIMEOUT = 30 # Seconds the rest of a frame has to arrive in once it has started, idle clients between frames never time out
+TRANSFER_TIMEOUT = 30 # Seconds the uploader and the downloader have to open their data channels for a relayed transfer
+STATS_HOST = "127.0.0.1" # The stats port only listens locally unless --stats-host says otherwise
+STATS_REQUEST_TIMEOUT = 2 # Seconds a stats client has to send its request, without one the metrics are sent as plain text
+
+
+class Client(Connection):
+    '''
+    One connected client (see fanout.py for the send queue).
+
+    syncedVersion is the catalog version the frames queued for the client bring it to, None until it asks for the file list.
+    legacy clients asked with FILELISTREQUEST and are told about changes with NEWFILE instead of SYNC.
+    '''
+    __slots__ = ("nickname", "syncedVersion", "legacy")
+
+    def __init__(self, sock, reader, nickname):
+        super().__init__(sock, reader, lambda connection: clientDisconnect(nickname))
+        self.nickname = nickname
+        self.syncedVersion = None
+        self.legacy = False
+
+    def __repr__(self):
+        return self.nickname
+
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind((HOST,PORT))
-server.listen(10) # Number inside specifies how many unexpected connections are allowed before they start getting rejected (Example (5) -> if more than 5 connections are waiting, new requests are denied)
-print(f"Server is listening on port {PORT}...")
-# print(f"IP: {HOST}")
+# Queues one frame for a client, it is sent by the client's own writer so this never waits for the client
+def sendTo(nickname, type, body=None, requestId=0):
+    connection = connections.get(nickname)
+    if connection is not None:
+        connection.enqueue(encodeFrame(type, body, requestId))
 
 # Sends a message to all clients
-def broadcast(message):
-    for nickname in connections:
-        connections[nickname].send(message.encode("utf-8"))
+def broadcast(type, body=None):
+    frame = encodeFrame(type, body)
+    for connection in list(connections.values()):
+        connection.enqueue(frame)
 
 # Removes disconnected peer's files from the database
 def clientDisconnect(nickname):
-    del connections[nickname]
-    print("Client removed:", connections)
-    fileList = fileDB.getByQuery({"owner":nickname})
-    for file in fileList:
-        id = file["id"]
-        fileDB.deleteById(id)
+    connection = connections.pop(nickname, None)
+    if connection is None:
+        return None
+    connection.close()
+    peer_addresses.pop(nickname, None)
+    print("Client removed:", nickname, f"({len(connections)} connected)")
+    version = catalog.version
+    catalog.removeOwner(nickname)
+    if catalog.version != version:
+        # The other clients drop the files nobody has any more from their lists
+        publishChanges()
+    if cluster is not None:
+        # The client's files in the other trackers' shards go too
+        cluster.postAll(protocol.SHARDFORGET, {"owner": nickname})
+        releaseNickname(nickname)
     return None
 
 # Sends the file list to a client requesting it.
-def sendFileList(client):
+def sendFileList(connection, requestId=0):
         try:
-            message = "FILELIST"
-            fileList = fileDB.getAll() 
-            for file in fileList:
-                message = message + ":"+ file["hash"] + "-" + file["fileName"]
-            client.send(message.encode("utf-8"))
+            files = [{"hash": fileHash, "fileName": fileName} for fileHash, fileName in catalog.files()]
+            connection.legacy = True
+            connection.syncedVersion = catalog.version
+            connection.enqueue(encodeFrame(protocol.FILELIST, {"files": files, "version": catalog.version}, requestId))
         except Exception as e:
             print("\nsendFileList")
             print("Exception occurred:", e)
 
+# Builds the SYNC message that brings a client from the given catalog version to the current one.
+# Only the changes are sent if the changelog still has them, otherwise the whole file list.
+def syncBody(version):
+    changes = catalog.changesSince(version)
+    if changes is None:
+        files = [{"hash": fileHash, "fileName": fileName} for fileHash, fileName in catalog.files()]
+        return {"from": version, "version": catalog.version, "snapshot": True, "added": files, "removed": []}
+    added, removed = changes
+    files = [{"hash": fileHash, "fileName": fileName} for fileHash, fileName in added.items()]
+    return {"from": version, "version": catalog.version, "snapshot": False, "added": files, "removed": removed}
+
+# Returns the encoded SYNC push from the given version to the current one.
+# Most clients are at the same version, so each push is encoded once and shared by all of them.
+def syncFrame(version):
+    if syncFrames.get("version") != catalog.version:
+        syncFrames.clear()
+        syncFrames["version"] = catalog.version
+    key = ("from", version)
+    if key not in syncFrames:
+        syncFrames[key] = encodeFrame(protocol.SYNC, syncBody(version))
+    return syncFrames[key]
+
+# Sends a client the changes since the catalog version it has. The reply is built when the client's writer gets to it,
+# so it continues from the pushes queued before it.
+def sendCatalogSync(connection, version, requestId=0):
+    connection.syncedVersion = version
+
+    def build(connection):
+        body = syncBody(connection.syncedVersion)
+        connection.syncedVersion = catalog.version
+        return encodeFrame(protocol.SYNC, body, requestId)
+
+    connection.enqueueBuild(build)
+
+# Built by each client's writer when it gets to a catalog notification.
+# A slow client has only one notification waiting however many changes there were, and gets them all in one SYNC.
+# In a cluster the clients are told with NEWFILE and ask for the file list again, it is gathered from every tracker.
+def catalogNotification(connection):
+    if cluster is not None:
+        if connection.syncedVersion is None or connection.syncedVersion == clusterVersion:
+            return None
+        connection.syncedVersion = clusterVersion
+        return encodeFrame(protocol.NEWFILE)
+    if connection.syncedVersion is None or connection.syncedVersion == catalog.version:
+        return None
+    frame = encodeFrame(protocol.NEWFILE) if connection.legacy else syncFrame(connection.syncedVersion)
+    connection.syncedVersion = catalog.version
+    return frame
+
+# Tells every client that the catalog has changed. Changes within FLUSH_INTERVAL are sent together.
+# In a cluster the other trackers are told too (forward=False when the change came from one of them).
+def publishChanges(forward=True):
+    global clusterVersion
+    if cluster is not None:
+        clusterVersion += 1
+        if forward:
+            cluster.postAll(protocol.NEWFILE)
+    broadcaster.publish("catalog", catalogNotification)
+
+class Transfer:
+    '''
+    One file relayed through the server.
+
+    The uploader and the downloader both open a data channel, a connection of its own that starts with a DATACHANNEL
+    frame carrying the transfer ID and token. The control connections stay free for other messages, so a client can
+    take part in many transfers at once and many downloaders can fetch the same file at the same time.
+    '''
+    __slots__ = ("id", "token", "hash", "uploader", "downloader", "offset", "codecs", "channels", "record", "requestId")
+
+    def __init__(self, fileHash, uploader, downloader, offset, codecs=(), record=None, requestId=0):
+        loop = asyncio.get_running_loop()
+        self.id = next(transferIds)
+        self.token = secrets.token_hex(16) # Only the two clients know it, nobody else can attach to the transfer
+        self.hash = fileHash
+        self.uploader = uploader
+        self.downloader = downloader
+        self.offset = offset
+        self.codecs = list(codecs) # Compression codecs the downloader can decompress, the uploader picks one or none
+        self.channels = {"upload": loop.create_future(), "download": loop.create_future()} # In the form: role: (socket, reader)
+        self.record = record # FileRecord with the size and piece size, looked up from another tracker's shard in a cluster
+        self.requestId = requestId # Of the downloader's request, an ERROR with it tells the downloader the transfer is off
+
+
+# Asks the uploader to send the file through the server, which relays it to the downloader.
+# Used when the uploader does not accept direct connections or the downloader could not reach it.
+# The offset tells where the downloader wants the file to start from when it resumes an interrupted download.
+# codecs are the compression codecs the downloader offers (see transfercodec.py).
+# A file in the content cache is sent from there and the uploader is not asked at all, it may even have disconnected.
+# In a cluster the uploader may be a client of another tracker (uploaderHome), which passes the request on. The uploader then
+# opens its data channel to this tracker, the downloader's home, where the transfer is.
+def requestRelay(fileHash, fileUploader, nickname, offset=0, codecs=(), record=None, uploaderHome=None, requestId=0):
+    cached = contentCache.open(fileHash) if contentCache is not None else None
+    transfer = Transfer(fileHash, None if cached else fileUploader, nickname, offset, codecs, record, requestId)
+    transfers[transfer.id] = transfer
+    if cached:
+        coroutine = sendCachedFile(transfer, *cached)
+    else:
+        fileData = record or catalog.first(fileHash)
+        if contentCache is not None and offset == 0 and fileData is not None and contentCache.wants(fileHash, fileData.size):
+            transfer.codecs = [] # Only an uncompressed file can be checked against its hash and cached on the way
+        coroutine = relayFile(transfer)
+    task = asyncio.get_running_loop().create_task(coroutine)
+    backgroundTasks.add(task)
+    task.add_done_callback(backgroundTasks.discard)
+
+    # Both clients are told to open a data channel for the transfer
+    details = {"hash": fileHash, "offset": offset, "transfer": transfer.id, "token": transfer.token}
+    sendTo(nickname, protocol.TRANSFER, details)
+    if cached:
+        return
+    request = {**details, "codecs": transfer.codecs, "downloader": nickname}
+    if cluster is None or uploaderHome in (None, cluster.node):
+        sendTo(fileUploader, protocol.FILESENDREQUEST, request)
+    else:
+        cluster.post(uploaderHome, protocol.FILESENDREQUEST, {**request, "uploader": fileUploader, "relay": list(parseNode(cluster.node))})
+
+# Reads and throws away raw data that nobody is waiting for, so the next frame can be read
+async def skipData(reader, count):
+    buffer = bytearray(64 * 1024)
+    while count > 0:
+        received = await asyncio.wait_for(reader.recvInto(buffer, min(len(buffer), count)), FRAME_TIMEOUT)
+        if received == 0:
+            break
+        count -= received
+
+# Connects a new data channel to its transfer. Returns False if there is no such transfer.
+def attachDataChannel(client, reader, message):
+    transfer = transfers.get(message.get("transfer"))
+    role = message.get("role")
+    if transfer is None or not secrets.compare_digest(str(message.get("token", "")), transfer.token) or role not in transfer.channels:
+        return False
+    channel = transfer.channels[role]
+    if channel.done():
+        return False
+    channel.set_result((client, reader))
+    return True
+
+# Forwards the file data of one transfer from the uploader's data channel to the downloader's
+async def relayFile(transfer):
+    loop = asyncio.get_running_loop()
+    relayedBytes = 0
+    flow = None
+    writer = None # Writes the file into the content cache while it is relayed
+    try:
+        # Waits until both clients have opened their data channel
+        (uploadSocket, uploadReader), (downloadSocket, _) = await asyncio.wait_for(
+            asyncio.gather(transfer.channels["upload"], transfer.channels["download"]), TRANSFER_TIMEOUT)
+        frame = await asyncio.wait_for(uploadReader.readFrame(), FRAME_TIMEOUT)
+        if frame is None or frame.type != protocol.FILE:
+            raise protocol.ProtocolError("The uploader did not send the file")
+        length = frame.body["length"]
+        # The owner may have left since the request. Without the file's size and piece size the downloader cannot place the data.
+        fileData = transfer.record or catalog.first(transfer.hash)
+        if fileData is None:
+            sendTo(transfer.downloader, protocol.ERROR, {"message": "File is not available"}, transfer.requestId)
+            raise protocol.ProtocolError(f"{transfer.hash} is not in the catalog any more")
+        started = time.perf_counter()
+        # Both clients count towards their per-peer limit, the size decides whether the file is relayed ahead of bulk transfers
+        flow = relayScheduler.open((transfer.uploader, transfer.downloader), length)
+
+        # Tell the downloader the file is coming before the first byte arrives,
+        # then forward the packets as they come in from the uploader (see relay.py).
+        # The header tells where in the file the data starts and how the file is split into pieces,
+        # so the downloader can keep track of what it has received and resume later.
+        # A compressed transfer is relayed until the uploader closes its side, its size on the wire is not known before
+        # The uploader's piece hashes go with it, the downloader checks them against the Merkle root from the catalog
+        # and then every piece as it arrives.
+        codec = frame.body.get("codec")
+        wireLength = None if codec else length
+        header = {
+            "hash": transfer.hash,
+            "offset": frame.body["offset"],
+            "length": length,
+            "size": fileData.size,
+            "pieceSize": fileData.pieceSize,
+            "transfer": transfer.id
+        }
+        if frame.body.get("pieces") is not None and fileData.root:
+            header["pieces"] = frame.body["pieces"]
+            header["root"] = fileData.root
+        if codec:
+            header["codec"] = codec
+        elif contentCache is not None and header["offset"] == 0:
+            writer = contentCache.writer(transfer.hash, length, fileData.pieceSize or DEFAULT_PIECE_SIZE)
+        await asyncio.wait_for(loop.sock_sendall(downloadSocket, encodeFrame(protocol.FILE, header)), FRAME_TIMEOUT)
+        # Part of the data may have arrived together with the FILE frame
+        pending = uploadReader.takeBuffered(uploadReader.buffered() if wireLength is None else wireLength)
+        if pending and flow.limited:
+            await flow.acquireAsync(len(pending))
+        await asyncio.wait_for(loop.sock_sendall(downloadSocket, pending), FRAME_TIMEOUT)
+        if writer is not None:
+            writer.write(pending)
+        remaining = None if wireLength is None else wireLength - len(pending)
+        relayedBytes = len(pending) + await relayStreamAsync(uploadSocket, downloadSocket, remaining, flow=flow, sink=writer)
+        duration = time.perf_counter() - started
+        speed = relayedBytes / max(duration, 1e-6) / 1024 / 1024
+        transfersFinished.inc("ok")
+        relayBytes.inc(amount=relayedBytes)
+        transferDuration.observe(duration)
+        transferSpeed.observe(speed)
+        compression = f", {codec} compressed from {length} bytes" if codec else ""
+        print(f"Transfer {transfer.id} complete. {relayedBytes} bytes of {transfer.hash} relayed from {transfer.uploader} to {transfer.downloader}"
+              f" in {duration:.2f} s ({speed:.1f} MB/s){compression}.")
+        if writer is not None and writer.commit():
+            print(f"{transfer.hash} is cached, {contentCache.size} bytes in {len(contentCache)} cached files")
+    except asyncio.CancelledError:
+        transfersFinished.inc("cancelled")
+        raise
+    except Exception as e:
+        # The downloader keeps what it has received and resumes from there when it asks again
+        transfersFinished.inc("failed")
+        print(f"Transfer {transfer.id} of {transfer.hash} to {transfer.downloader} failed after {relayedBytes} bytes: {e!r}")
+    finally:
+        transfers.pop(transfer.id, None)
+        if flow is not None:
+            flow.close()
+        if writer is not None:
+            writer.abort()
+        for channel in transfer.channels.values():
+            if channel.done() and not channel.cancelled():
+                channel.result()[0].close()
+            else:
+                channel.cancel()
+
+# Sends a file from the content cache to the downloader's data channel with sendfile (see relay.py).
+# The downloader cannot tell it apart from a relayed transfer, so it resumes the same way.
+async def sendCachedFile(transfer, file, size):
+    loop = asyncio.get_running_loop()
+    sentBytes = 0
+    flow = None
+    try:
+        downloadSocket, _ = await asyncio.wait_for(transfer.channels["download"], TRANSFER_TIMEOUT)
+        offset = min(transfer.offset, size)
+        length = size - offset
+        started = time.perf_counter()
+        fileData = transfer.record or catalog.first(transfer.hash)
+        header = {
+            "hash": transfer.hash,
+            "offset": offset,
+            "length": length,
+            "size": size,
+            "pieceSize": fileData.pieceSize if fileData and fileData.pieceSize else DEFAULT_PIECE_SIZE,
+            "transfer": transfer.id
+        }
+        # The piece hashes were calculated while the file was cached, the file matched its hash so they are right.
+        # The Merkle root only goes with them while somebody shares the file.
+        manifest = contentCache.manifest(transfer.hash)
+        if manifest is not None:
+            header["pieceSize"], header["pieces"] = manifest
+            if fileData and fileData.root and fileData.pieceSize == header["pieceSize"]:
+                header["root"] = fileData.root
+        await asyncio.wait_for(loop.sock_sendall(downloadSocket, encodeFrame(protocol.FILE, header)), FRAME_TIMEOUT)
+        flow = relayScheduler.open((transfer.downloader,), length)
+        sentBytes = await sendFileAsync(downloadSocket, file, offset, length, flow=flow)
+        duration = time.perf_counter() - started
+        speed = sentBytes / max(duration, 1e-6) / 1024 / 1024
+        transfersFinished.inc("ok")
+        cacheBytesSent.inc(amount=sentBytes)
+        transferDuration.observe(duration)
+        transferSpeed.observe(speed)
+        print(f"Transfer {transfer.id} complete. {sentBytes} bytes of {transfer.hash} sent from the cache to {transfer.downloader}"
+              f" in {duration:.2f} s ({speed:.1f} MB/s).")
+    except asyncio.CancelledError:
+        transfersFinished.inc("cancelled")
+        raise
+    except Exception as e:
+        transfersFinished.inc("failed")
+        print(f"Transfer {transfer.id} of {transfer.hash} from the cache to {transfer.downloader} failed after {sentBytes} bytes: {e!r}")
+    finally:
+        file.close()
+        transfers.pop(transfer.id, None)
+        if flow is not None:
+            flow.close()
+        for channel in transfer.channels.values():
+            if channel.done() and not channel.cancelled():
+                channel.result()[0].close()
+            else:
+                channel.cancel()
+
+# Returns (home tracker, seeding address) of a file's owner. The home is None when this tracker runs alone.
+def ownerInfo(owner):
+    if owner in connections or cluster is None:
+        return (cluster.node if cluster else None), peer_addresses.get(owner)
+    return shardOwners.get(owner, (None, None))
+
+# Returns the records of a file as (FileRecord, owner's home tracker, owner's seeding address or None), from the local
+# catalog or from the tracker whose shard has the file. An unreachable shard is treated like a file nobody has.
+async def lookupFile(fileHash):
+    if cluster is None or cluster.isLocal(fileHash):
+        return [(record, *ownerInfo(record.owner)) for record in catalog.get(fileHash) or ()]
+    node = cluster.owner(fileHash)
+    try:
+        reply = await cluster.request(node, protocol.SHARDLOOKUP, {"hash": fileHash})
+    except CLUSTER_ERRORS as e:
+        print(f"Cannot look {fileHash} up on tracker {node}: {e!r}")
+        return []
+    return [(FileRecord.fromDict(data), data["home"], data["address"]) for data in reply.body["records"]]
+
+# Adds a client's files to the catalog, in a cluster to the shards of the trackers the hashes belong to.
+# Returns how many were new. Files meant for a tracker that cannot be reached are not added.
+async def announceFiles(owner, records):
+    if cluster is None:
+        groups = {None: records}
+    else:
+        groups = cluster.group(records, lambda record: record.hash)
+    added = 0
+    local = groups.pop(cluster.node if cluster else None, None)
+    if local:
+        version = catalog.version
+        added += len(catalog.addMany(local))
+        if catalog.version != version:
+            publishChanges()
+    if groups:
+        home, address = ownerInfo(owner)
+        nodes = list(groups)
+        replies = await asyncio.gather(*(cluster.request(node, protocol.SHARDANNOUNCE, {
+            "owner": owner, "home": home, "address": address, "files": [record.toDict() for record in groups[node]]
+        }) for node in nodes), return_exceptions=True)
+        for node, reply in zip(nodes, replies):
+            if isinstance(reply, Exception):
+                print(f"Cannot add {len(groups[node])} file(s) of {owner} to tracker {node}: {reply!r}")
+            else:
+                added += reply.body["added"]
+    return added
+
+# File names are not partitioned, so every tracker searches its own shard for the page and the pages are merged by rank.
+# The cursor is the rank of the last result like on a single tracker, each tracker continues after it.
+async def searchCluster(query, limit, cursor):
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    ranked, total = catalog.searchRanked(query, limit + 1, cursor)
+    replies = await cluster.gather(protocol.SEARCH, {"query": query, "limit": limit + 1, "cursor": cursor})
+    for node, reply in replies.items():
+        if isinstance(reply, Exception):
+            print(f"Tracker {node} did not answer the search: {reply!r}")
+            continue
+        ranked.extend((tuple(rank), result) for rank, result in reply.body["ranks"])
+        total += reply.body["total"]
+    ranked.sort(key=lambda entry: entry[0])
+    results, nextCursor = searchPage(ranked[:limit + 1], limit)
+    return results, nextCursor, total
+
+# Returns (clusterVersion, files of every tracker). The clients all ask after the same NEWFILE, so the trackers are only asked once per version.
+async def clusterFiles():
+    global clusterSnapshot
+    if clusterSnapshot[0] != clusterVersion:
+        clusterSnapshot = (clusterVersion, asyncio.ensure_future(gatherFiles()))
+    version, task = clusterSnapshot
+    return version, await asyncio.shield(task)
+
+async def gatherFiles():
+    files = dict(catalog.files())
+    for node, reply in (await cluster.gather(protocol.FILELISTREQUEST)).items():
+        if isinstance(reply, Exception):
+            print(f"Tracker {node} did not send its file list: {reply!r}")
+            continue
+        files.update((data["hash"], data["fileName"]) for data in reply.body["files"])
+    return [{"hash": fileHash, "fileName": fileName} for fileHash, fileName in files.items()]
+
+# Reserves a nickname for a new client. In a cluster the tracker that owns the nickname on the ring decides.
+# If that tracker cannot be reached the nickname is refused, as another client may hold it there.
+async def claimNickname(nickname):
+    if cluster is None:
+        return True
+    node = cluster.owner(nickname)
+    if node == cluster.node:
+        if nickname in claims:
+            return False
+        claims[nickname] = cluster.node
+        return True
+    try:
+        reply = await cluster.request(node, protocol.CLAIM, {"nickname": nickname, "home": cluster.node})
+        return reply.body["valid"]
+    except CLUSTER_ERRORS as e:
+        print(f"Cannot check nickname {nickname} on tracker {node}: {e!r}")
+        return False
+
+def releaseNickname(nickname):
+    node = cluster.owner(nickname)
+    if node == cluster.node:
+        claims.pop(nickname, None)
+    else:
+        cluster.post(node, protocol.RELEASE, {"nickname": nickname, "home": cluster.node})
+
 # Handles message exchange between two clients or client and server.
-def handle(client, nickname):
+async def handle(connection):
+    nickname = connection.nickname
+    reader = connection.reader
     while True:
         try:
-            # message is a str received from the client. 
-            # The message is written in the form: "REQUEST:FileHash:FileName" for example
-            message = client.recv(1024).decode("utf-8").split(":")
-            option = message[0]
+            # frame is the next message from the client, frame.body holds its fields,
+            # for example {"hash": "a1b2c3d4", "offset": 0} for a DOWNLOADREQUEST
+            frame = await reader.readFrame()
+            if frame is None:
+                print(f"Client {nickname} closed the connection")
+                clientDisconnect(nickname)
+                break
+            option = frame.type
+            message = frame.body
+            started = time.perf_counter()
+            messagesHandled.inc(frame.name)
 
             # Inform uploader for upcoming download request.
-            if option == "DOWNLOADREQUEST":
+            if option == protocol.DOWNLOADREQUEST:
                 # Parsing the info from message
-                fileHash = message[1]
+                fileHash = message["hash"]
+                offset = message.get("offset", 0)
                 
-                # Getting the uploader information from the database and the connections list:
-                fileDict = fileDB.getByQuery({"hash": fileHash})
-                fileUploader = fileDict[0]["owner"]
-                 
-                # Add the client requesting the file to the download_queue dictionary.
-                download_queue[fileHash] = nickname
-
-                # Sends a message to the client who has the file to let them know to start sending it.
-                fileRequestMessage = "FILESENDREQUEST:" + fileHash
-                connections[fileUploader].send(fileRequestMessage.encode("utf-8"))
+                # Getting the uploader information from the catalog (the shard's tracker in a cluster) and the seeding addresses:
+                fileRecords = await lookupFile(fileHash)
+                # If the owners accept direct connections the downloader fetches the file straight from them
+                # (in pieces, from all of them at once), so the file data does not go through the server at all.
+                seeders = list({tuple(address) for record, _, address in fileRecords if address and record.owner != nickname})
+                if not fileRecords and (contentCache is None or fileHash not in contentCache):
+                    sendTo(nickname, protocol.ERROR, {"message": "File is not available"}, frame.requestId)
+                elif seeders:
+                    seeders = random.sample(seeders, min(len(seeders), MAX_SWARM_PEERS))
+                    record = fileRecords[0][0]
+                    # The piece size and the Merkle root of the file's manifest let the downloader check every piece it receives
+                    sendTo(nickname, protocol.PEERLIST, {
+                        "hash": fileHash,
+                        "size": record.size,
+                        "pieceSize": record.pieceSize,
+                        "root": record.root,
+                        "peers": seeders
+                    }, frame.requestId)
+                elif fileRecords:
+                    # Relayed from the owner, or sent from the content cache if the server has the file
+                    record, home, _ = fileRecords[0]
+                    requestRelay(fileHash, record.owner, nickname, offset, message.get("codecs", ()), record, home, frame.requestId)
+                else:
+                    requestRelay(fileHash, None, nickname, offset, message.get("codecs", ()), requestId=frame.requestId)
+
+            # The downloader could not connect to the uploader directly, the file is relayed through the server instead.
+            elif option == protocol.RELAYREQUEST:
+                fileHash = message["hash"]
+                fileRecords = await lookupFile(fileHash)
+                if not fileRecords and (contentCache is None or fileHash not in contentCache):
+                    sendTo(nickname, protocol.ERROR, {"message": "File is not available"}, frame.requestId)
+                elif fileRecords:
+                    record, home, _ = fileRecords[0]
+                    requestRelay(fileHash, record.owner, nickname, message.get("offset", 0), message.get("codecs", ()), record, home, frame.requestId)
+                else:
+                    requestRelay(fileHash, None, nickname, message.get("offset", 0), message.get("codecs", ()), requestId=frame.requestId)
+
+            # Client tells where its seeding listener accepts direct connections from other clients.
+            elif option == protocol.PEERADDRESS:
+                host = message["host"] or connection.sock.getpeername()[0]
+                peer_addresses[nickname] = (host, message["port"])
+                print(f"{nickname} is seeding on {host}:{message['port']}")
+                if cluster is not None:
+                    # The trackers with the client's files give the address to downloaders
+                    cluster.postAll(protocol.SHARDOWNER, {"owner": nickname, "home": cluster.node, "address": list(peer_addresses[nickname])})
                 
 
-            # Starts sending the file 
-            elif option == "FILE":
-                chunkList = []
-                fileHash = message[1]
-                #fileExtension = fileDB.getByQuery({"hash":fileHash})[0]["fileName"].split(".")[1]
-                #tempFile = "temp." + fileExtension
-
-                # Finds the downloaders socket from a downloader_queue dictionary
-                if fileHash in download_queue.keys():
-                    # Define neccessary variables
-                    username = download_queue[fileHash] # Downloaders username
-                    downloaderSocket = connections[username]
-                    uploaderSocket = client
-
-                    # Start receiving packets from the uploader
-                    file_message = uploaderSocket.recv(1024)
-                    while file_message:
-                        chunkList.append(file_message)
-                        file_message = uploaderSocket.recv(1024)
-                    
-                    # Sending the file to the client who is requesting it
-                    message = "FILE:" + fileHash
-                    downloaderSocket.send(message.encode("utf-8"))
-                    for chunk in chunkList:
-                        downloaderSocket.send(chunk)
-                    downloaderSocket.shutdown(socket.SHUT_WR)
-                    #downloaderSocket.close()
-                print(f"Sending file complete. {len(chunkList)} packets sent.")
+            # Files are sent over data channels, a FILE frame here is from an old client. Its data is skipped.
+            elif option == protocol.FILE:
+                await skipData(reader, message["length"])
+                sendTo(nickname, protocol.ERROR, {"message": "Send files over a data channel"}, frame.requestId)
 
             # Client wants the server to know that they have a file that they can send to other clients upon request.
-            elif option == "UPLOADREQUEST":
-                hashList = fileDB.getByQuery({"hash":message[3]})
-                
-                # If hash is not found on the database already, adds the file info to the database
-                if hashList == []:
-                    print("Adding file to db")
-                    fileDB.add({
-                        "hash": message[3],
-                        "owner": message[1],
-                        "fileName": message[2]
-                    })
+            elif option == protocol.UPLOADREQUEST and not isFileHash(message["hash"]):
+                sendTo(nickname, protocol.ERROR, {"message": "Invalid file hash"}, frame.requestId)
+            elif option == protocol.UPLOADREQUEST:
+                # The owner is always the client itself, whatever the message says
+                fileData = FileRecord(message["hash"], nickname, message["fileName"],
+                                      message["size"], message["pieceSize"], message["root"])
+
+                # Adds the file info to the catalog unless this client has already shared the same file.
+                # The change is pushed to every client, a new owner of a listed file does not change anyone's list.
+                if await announceFiles(nickname, [fileData]):
+                    print("Adding file to catalog")
+                    # A message to client informing about a successful upload
+                    sendTo(nickname, protocol.UPLOAD, {"status": "Successful"}, frame.requestId)
+                # If the client has already shared the file, it won't be added there another time.
                 else:
-                    for data in hashList:
-                        if data["owner"] != nickname:
-                            print("Adding file to db")
-                            fileDB.add({
-                                "hash": message[3],
-                                "owner": message[1],
-                                "fileName": message[2]
-                            })
-                            # A message to client informing about a successful upload
-                            client.send("UPLOAD:Successful".encode("utf-8"))
-                        # If the hash can already be found on the database, it won't be added there another time.
-                        else:
-                            client.send("UPLOAD:Failed".encode("utf-8"))
-                
-                # Broadcast to every client to tell them to request an updated file list
-                updateMessage = "NEWFILE"
-                broadcast(updateMessage)
+                    sendTo(nickname, protocol.UPLOAD, {"status": "Failed"}, frame.requestId)
             
-            # Sends the contents of fileDB to a client requesting it
-            elif option == "FILELISTREQUEST":
-                sendFileList(client)
+            # Client shares many files at once, usually everything in its folder when it connects.
+            # The files are added to the catalog in one go and the other clients get one notification for all of them.
+            elif option == protocol.ANNOUNCE:
+                # Files whose hash is not a SHA-256 hash in hex are left out and counted as rejected
+                records = [FileRecord(data["hash"], nickname, data["fileName"], data["size"], data["pieceSize"], data["root"])
+                           for data in message["files"] if isFileHash(data["hash"])]
+                added = await announceFiles(nickname, records)
+                print(f"{nickname} shared {added} file(s)")
+                sendTo(nickname, protocol.ANNOUNCED, {"added": added, "duplicates": len(records) - added,
+                                                      "rejected": len(message["files"]) - len(records)}, frame.requestId)
+
+            # Sends the contents of the catalog to a client requesting it
+            elif option == protocol.FILELISTREQUEST:
+                if cluster is None:
+                    sendFileList(connection, frame.requestId)
+                else:
+                    version, files = await clusterFiles()
+                    connection.legacy = True
+                    connection.syncedVersion = version
+                    connection.enqueue(encodeFrame(protocol.FILELIST, {"files": files, "version": version}, frame.requestId))
+
+            # Finds files by name, one page at a time
+            elif option == protocol.SEARCH:
+                try:
+                    query, limit = str(message.get("query", "")), int(message.get("limit") or MAX_SEARCH_RESULTS)
+                    if cluster is None:
+                        results, cursor, total = catalog.search(query, limit, message.get("cursor"))
+                    else:
+                        results, cursor, total = await searchCluster(query, limit, message.get("cursor"))
+                    sendTo(nickname, protocol.SEARCHRESULTS, {"results": results, "cursor": cursor, "total": total}, frame.requestId)
+                except (TypeError, ValueError):
+                    sendTo(nickname, protocol.ERROR, {"message": "Invalid search cursor"}, frame.requestId)
+
+            # Sends the changes since the version of the file list the client has
+            elif option == protocol.SYNCREQUEST:
+                if cluster is None:
+                    sendCatalogSync(connection, message.get("version"), frame.requestId)
+                else:
+                    # The shards have no common changelog, a client that is behind gets the whole file list
+                    version, files = await clusterFiles()
+                    current = message.get("version") == version
+                    connection.syncedVersion = version
+                    connection.enqueue(encodeFrame(protocol.SYNC, {"from": message.get("version"), "version": version, "snapshot": not current,
+                                                                   "added": [] if current else files, "removed": []}, frame.requestId))
             
             # Removes the client's files from the database when a client disconnects from the network.
-            elif  option == "DISCONNECT":
+            elif  option == protocol.DISCONNECT:
                 print(f"Client {nickname} disconnecting")
                 clientDisconnect(nickname)
                 break
 
+            else:
+                sendTo(nickname, protocol.ERROR, {"message": f"Unexpected message {frame.name}"}, frame.requestId)
+            handleLatency.observe(time.perf_counter() - started, frame.name)
+
+            # sendTo drops clients that cannot keep up, their coroutine ends here
+            if connections.get(nickname) is not connection:
+                break
+
+        except asyncio.TimeoutError:
+            print("\nhandle")
+            print(f"{nickname} sent only part of a frame within {FRAME_TIMEOUT} s, disconnecting")
+            clientDisconnect(nickname)
+            break
         except ConnectionAbortedError as e:
             print("\nhandle")
             print(f"ConnectionAbortedError, disconnecting {nickname}")
@@ -174,48 +769,383 @@ def handle(client, nickname):
             clientDisconnect(nickname)
             break
 
-# Handles the new clients and connections.
-def server_main():
+# Checks if users username is unique. Returns the nickname, or None if the client left before picking a free one.
+# A connection that starts with DATACHANNEL is a data channel of a transfer, it is handed to the transfer and "" is returned.
+# A connection that starts with NODE is another tracker of the cluster, its NODE frame is returned.
+async def handshake(client, reader):
+    loop = asyncio.get_running_loop()
     while True:
+        frame = await reader.readFrame()
+        if frame is None:
+            return None # Client left before choosing a nickname
+        if frame.type == protocol.DATACHANNEL:
+            return "" if attachDataChannel(client, reader, frame.body) else None
+        if frame.type == protocol.NODE:
+            return frame
+        if frame.type != protocol.NICKNAME:
+            continue
+        nickname = frame.body["nickname"]
+        if nickname in connections or nickname in pendingNicknames:
+            await loop.sock_sendall(client, encodeFrame(protocol.NICKNAMESTATUS, {"valid": False}, frame.requestId))
+            continue
+        # Reserved before the first await, so two clients asking for the same free nickname cannot both get it
+        pendingNicknames.add(nickname)
+        claimed = False
         try:
-            client, address = server.accept()
-            print(f"Connected with {str(address)}")
-            nickname = None
-            
-            # Checks if users username is unique
-            invalid = True
-            while invalid:
-                nickname = client.recv(1024).decode("utf-8")
-                if nickname != None:
-                    if nickname in connections.keys():
-                        client.send("INVALID".encode())
-                    else:
-                        client.send("VALID".encode())
-                        invalid = False
-        
+            claimed = await claimNickname(nickname)
+            await loop.sock_sendall(client, encodeFrame(protocol.NICKNAMESTATUS, {"valid": claimed}, frame.requestId))
+        except BaseException: # Also the cancellation when the handshake times out
+            pendingNicknames.discard(nickname)
+            if claimed and cluster is not None:
+                releaseNickname(nickname)
+            raise
+        if claimed:
+            return nickname # handleClient moves it from pendingNicknames to connections
+        pendingNicknames.discard(nickname)
 
-            # A dictionary where UNIQUE nicknames for users is the key and value is a list of their files
-            connections[nickname] = client
+# Runs the handshake for a new client and then serves it until it leaves
+async def handleClient(client, address):
+    reader = AsyncFrameReader(client, FRAME_TIMEOUT)
+    try:
+        nickname = await asyncio.wait_for(handshake(client, reader), HANDSHAKE_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"{address} did not pick a nickname within {HANDSHAKE_TIMEOUT} s")
+        nickname = None
+    except Exception as e:
+        print("\nhandshake")
+        print(f"Exception occurred: {e}")
+        nickname = None
+    if nickname is None:
+        client.close()
+        return
+    if nickname == "":
+        return # A data channel, relayFile uses and closes it
+    if isinstance(nickname, protocol.Frame):
+        await handleNode(client, reader, nickname)
+        return
 
-            print("Nickname of the client is", nickname + "!")
+    # A dictionary where UNIQUE nicknames for users is the key and value is their connection
+    connection = Client(client, reader, nickname)
+    connections[nickname] = connection
+    pendingNicknames.discard(nickname)
+    connection.start()
+    print("Nickname of the client is", nickname + "!")
+    await handle(connection)
 
-            thread = threading.Thread(target=handle, args=(client, nickname,))
-            thread.start() # This starts the worker (handle) function in a separate thread.
+# Answers the requests of another tracker of the cluster. Its connection stays open, the replies carry the request IDs.
+async def handleNode(sock, reader, hello):
+    if cluster is None:
+        await asyncio.get_running_loop().sock_sendall(sock, encodeFrame(protocol.ERROR, {"message": "This tracker is not in a cluster"}, hello.requestId))
+        sock.close()
+        return
+    loop = asyncio.get_running_loop()
+    if not await cluster.admits(hello.body, sock.getpeername()[0]):
+        print(f"Refused tracker {hello.body.get('node')!r} from {sock.getpeername()[0]}, it is not a tracker of this cluster")
+        await loop.sock_sendall(sock, encodeFrame(protocol.ERROR, {"message": "Not a tracker of this cluster"}, hello.requestId))
+        sock.close()
+        return
+    node = hello.body["node"]
+    connection = Connection(sock, reader)
+    connection.start()
+    connection.enqueue(encodeFrame(protocol.NODE, cluster.hello(), hello.requestId))
+    cluster.learn([node, *hello.body.get("nodes", ())])
+    try:
+        while True:
+            frame = await reader.readFrame()
+            if frame is None:
+                break
+            option = frame.type
+            message = frame.body
+            messagesHandled.inc(frame.name)
+            reply = None
 
-        except ConnectionAbortedError as e:
-            print("\nmain")
-            print(f"ConnectionAbortedError: {e}")
-            clientDisconnect(nickname)
-            # print("1:", connections)
-            continue
-        except Exception as e:
+            # Files of a client of another tracker whose hashes belong to this tracker's shard
+            if option == protocol.SHARDANNOUNCE:
+                owner = message["owner"]
+                shardOwners[owner] = (message["home"], message["address"])
+                records = [FileRecord(data["hash"], owner, data["fileName"], data["size"], data["pieceSize"], data["root"])
+                           for data in message["files"] if isFileHash(data["hash"])]
+                version = catalog.version
+                added = catalog.addMany(records)
+                if catalog.version != version:
+                    publishChanges()
+                reply = (protocol.ANNOUNCED, {"added": len(added), "duplicates": len(records) - len(added)})
+
+            elif option == protocol.SHARDOWNER:
+                shardOwners[message["owner"]] = (message["home"], message["address"])
+
+            elif option == protocol.SHARDFORGET:
+                shardOwners.pop(message["owner"], None)
+                version = catalog.version
+                catalog.removeOwner(message["owner"])
+                if catalog.version != version:
+                    publishChanges()
+
+            elif option == protocol.SHARDLOOKUP:
+                records = []
+                for record in catalog.get(message["hash"]) or ():
+                    home, address = ownerInfo(record.owner)
+                    records.append({**record.toDict(), "home": home, "address": address})
+                reply = (protocol.SHARDRECORDS, {"records": records})
+
+            # One page of this shard, with the ranks so that the asking tracker can merge the pages
+            elif option == protocol.SEARCH:
+                try:
+                    count = max(1, min(int(message.get("limit") or MAX_SEARCH_RESULTS), MAX_SEARCH_RESULTS + 1))
+                    ranked, total = catalog.searchRanked(str(message.get("query", "")), count, message.get("cursor"))
+                    reply = (protocol.SEARCHRESULTS, {"ranks": [[list(rank), result] for rank, result in ranked], "total": total})
+                except (TypeError, ValueError):
+                    reply = (protocol.ERROR, {"message": "Invalid search cursor"})
+
+            elif option == protocol.FILELISTREQUEST:
+                reply = (protocol.FILELIST, {"files": [{"hash": fileHash, "fileName": fileName} for fileHash, fileName in catalog.files()]})
+
+            # Another tracker's shard has changed, its clients are told by that tracker
+            elif option == protocol.NEWFILE:
+                publishChanges(forward=False)
+
+            # A client of this tracker is asked to upload a file to a transfer on another tracker
+            elif option == protocol.FILESENDREQUEST:
+                sendTo(message.pop("uploader"), protocol.FILESENDREQUEST, message)
+
+            elif option == protocol.CLAIM:
+                valid = message["nickname"] not in claims
+                if valid:
+                    claims[message["nickname"]] = message["home"]
+                reply = (protocol.NICKNAMESTATUS, {"valid": valid})
+
+            elif option == protocol.RELEASE:
+                if claims.get(message["nickname"]) == message["home"]:
+                    del claims[message["nickname"]]
+
+            # The tracker itself or a tracker that is gone for good, see leaveCluster and removeNode
+            elif option == protocol.LEAVE:
+                cluster.forget(message["node"])
+
+            else:
+                reply = (protocol.ERROR, {"message": f"Unexpected message {frame.name}"})
+            if reply is not None:
+                connection.enqueue(encodeFrame(*reply, frame.requestId))
+    except (OSError, protocol.ProtocolError, KeyError) as e:
+        print(f"Tracker {node} sent an invalid request or broke: {e!r}")
+    finally:
+        connection.close()
+
+# Called when trackers join the cluster. Connecting to them tells them about this tracker and the ones it knows,
+# then the files and nicknames whose keys moved to them are handed over.
+def clusterJoined(nodes):
+    for node in nodes:
+        cluster.post(node, protocol.NEWFILE) # Opens the link, the new tracker's clients may not have this tracker's files yet
+    task = asyncio.get_running_loop().create_task(rebalance())
+    backgroundTasks.add(task)
+    task.add_done_callback(backgroundTasks.discard)
+
+# Hands the records and nickname claims that now belong to another tracker over to it. Only the keys that moved are sent,
+# about 1/N of them when the cluster grows to N trackers. Records that could not be handed over stay here.
+async def rebalance():
+    moved = {}
+    for record in catalog.records():
+        node = cluster.owner(record.hash)
+        if node != cluster.node:
+            moved.setdefault((node, record.owner), []).append(record)
+    failed = set()
+    for (node, owner), records in moved.items():
+        home, address = ownerInfo(owner)
+        try:
+            await cluster.request(node, protocol.SHARDANNOUNCE, {"owner": owner, "home": home, "address": address,
+                                                                 "files": [record.toDict() for record in records]})
+        except CLUSTER_ERRORS as e:
+            print(f"Cannot hand {len(records)} file(s) of {owner} over to tracker {node}: {e!r}")
+            failed.update(record.hash for record in records)
+    hashes = {record.hash for records in moved.values() for record in records} - failed
+    for fileHash in hashes:
+        catalog.removeFile(fileHash)
+    for nickname, home in list(claims.items()):
+        node = cluster.owner(nickname)
+        if node != cluster.node:
+            try:
+                await cluster.request(node, protocol.CLAIM, {"nickname": nickname, "home": home})
+                del claims[nickname]
+            except CLUSTER_ERRORS as e:
+                print(f"Cannot hand nickname {nickname} over to tracker {node}: {e!r}")
+    if hashes:
+        print(f"Handed {len(hashes)} file(s) over to the trackers that own them now, {len(catalog.byHash)} left in this shard")
+
+# Called when a tracker has left the cluster. Its clients are gone, so their files and nicknames go too.
+# The files it kept for the other trackers' clients were handed over by leaveCluster, or are lost if it is gone for good
+# until their owners announce them again.
+def clusterLeft(node):
+    owners = [owner for owner, (home, _) in shardOwners.items() if home == node]
+    version = catalog.version
+    for owner in owners:
+        del shardOwners[owner]
+        catalog.removeOwner(owner)
+    for nickname in [nickname for nickname, home in claims.items() if home == node]:
+        del claims[nickname]
+    if catalog.version != version:
+        publishChanges()
+
+# Hands this tracker's shard and nicknames over to the trackers that own them without it, then tells them it has left.
+# The files of this tracker's own clients are not handed over, they leave with it.
+async def leaveCluster():
+    others = cluster.others()
+    if not others:
+        return
+    for nickname in list(connections):
+        catalog.removeOwner(nickname)
+    for nickname in [nickname for nickname, home in claims.items() if home == cluster.node]:
+        del claims[nickname]
+    cluster.ring.remove(cluster.node)
+    await rebalance()
+    await asyncio.gather(*(cluster.link(node).send(protocol.LEAVE, {"node": cluster.node}) for node in others), return_exceptions=True)
+    print(f"Left the cluster of {', '.join(others)}")
+
+# Takes a tracker off the ring of this tracker and of the others. Returns what was done, for the stats port.
+def removeNode(node):
+    if cluster is None:
+        return "This tracker is not in a cluster\n"
+    if not cluster.forget(node):
+        return f"{node} is not a tracker of this cluster\n"
+    cluster.postAll(protocol.LEAVE, {"node": node})
+    return f"Removed {node}, {len(cluster.ring)} trackers left\n"
+
+# Lets the server keep as many sockets open as the system allows
+def raiseFileLimit():
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError) as e:
+        print(f"Could not raise the open file limit: {e}")
+
+# Answers one connection to the stats port with the metrics in the Prometheus text format.
+# An HTTP GET (from Prometheus or curl) gets an HTTP reply, GET /profile returns the profiler's folded stacks.
+# A client that sends nothing, e.g. nc, gets the plain metrics after STATS_REQUEST_TIMEOUT.
+async def serveStats(reader, writer):
+    try:
+        try:
+            requestLine = await asyncio.wait_for(reader.readline(), STATS_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            requestLine = b""
+        http = requestLine.startswith(b"GET ")
+        path = requestLine.split()[1].decode("latin-1") if http and len(requestLine.split()) > 1 else "/metrics"
+        if http:
+            # The headers are not needed, they are only read so that the client does not get a reset
+            while (await asyncio.wait_for(reader.readline(), STATS_REQUEST_TIMEOUT)).strip():
+                pass
+        if path.startswith("/profile"):
+            body = profiler.folded() if profiler else "# The server runs without --profile\n"
+        elif path.startswith("/remove"):
+            # GET /remove?node=HOST:PORT takes a tracker that is gone for good off the ring
+            body = removeNode(parse_qs(urlsplit(path).query).get("node", [""])[0])
+        else:
+            body = metrics.render()
+        data = body.encode("utf-8")
+        if http:
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         + f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("ascii"))
+        writer.write(data)
+        await writer.drain()
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Stats request failed: {e!r}")
+    finally:
+        writer.close()
+
+# Handles the new clients and connections.
+# relayLimit, peerLimit and transferLimit are bytes per second of the relay in total, per client and per transfer.
+# cacheDir is the folder of the content cache, which may take up to cacheSize bytes. No folder, no cache.
+# clusterNodes are the addresses ("host:port") of other trackers to share the catalog with, node is this tracker's own address.
+# clusterSecret lets trackers that are not in clusterNodes join, see sharding.Cluster.
+async def server_main(host=HOST, port=PORT, statsHost=STATS_HOST, statsPort=None, profilePath=None,
+                      relayLimit=None, peerLimit=None, transferLimit=None, cacheDir=None, cacheSize=parseSize(CACHE_SIZE),
+                      clusterNodes=None, node=None, clusterSecret=None):
+    global profiler, relayScheduler, contentCache, cluster, transferIds
+    raiseFileLimit()
+    if clusterNodes is not None:
+        cluster = Cluster(node or f"{host}:{port}", clusterNodes, clusterJoined, clusterLeft, clusterSecret)
+        # A client may upload for transfers of several trackers, their IDs must not clash
+        transferIds = itertools.count(random.randrange(1, 2 ** 31))
+        task = asyncio.get_running_loop().create_task(cluster.start())
+        backgroundTasks.add(task)
+        task.add_done_callback(backgroundTasks.discard)
+        print(f"Tracker {cluster.node} of a cluster of {len(cluster.ring)}: {', '.join(sorted(cluster.ring.nodes))}")
+    if cacheDir:
+        contentCache = ContentCache(cacheDir, cacheSize)
+        print(f"Content cache in {cacheDir}: {len(contentCache)} files, {contentCache.size} of {cacheSize} bytes used")
+    if relayLimit or peerLimit or transferLimit:
+        relayScheduler = BandwidthScheduler(relayLimit, peerLimit, transferLimit)
+        print(f"Relay bandwidth limits: {relayLimit or 'none'} in total, {peerLimit or 'none'} per client, {transferLimit or 'none'} per transfer (bytes/s)")
+    if statsPort is not None:
+        await asyncio.start_server(serveStats, statsHost, statsPort)
+        print(f"Stats are served on {statsHost}:{statsPort}")
+    if profilePath:
+        profiler = SamplingProfiler() # Samples the event loop, which runs in this thread
+        profiler.start()
+    try:
+        await acceptClients(host, port)
+    finally:
+        if cluster is not None:
+            try:
+                await asyncio.wait_for(leaveCluster(), LEAVE_TIMEOUT)
+            except (*CLUSTER_ERRORS, asyncio.CancelledError) as e:
+                print(f"Could not hand the shard over before shutting down: {e!r}")
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(profilePath)
+            print(f"{profiler.samples} profile samples written to {profilePath}")
+
+async def acceptClients(host, port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(BACKLOG)
+    server.setblocking(False)
+    print(f"Server is listening on port {port}...")
+    # print(f"IP: {host}")
+
+    loop = asyncio.get_running_loop()
+    clientTasks = set() # Keeps the client coroutines alive until they finish
+    while True:
+        try:
+            client, address = await loop.sock_accept(server)
+            client.setblocking(False)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"Connected with {str(address)}")
+            task = asyncio.create_task(handleClient(client, address))
+            clientTasks.add(task)
+            task.add_done_callback(clientTasks.discard)
+        except OSError as e:
+            # For example too many open files, wait a moment instead of spinning on the error
             print("\nmain")
             print(f"Exception occurred: {e}")
-            clientDisconnect(nickname)
-            # print("2:", connections)
-            continue
+            await asyncio.sleep(0.1)
 
 if __name__ == "__main__":
-    server_main()
+    parser = argparse.ArgumentParser(description="File sharing tracker server.")
+    parser.add_argument("--host", default=HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on")
+    parser.add_argument("--stats-port", type=int, help="Serve metrics in the Prometheus text format on this port, e.g. 9100")
+    parser.add_argument("--stats-host", default=STATS_HOST, help="Address the stats port listens on")
+    parser.add_argument("--profile", metavar="FILE", help="Sample the event loop and write the folded stacks to FILE on exit")
+    parser.add_argument("--relay-limit", type=parseRate, metavar="RATE", help="Bytes per second the relay sends in total, e.g. 50M")
+    parser.add_argument("--peer-limit", type=parseRate, metavar="RATE", help="Bytes per second relayed to or from one client, e.g. 10M")
+    parser.add_argument("--transfer-limit", type=parseRate, metavar="RATE", help="Bytes per second of one relayed transfer, e.g. 5M")
+    parser.add_argument("--cache-dir", metavar="DIR", help="Keep relayed files in this folder and send later downloads of them from there")
+    parser.add_argument("--cache-size", type=parseSize, default=CACHE_SIZE, metavar="SIZE", help=f"Disk space of the cache, least recently used files are evicted first (default {CACHE_SIZE})")
+    parser.add_argument("--cluster", type=lambda text: [node.strip() for node in text.split(",") if node.strip()], metavar="HOST:PORT,...",
+                        help="Split the catalog with these other trackers, one of them is enough to join a running cluster that has a --cluster-secret")
+    parser.add_argument("--cluster-secret", default=os.environ.get("FILESHARE_CLUSTER_SECRET"), metavar="SECRET",
+                        help="Shared by the trackers of the cluster, lets new trackers join (default the FILESHARE_CLUSTER_SECRET environment variable). "
+                             "Without it only the trackers in --cluster and the ones they know are accepted")
+    parser.add_argument("--node", metavar="HOST:PORT", help="Address the other trackers and the clients reach this tracker at (default --host:--port)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(server_main(args.host, args.port, args.stats_host, args.stats_port, args.profile,
+                                args.relay_limit, args.peer_limit, args.transfer_limit, args.cache_dir, args.cache_size,
+                                args.cluster, args.node, args.cluster_secret))
+    except KeyboardInterrupt:
+        pass
 
-print("Server is going offline.")
\ No newline at end of file
+print("Server is going offline.")
@@ -0,0 +1,166 @@
+# DS Final project
+# Compression of relayed file data. The downloader offers the codecs it knows when it asks for a file, and the uploader
+# picks one for the transfer if the start of the file compresses well enough, otherwise the file is sent as it is.
+# Sources:
+# 1. zlib documentation: https://docs.python.org/3/library/zlib.html
+
+
+'''
+1. Codec: Interface of a compression codec: a name, compress(data) and decompress(data, size).
+2. ZlibCodec: Codec on zlib from the standard library.
+3. registerCodec / getCodec / codecNames: The codecs this program knows, by name.
+4. chooseCodec: Takes the file path, the first block of data and the codec names the downloader offers as parameters and returns the codec to use or None.
+5. encodeBlock: Takes a codec and a block of file data as parameters and returns the block as it is sent.
+6. readBlock: Takes a codec, a function that reads exactly n bytes and the most bytes the block may have as parameters and returns the next block of file data.
+7. CompressionStats: Bytes before and after compression and the CPU time it took, for the transfer report.
+
+A compressed transfer is a sequence of blocks, each block is BLOCK_HEADER (size of the data, size on the wire) followed by
+the bytes on the wire. Every block is compressed on its own, so the receiver writes and verifies pieces as blocks arrive.
+A block that does not get smaller is sent as it is, its two sizes are equal.
+'''
+
+import os
+import struct
+import time
+import zlib
+
+from protocol import ProtocolError
+
+BLOCK_HEADER = struct.Struct("!II")
+BLOCK_SIZE = 4 * 1024 * 1024 # Most file data one block may carry, a header that claims more is rejected before anything is read
+ZLIB_LEVEL = 6
+MIN_RATIO = 0.9 # The sample has to shrink to this fraction of its size for the transfer to be compressed
+# Formats that are compressed already, they are sent as they are without trying
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".pdf", ".mp3", ".mp4", ".mkv", ".avi", ".mov", ".ogg",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jar", ".docx", ".xlsx", ".pptx"
+}
+
+
+class Codec:
+    '''A compression codec. name is what the peers call it in FILESENDREQUEST and FILE messages.'''
+    name = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    # size is the size of the data before compression, a block that decompresses to anything else is corrupt
+    def decompress(self, data, size):
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+
+    def __init__(self, level=ZLIB_LEVEL):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    # Inflates at most size bytes, a block that would inflate to more (e.g. a zip bomb from a hostile uploader) is rejected
+    # before it is held in memory
+    def decompress(self, data, size):
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError(f"Block does not decompress to {size} bytes")
+        return result
+
+
+codecs = {} # In the form: name: Codec
+
+
+def registerCodec(codec):
+    codecs[codec.name] = codec
+
+
+def getCodec(name):
+    return codecs.get(name)
+
+
+# Names of the known codecs in the order they are preferred
+def codecNames():
+    return list(codecs)
+
+
+registerCodec(ZlibCodec())
+
+
+# Picks the codec of a transfer. Returns None when the file is sent uncompressed.
+def chooseCodec(filePath, sample, offered):
+    """
+    Parameters:
+    - filePath: The path to the file. Files with a compressed format (INCOMPRESSIBLE_EXTENSIONS) are never compressed.
+    - sample: The first block of the data to send.
+    - offered: Names of the codecs the downloader can decompress.
+
+    Returns:
+    - codec: The first offered codec that shrinks the sample below MIN_RATIO of its size, or None.
+    """
+    if not sample or os.path.splitext(filePath)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return None
+    for name in offered or ():
+        codec = codecs.get(name)
+        if codec is not None and len(codec.compress(sample)) < MIN_RATIO * len(sample):
+            return codec
+    return None
+
+
+def encodeBlock(codec, data, stats=None):
+    start = time.thread_time()
+    compressed = codec.compress(data)
+    if len(compressed) >= len(data):
+        compressed = data # Stored as it is, this part of the file does not compress
+    if stats is not None:
+        stats.add(len(data), BLOCK_HEADER.size + len(compressed), time.thread_time() - start)
+    return BLOCK_HEADER.pack(len(data), len(compressed)) + compressed
+
+
+# Reads the next block. readExactly(n) returns exactly n bytes of the stream.
+# limit is the most data the block may hold, e.g. what is left of the file, a bigger block is rejected before it is read.
+def readBlock(codec, readExactly, stats=None, limit=None):
+    size, wireSize = BLOCK_HEADER.unpack(readExactly(BLOCK_HEADER.size))
+    # An empty block would never move the receiver forward, so it is as malformed as one that is too big
+    if size == 0 or size > BLOCK_SIZE:
+        raise ProtocolError(f"Block of {size} bytes is not between 1 and {BLOCK_SIZE} bytes")
+    if limit is not None and size > limit:
+        raise ValueError(f"Block of {size} bytes is longer than the {limit} bytes left")
+    if wireSize > size:
+        raise ValueError(f"Block of {size} bytes is {wireSize} bytes on the wire")
+    payload = readExactly(wireSize)
+    if wireSize == size:
+        data = payload
+        cpu = 0.0
+    else:
+        start = time.thread_time()
+        data = codec.decompress(payload, size)
+        cpu = time.thread_time() - start
+        if len(data) != size:
+            raise ValueError(f"Block decompressed to {len(data)} bytes instead of {size}")
+    if stats is not None:
+        stats.add(size, BLOCK_HEADER.size + wireSize, cpu)
+    return data
+
+
+class CompressionStats:
+    '''Counts the bytes of a transfer before and after compression and the CPU time spent on it.'''
+    __slots__ = ("codec", "dataBytes", "wireBytes", "cpuTime")
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.dataBytes = 0
+        self.wireBytes = 0
+        self.cpuTime = 0.0
+
+    def add(self, dataBytes, wireBytes, cpuTime):
+        self.dataBytes += dataBytes
+        self.wireBytes += wireBytes
+        self.cpuTime += cpuTime
+
+    def ratio(self):
+        return self.wireBytes / self.dataBytes if self.dataBytes else 1.0
+
+    def __str__(self):
+        return (f"{self.codec.name}: {self.dataBytes} bytes as {self.wireBytes} on the wire "
+                f"(ratio {self.ratio():.2f}), {self.cpuTime:.3f} s CPU")